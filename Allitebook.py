@@ -1,10 +1,28 @@
+import argparse
+import collections
+import multiprocessing
 import os
 import re
 import signal
+import sys
+import threading
+import time
+import urllib2
 from io import OpenWrapper
+from multiprocessing.pool import ThreadPool
 
 from lib import BookInfoExtracter
-from lib.Config import Config
+from lib import ListingParser
+from lib.Blacklist import Blacklist
+from lib.BlobStore import BlobStore
+from lib.Catalog import Catalog
+from lib.Config import ProgressStore
+from lib.FileWriter import FileWriter
+from lib.Manifest import Manifest
+from lib.Metrics import Metrics
+from lib.PageLeases import PageLeases
+from lib.Pipeline import Pipeline
+from lib.utils import async_web
 from lib.utils import web
 from lib.utils import file_tools
 from lib.utils import interrupt
@@ -12,7 +30,8 @@ from lib.utils import interrupt
 
 class AllitebookDownloader(object):
 
-    def __init__(self, homepage):
+    def __init__(self, homepage, workers=1, extract_workers=1, listing_workers=1, queue_depth=8,
+                 stream_book_pages=False, dedupe=False, summary_files=False):
         """
         A class for downloading books from www.allitebooks.com
 
@@ -21,29 +40,55 @@ class AllitebookDownloader(object):
 
         Args:
             homepage (str): link to the homepage of the website
+            workers (int, optional): number of PDF files downloaded at the same time, defaults to 1
+            extract_workers (int, optional): number of book pages processed at the same time,
+                defaults to 1
+            listing_workers (int, optional): number of listing pages retrieved at the same time,
+                defaults to 1
+            queue_depth (int, optional): maximum books waiting in front of each stage, defaults
+                to 8
+            stream_book_pages (bool, optional): stop reading book pages once the book
+                information is found or not, defaults to False
+            dedupe (bool, optional): keep identical PDF files once and link the books to
+                them or not, defaults to False
+            summary_files (bool, optional): also write the summary of every book to a text
+                file next to its PDF file or not, defaults to False
 
         Returns:
             AllitebookDownloader: an instance of the class to download books from
                 www.allitebooks.com
         """
+        self.workers = max(1, workers)
+        self.extract_workers = max(1, extract_workers)
+        self.listing_workers = max(1, listing_workers)
+        self.queue_depth = max(1, queue_depth)
+        self.stream_book_pages = stream_book_pages
+        self.summary_files = summary_files
+        self.listing_parse_stats = {'pages': 0, 'parse_time': 0.0, 'max_parse_time': 0.0}
+        self.listing_parse_stats_lock = threading.Lock()
+        self.is_page_held = None
         self.config = self._initialize_config()
         self.blacklist = self._initialize_blacklist()
+        self.manifest = Manifest.Manifest('Allitebook.manifest')
+        self.catalog = Catalog.Catalog('Allitebook.catalog')
+        self.blob_store = BlobStore.BlobStore('allitebook/.blobs') if dedupe else None
         self.total_number_of_pages = self._get_adjusted_total_pages(homepage)
         signal.signal(signal.SIGINT, self._save_progress)
 
     def _initialize_config(self):
         """
-        Load the configuration file
+        Load the progress store
 
-        Load the configuration file ('Allitebook.ini') if possible.  Otherwise, create
-        one with the default value if it doesn't already exists.
+        Load the progress store ('Allitebook.progress') if possible.  Otherwise, create one
+        with the values of the old configuration file ('Allitebook.ini') if there is one, or
+        with the default values.  Every change to the store is committed right away.
 
         Args:
 
         Returns:
-            Config: instance of the config class containing the config values
+            ProgressStore: instance of the progress store containing the config values
         """
-        config = Config.Config('Allitebook.ini')
+        config = ProgressStore.ProgressStore('Allitebook.progress', legacy_filename='Allitebook.ini')
         config.set_default_value('url', None)
         config.set_default_value('query', None)
         config.set_default_value('current_pages', 0)
@@ -54,27 +99,22 @@ class AllitebookDownloader(object):
         """
         Load the blacklist
 
-        Populate self.blacklist with the content of 'blacklist.txt'; results in a list of
-        urls to be skipped.
+        Populate self.blacklist with the content of 'blacklist.txt'; results in a set of
+        urls and rules matching urls to be skipped, reloaded when the file changes.
 
         Args:
 
         Returns:
-            list: A list of urls to be skipped
+            Blacklist: the urls to be skipped
         """
-        blacklist = []
-        if os.path.exists('blacklist.txt'):
-            with open('blacklist.txt') as blacklist_file_handler:
-                file_content = blacklist_file_handler.readlines()
-                blacklist = map(str.strip, file_content)
-        return blacklist
+        return Blacklist.Blacklist('blacklist.txt')
 
     def _save_progress(self, *args):
         """
         Save the current progress and terminate the program
 
         Temporarily block the KeyboardInterrupt signal (Ctrl-C), save the config values to
-        the configuration file, and terminate the program.
+        the progress store, and terminate the program.
 
         Args:
             *args: normally signum and frame, but might also have no value
@@ -97,7 +137,9 @@ class AllitebookDownloader(object):
 
         Extract the total number of pages of books from the website, so that we can
         start from the end.  Adjust the value based on progress already made (done by
-        subtracting the pages completed from the current last page).
+        subtracting the pages completed from the current last page).  The current page is
+        rebased on the new total in the same transaction, so that the saved progress stays
+        consistent whenever the program stops.
 
         Args:
             homepage (str): link to the homepage of a website
@@ -113,11 +155,11 @@ class AllitebookDownloader(object):
 
         total_pages = int(total_pages_match.group(1))
         adjusted_pages_count = total_pages - self.config.get('total_pages') + self.config.get('current_pages')
-        self.config.set('total_pages', total_pages)
+        self.config.set_many({'total_pages': total_pages, 'current_pages': adjusted_pages_count})
 
         return adjusted_pages_count
 
-    def _retrieve_book_info(self, book_link):
+    def _retrieve_book_info(self, book_link, page_content=None):
         """
         Retrieve the book category, pdf downlooad link, and book excerpt
 
@@ -127,6 +169,8 @@ class AllitebookDownloader(object):
 
         Args:
             book_link (str): the link for a particular book
+            page_content (str, optional): the already retrieved source of the book page,
+                defaults to None (retrieve it from book_link)
 
         Returns:
             tuple: category of the book, download link, and book excerpt
@@ -135,14 +179,66 @@ class AllitebookDownloader(object):
             AssertionError: Occurs when the condition asserted is False, should never happen
         """
         try:
-            book_info_extracter = BookInfoExtracter.BookInfoExtracter(book_link)
+            book_info_extracter = BookInfoExtracter.BookInfoExtracter(book_link, page_content, self.stream_book_pages)
             category, pdf_download_link, summary = book_info_extracter.get_book_info()
             return category, pdf_download_link, summary
         except AssertionError:
             self._save_progress()
             raise
 
-    def get_list_of_books_page(self, page):
+    def _parse_list_of_books_page(self, page_content):
+        """
+        Extract the links leading to each book from the source of a listing page
+
+        The links are extracted lazily, one at a time, and the time spent parsing the page
+        is added to the listing parse stats.
+
+        Args:
+            page_content (str): the source of the listing page
+
+        Returns:
+            generator: the links in the order they are listed on the page (newest first)
+
+        Raises:
+            AssertionError: Occurs when the page lists no book, should never happen
+        """
+        listing_parser = ListingParser.ListingParser(page_content)
+        try:
+            for book_page in listing_parser:
+                yield book_page
+            assert_message = 'Marker for finding book section not found!'
+            interrupt.assert_extended(listing_parser.book_page_count > 0, assert_message, self._save_progress)
+        finally:
+            self._record_listing_parse_time(listing_parser.parse_time)
+
+    def _record_listing_parse_time(self, parse_time):
+        Metrics.metrics.observe('listing_parse_seconds', parse_time)
+        with self.listing_parse_stats_lock:
+            self.listing_parse_stats['pages'] += 1
+            self.listing_parse_stats['parse_time'] += parse_time
+            self.listing_parse_stats['max_parse_time'] = max(self.listing_parse_stats['max_parse_time'], parse_time)
+
+    def get_listing_parse_stats(self):
+        """
+        Get the time spent parsing listing pages so far
+
+        Args:
+
+        Returns:
+            dict: the number of pages parsed, and the total and longest parse_time of a page
+                in seconds
+        """
+        with self.listing_parse_stats_lock:
+            return dict(self.listing_parse_stats)
+
+    def _print_listing_parse_stats(self):
+        listing_parse_stats = self.get_listing_parse_stats()
+        if listing_parse_stats['pages']:
+            print 'Parsed {0} listing pages, {1:.2f} ms per page (longest {2:.2f} ms)'.format(
+                listing_parse_stats['pages'], 1000 * listing_parse_stats['parse_time'] / listing_parse_stats['pages'],
+                1000 * listing_parse_stats['max_parse_time'])
+
+    def get_list_of_books_page(self, page, page_content=None):
         """
         Retrieve a list of books page
 
@@ -152,30 +248,16 @@ class AllitebookDownloader(object):
 
         Args:
             page (str): link listing a set of books
+            page_content (str, optional): the already retrieved source of the page, defaults to
+                None (retrieve it from page)
 
         Returns:
             list: a list of links each of which leads to a webpage for a particular book
         """
-        HTML_LINK_TAG = '<a href="'
-        BOOK_SECTION_MARKER = '"entry-title"'
-
-        list_of_books_page = []
-        page_content = web.get_source(page)
-
-        book_section_pattern = re.compile(BOOK_SECTION_MARKER)
-        book_section_match = book_section_pattern.search(page_content)
-        book_section_assert_message = 'Marker for finding book section not found!'
-        book_page_assert_message = 'Marker for finding book link not found!'
-
-        book_page_pattern = re.compile('<a href="(.+?)"')
-        while interrupt.assert_extended(book_section_match is not None, book_section_assert_message, self._save_progress):
-            book_section_start_index = book_section_match.start()
-            book_page_match = book_page_pattern.search(page_content, marker_index)
-
-            interrupt.assert_extended(book_page_match is not None, book_page_assert_message, self._save_progress)
-            link = str(book_page_match.group(1))
-            list_of_books_page.append(link)
-            book_section_match = book_section_pattern.search(page_content, book_page_match.end())
+        with Metrics.metrics.time('stage_seconds', stage='listing'):
+            if page_content is None:
+                page_content = web.get_source(page)
+            list_of_books_page = list(self._parse_list_of_books_page(page_content))
 
         list_of_books_page.reverse()
         try:
@@ -191,7 +273,8 @@ class AllitebookDownloader(object):
 
         Use the category as the base directory path and join it with the properly encoded
         filename. If the category is made up of a single directory name, the file would be
-        dumped in the general section inside the given category.
+        dumped in the general section inside the given category.  The directory is created
+        if needed, once per run.
 
         Args:
             category (str): the directory path the file would be dumped into
@@ -206,12 +289,96 @@ class AllitebookDownloader(object):
             directory_path = os.path.join(base_directory, 'general')
 
         filename = pdf_link[pdf_link.rfind('/') + 1:]
-        file_tools.assure_directory_path_exists(directory_path)
+        FileWriter.file_writer.ensure_directory(directory_path)
 
         raw_encoded_full_path = os.path.join(directory_path, filename)
         proper_encoded_full_path = raw_encoded_full_path.replace(' ', '_')
         return proper_encoded_full_path
 
+    def download_book(self, book_link):
+        """
+        Extract relevant information and download the file
+
+        Extract the book category, the PDF download link, and book summary from the given page
+        and download the file using the extracted PDF download link.
+
+        Args:
+            book_link (str): the link for a particular book
+
+        Returns:
+            tuple: the book link, PDF download link, path to save the file to, path of the part
+                file holding the downloaded file (None if the download failed), book excerpt,
+                and category of the book
+        """
+        category, pdf_download_link, summary = self._retrieve_book_info(book_link)
+        book_filename = self.get_path_to_save_file(category, pdf_download_link)
+        part_filename = web.download_to_part_file(pdf_download_link, book_filename)
+        return book_link, pdf_download_link, book_filename, part_filename, summary, category
+
+    def save_book(self, downloaded_book, move_cursor=True, content_digest=None):
+        """
+        Save a downloaded book to its proper destination
+
+        Commit the downloaded PDF file, record the book in the manifest and its summary in the
+        catalog, then move the progress cursor to the given book.  If summary files are
+        enabled, the summary is also written next to the PDF file.  Files are written to part
+        files first and renamed, so they are never left half written, and synced following the
+        fsync policy of the file writer.  If the digest of
+        the PDF file is given, the file goes through the blob store and the book is linked to
+        its content instead.  Must be run from the main thread, in the order the books are
+        listed.
+
+        Args:
+            downloaded_book (tuple): the value returned by download_book
+            move_cursor (bool, optional): move the progress cursor to the book or not, defaults
+                to True
+            content_digest (ContentDigest, optional): the digest computed while the PDF file
+                was downloaded, defaults to None
+
+        Returns:
+
+        """
+        book_link, pdf_download_link, book_filename, part_filename, summary, category = downloaded_book
+        if part_filename is not None:
+            with interrupt.KeyboardInterruptBlocked(), Metrics.metrics.time('stage_seconds', stage='save'):
+                if self.summary_files:
+                    summary_filename = book_filename[:book_filename.rfind('.pdf')] + '.txt'
+                    with OpenWrapper(file_tools.get_part_filename(summary_filename), 'w', encoding='utf-8') as file_:
+                        file_.write(summary)
+                        FileWriter.file_writer.finish(file_)
+                    FileWriter.file_writer.commit(summary_filename)
+                if content_digest is not None:
+                    if self.blob_store.commit(part_filename, book_filename, content_digest):
+                        Metrics.metrics.increment('duplicate_books_total')
+                    FileWriter.file_writer.record_commit(book_filename)
+                else:
+                    FileWriter.file_writer.commit(book_filename)
+                book_size = os.path.getsize(book_filename)
+                self.catalog.record(book_link, pdf_download_link, book_filename, category, summary)
+                self.manifest.record(book_link, pdf_download_link, book_filename, book_size, 'downloaded')
+                if move_cursor:
+                    self.config.set('url', book_link)
+            Metrics.metrics.increment('books_total', status='downloaded')
+            Metrics.metrics.increment('book_bytes_total', book_size)
+        else:
+            self.manifest.record(book_link, pdf_download_link, book_filename, None, 'failed')
+            Metrics.metrics.increment('books_total', status='failed')
+
+    def is_skipped(self, book_page):
+        """
+        Check whether a book should be skipped without retrieving anything
+
+        A book is skipped if it is blacklisted or if the manifest says it was already
+        downloaded.
+
+        Args:
+            book_page (str): the link for a particular book
+
+        Returns:
+            bool: whether the book should be skipped or not
+        """
+        return book_page in self.blacklist or self.manifest.is_downloaded(book_page)
+
     def process_book_link(self, book_link):
         """
         Extract relevant information, download the file, and save it to proper destination
@@ -226,18 +393,267 @@ class AllitebookDownloader(object):
         Returns:
 
         """
-        category, pdf_download_link, summary = self._retrieve_book_info(book_link)
-        pdf_file_content = web.download_page(pdf_download_link)
-        book_filename = self.get_path_to_save_file(category, pdf_download_link)
-        summary_filename = book_filename[:book_filename.rfind('.pdf')] + '.txt'
+        self.save_book(self.download_book(book_link))
 
-        if pdf_file_content is not None:
-            with interrupt.KeyboardInterruptBlocked():
-                with open(book_filename, 'a') as file_:
-                    file_.write(pdf_file_content)
-                with OpenWrapper(summary_filename, 'a', encoding='utf-8') as file_:
-                    file_.write(summary)
-                self.config.set('url', book_link)
+    def _run_extract_stage(self, book):
+        """
+        Pipeline stage extracting the information of a book
+
+        A book page that cannot be retrieved, even after retrying, is logged and the book
+        goes on without a PDF download link, to be recorded as failed.
+
+        Args:
+            book (dict): the book going through the pipeline
+
+        Returns:
+            dict: the book with the path to save the file to, the PDF download link, the book
+                excerpt, and the category added
+        """
+        if book['book_page'] is not None:
+            try:
+                with Metrics.metrics.time('stage_seconds', stage='extract'):
+                    category, pdf_download_link, summary = self._retrieve_book_info(book['book_page'])
+            except urllib2.URLError as url_error:
+                web.log_download_error(url_error, book['book_page'], stage='extract')
+                book.update(book_filename=None, pdf_download_link=None, summary=None, category=None)
+                return book
+            book['book_filename'] = self.get_path_to_save_file(category, pdf_download_link)
+            book['pdf_download_link'] = pdf_download_link
+            book['summary'] = summary
+            book['category'] = category
+        return book
+
+    def _run_download_stage(self, book):
+        """
+        Pipeline stage downloading the PDF file of a book to its part file
+
+        The PDF file of a book whose page was handed to another worker is left alone.
+
+        Args:
+            book (dict): the book going through the pipeline
+
+        Returns:
+            dict: the book with the path of the part file added (None if the download failed)
+        """
+        book['part_filename'] = None
+        book['content_digest'] = None
+        if self._is_page_lost(book['page_number']):
+            book['is_lost'] = True
+            return book
+        if book['book_page'] is not None and book['pdf_download_link'] is not None:
+            if self.blob_store is not None:
+                book['content_digest'] = self.blob_store.create_content_digest()
+            with Metrics.metrics.time('stage_seconds', stage='download'):
+                book['part_filename'] = web.download_to_part_file(book['pdf_download_link'], book['book_filename'],
+                                                                  content_digest=book['content_digest'])
+        return book
+
+    def _iter_listing_pages(self):
+        """
+        Retrieve the listing pages from the last to the first, ahead of time
+
+        Listing pages are retrieved by a pool of listing workers, a few pages ahead of the
+        one being handed out.
+
+        Args:
+
+        Returns:
+            generator: the page number and the books to download on it, in the order they were
+                added to the site
+        """
+        listing_pool = ThreadPool(self.listing_workers)
+        page_numbers = iter(xrange(self.total_number_of_pages, 0, -1))
+        pending_listing_pages = collections.deque()
+        try:
+            while True:
+                while len(pending_listing_pages) < 2 * self.listing_workers:
+                    page_number = next(page_numbers, None)
+                    if page_number is None:
+                        break
+                    page = 'http://www.allitebooks.com/page/{0}/'.format(page_number)
+                    list_result = listing_pool.apply_async(self.get_list_of_books_page, (page,))
+                    pending_listing_pages.append((page_number, list_result))
+                if not pending_listing_pages:
+                    return
+
+                page_number, list_result = pending_listing_pages.popleft()
+                yield page_number, [book_page for book_page in list_result.get() if not self.is_skipped(book_page)]
+        finally:
+            listing_pool.terminate()
+
+    def _iter_new_listing_pages(self):
+        """
+        Retrieve the listing pages from the first one until an already downloaded book is found
+
+        Books the manifest records as failed or pending are handed out first.  Pages are then
+        retrieved one at a time, since the walk usually stops on the first one, and handed out
+        as soon as they are parsed.  Their new books are recorded as pending in the manifest
+        before, so that if the sync is interrupted the next one hands them out again even
+        though the walk stops before them.
+
+        Args:
+
+        Returns:
+            generator: the page number (None for the unfinished books) and the books to
+                download, the oldest first on each page
+        """
+        unfinished_books = [book_page for book_page in self.manifest.get_unfinished()
+                            if book_page not in self.blacklist]
+        if unfinished_books:
+            yield None, unfinished_books
+        unfinished_books = set(unfinished_books)
+
+        for page_number in xrange(1, self.total_number_of_pages + 1):
+            page = 'http://www.allitebooks.com/page/{0}/'.format(page_number)
+            new_books = []
+            is_downloaded_book_found = False
+            with Metrics.metrics.time('stage_seconds', stage='listing'):
+                book_pages = list(self._parse_list_of_books_page(web.get_source(page)))
+            for book_page in book_pages:
+                if self.manifest.is_downloaded(book_page):
+                    is_downloaded_book_found = True
+                    break
+                if book_page not in self.blacklist and book_page not in unfinished_books:
+                    new_books.append(book_page)
+            self.manifest.record_pending(new_books)
+            yield page_number, new_books[::-1]
+            if is_downloaded_book_found:
+                return
+
+    def _iter_leased_listing_pages(self, page_leases, total_pages):
+        """
+        Retrieve the listing pages of the ranges claimed from the page leases
+
+        Ranges are claimed one at a time until every range is done.  While the remaining
+        ranges are leased by other workers, wait for them to finish or for their leases to
+        expire.  A range whose lease was lost is left to the worker that claimed it since.
+
+        Args:
+            page_leases (PageLeases): the leases shared by the workers
+            total_pages (int): the number of listing pages of the site
+
+        Returns:
+            generator: the page number and the books to download on it, in the order they were
+                added to the site
+        """
+        while True:
+            lease = page_leases.claim()
+            if lease is None:
+                if not page_leases.has_unfinished():
+                    return
+                time.sleep(min(1.0, page_leases.lease_duration / 4.0))
+                continue
+            next_offset, last_offset = lease
+            for offset in xrange(next_offset, last_offset + 1):
+                if not page_leases.holds(offset):
+                    break
+                page_number = total_pages - offset
+                if page_number < 1:
+                    yield page_number, []
+                    continue
+                page = 'http://www.allitebooks.com/page/{0}/'.format(page_number)
+                yield page_number, [book_page for book_page in self.get_list_of_books_page(page)
+                                    if not self.is_skipped(book_page)]
+
+    def _is_page_lost(self, page_number):
+        """
+        Check whether the given page was handed to another worker since it was retrieved
+
+        Args:
+            page_number (int): the number of the listing page, None for books on no page
+
+        Returns:
+            bool: whether the page is not held anymore or not
+        """
+        return self.is_page_held is not None and page_number is not None and not self.is_page_held(page_number)
+
+    def _feed_pipeline(self, pipeline, window, iter_listing_pages):
+        """
+        Feed the books of the listing pages to the pipeline
+
+        Books are fed in the order given by iter_listing_pages, each one taking a numbered
+        position followed by one marker for the end of its page.  Every position needs a slot
+        of the window, which is given back once it has been saved, so that at most a window's
+        worth of books is ever in progress.  The rest of a page that is lost to another worker
+        is not fed.
+
+        Args:
+            pipeline (Pipeline): the pipeline to feed
+            window (Semaphore): limits the number of books in progress
+            iter_listing_pages (func): yields the page numbers and their books
+
+        Returns:
+
+        """
+        listing_pages = iter_listing_pages()
+        try:
+            position = 0
+            for page_number, list_of_books_page in listing_pages:
+                for book_page in list_of_books_page + [None]:
+                    if book_page is not None and self._is_page_lost(page_number):
+                        continue
+                    window.acquire()
+                    pipeline.put({'position': position, 'page_number': page_number, 'book_page': book_page})
+                    position += 1
+            pipeline.close()
+        except Exception:
+            pipeline.abort(sys.exc_info())
+        finally:
+            listing_pages.close()
+
+    def _run_pipeline(self, iter_listing_pages, move_cursor, on_page_saved=None, is_page_held=None):
+        """
+        Download the books of the listing pages through the pipeline
+
+        Listing pages, book pages, and PDF files are handled by separate stages connected by
+        bounded queues, and the books are saved by this thread in the order they are listed,
+        so the progress cursor only moves forward once every earlier book is done.
+
+        Args:
+            iter_listing_pages (func): yields the page numbers and their books
+            move_cursor (bool): move the progress cursor as books and pages are saved or not
+            on_page_saved (func, optional): called with the page number once every book of a
+                page is saved, defaults to None
+            is_page_held (func, optional): called with a page number, tells whether this
+                process may still work on the page; the books of a page that is not held are
+                neither fed, downloaded, nor saved, defaults to None (every page is held)
+
+        Returns:
+
+        """
+        self.is_page_held = is_page_held
+        pipeline = Pipeline.Pipeline([Pipeline.Stage('extract', self._run_extract_stage, self.extract_workers),
+                                      Pipeline.Stage('download', self._run_download_stage, self.workers)],
+                                     self.queue_depth)
+        window = threading.Semaphore(2 * self.queue_depth + self.extract_workers + self.workers)
+        feeder = threading.Thread(target=self._feed_pipeline, args=(pipeline.start(), window, iter_listing_pages),
+                                  name='listing')
+        feeder.daemon = True
+        feeder.start()
+
+        next_position = 0
+        finished_books = {}
+        for book in pipeline.results():
+            finished_books[book['position']] = book
+            while next_position in finished_books:
+                book = finished_books.pop(next_position)
+                next_position += 1
+                window.release()
+                if book['book_page'] is None:
+                    if self._is_page_lost(book['page_number']):
+                        continue
+                    if move_cursor:
+                        with interrupt.KeyboardInterruptBlocked():
+                            self.config.set('current_pages', book['page_number'])
+                    if on_page_saved is not None:
+                        on_page_saved(book['page_number'])
+                    continue
+                if book.get('is_lost') or self._is_page_lost(book['page_number']):
+                    continue
+                print book['book_page']
+                self.save_book((book['book_page'], book['pdf_download_link'], book['book_filename'],
+                                book['part_filename'], book['summary'], book['category']), move_cursor,
+                               book['content_digest'])
 
     def start(self):
         """
@@ -251,25 +667,479 @@ class AllitebookDownloader(object):
         Returns:
 
         """
-        for page_number in xrange(self.total_number_of_pages, 0, -1):
-            page = 'http://www.allitebooks.com/page/{0}/'.format(page_number)
-            list_of_books_page = self.get_list_of_books_page(page)
-            for book_page in list_of_books_page:
-                if book_page in self.blacklist:
-                    continue
-                print book_page
-                self.process_book_link(book_page)
-            self.config.set('current_pages', page_number)
+        self._run_pipeline(self._iter_listing_pages, move_cursor=True)
         print 'Done!'
+        self._print_listing_parse_stats()
         self._save_progress()
 
+    def sync(self):
+        """
+        Download the books added since the last run
+
+        Retry the books that failed or were left unfinished before, then start from the
+        first page and count upward until the first book that was already downloaded,
+        downloading the books found along the way.  The progress cursor of start is left
+        alone.  If the manifest holds no downloaded book, every book would count as new, so
+        start is run instead: it resumes from the progress cursor and fills the manifest.
+
+        Args:
+
+        Returns:
+
+        """
+        if not self.manifest.has_downloaded():
+            print 'No downloaded book in the manifest, resuming the whole crawl instead...'
+            self.start()
+            return
+        self._run_pipeline(self._iter_new_listing_pages, move_cursor=False)
+        print 'Done!'
+        self._print_listing_parse_stats()
+        self._save_progress()
+
+    def start_shard(self, page_leases):
+        """
+        Download the books of the page ranges claimed from the page leases
+
+        Run as one of several worker processes sharing the same page leases: ranges of pages
+        are claimed and downloaded like start does, and each page is recorded in the leases
+        once every book on it is saved.  Work on a page stops as soon as its lease is lost,
+        leaving the page to the worker that claims it.  The progress cursor of start is left
+        alone, the leases keep the progress instead.
+
+        Args:
+            page_leases (PageLeases): the leases shared by the workers
+
+        Returns:
+
+        """
+        total_pages = self.config.get('total_pages')
+        page_leases.add_pages(total_pages)
+        page_leases.start_heartbeat()
+        try:
+            self._run_pipeline(lambda: self._iter_leased_listing_pages(page_leases, total_pages), move_cursor=False,
+                               on_page_saved=lambda page_number: page_leases.advance(total_pages - page_number),
+                               is_page_held=lambda page_number: page_leases.holds(total_pages - page_number))
+        finally:
+            page_leases.release()
+        print 'Done!'
+        self._print_listing_parse_stats()
+        self._save_progress()
+
+    def start_async(self, max_in_flight=100):
+        """
+        Start the whole process on a single thread
+
+        Same as start, but listing pages, book pages, and PDF files are all retrieved with
+        non-blocking requests, keeping up to max_in_flight of them running at once.
+
+        Args:
+            max_in_flight (int, optional): maximum requests running at once, defaults to 100
+
+        Returns:
+
+        """
+        AsyncCrawl(self, max_in_flight).run()
+        print 'Done!'
+        self._print_listing_parse_stats()
+        self._save_progress()
+
+
+class AsyncCrawl(object):
+
+    def __init__(self, allitebook_downloader, max_in_flight=100):
+        """
+        A single-threaded crawl driven by asynchronous requests
+
+        Pages are walked from the last to the first like AllitebookDownloader.start.  A few
+        listing pages are retrieved ahead of time, and every book on them is retrieved at once
+        (bounded by max_in_flight).  Books are saved in the order they are listed, so the
+        progress cursor only moves forward once every earlier book is done.  Requests failing
+        with transient errors are retried following the retry policy, and a book page that
+        still cannot be retrieved is logged and its book recorded as failed.
+
+        Args:
+            allitebook_downloader (AllitebookDownloader): the downloader to save books with
+            max_in_flight (int, optional): maximum requests running at once, defaults to 100
+
+        Returns:
+            AsyncCrawl: an instance of the class
+        """
+        self.downloader = allitebook_downloader
+        self.fetcher = async_web.AsyncFetcher(max_in_flight)
+        self.page_numbers = iter(xrange(allitebook_downloader.total_number_of_pages, 0, -1))
+        self.listing_lookahead = max(2, max_in_flight // 10)
+        self.pages = []
+
+    def _fetch_next_listing_page(self):
+        """
+        Queue the retrieval of the next listing page, if any
+
+        Args:
+
+        Returns:
+
+        """
+        page_number = next(self.page_numbers, None)
+        if page_number is None:
+            return
+        page = {'number': page_number, 'books': None, 'saved': 0}
+        self.pages.append(page)
+        link = 'http://www.allitebooks.com/page/{0}/'.format(page_number)
+        async_web.get_source(self.fetcher, link, lambda page_content: self._on_listing_page(page, link, page_content))
+
+    def _on_listing_page(self, page, link, page_content):
+        """
+        Queue the retrieval of every book on a listing page
+
+        Args:
+            page (dict): the page number, the slots for its books, and how many are saved
+            link (str): link to the listing page
+            page_content (str): the source of the listing page
+
+        Returns:
+
+        """
+        list_of_books_page = [book_page for book_page in self.downloader.get_list_of_books_page(link, page_content)
+                              if not self.downloader.is_skipped(book_page)]
+        page['books'] = [None] * len(list_of_books_page)
+        start_time = time.time()
+        for index, book_page in enumerate(list_of_books_page):
+            on_book_page = lambda book_content, index=index, book_page=book_page: \
+                self._on_book_page(page, index, book_page, book_content, start_time)
+            on_book_page_error = lambda url_error, index=index, book_page=book_page: \
+                self._on_book_page_error(page, index, book_page, url_error, start_time)
+            async_web.get_source(self.fetcher, book_page, on_book_page, on_book_page_error)
+        self._save_finished_books()
+
+    def _on_book_page(self, page, index, book_page, book_content, start_time):
+        """
+        Extract the book information and queue the retrieval of the PDF file
+
+        The time from queuing the book page to extracting its information, and then to
+        downloading the PDF file, is recorded like the extract and download stages of the
+        threaded engine.
+
+        Args:
+            page (dict): the page number, the slots for its books, and how many are saved
+            index (int): position of the book on the listing page
+            book_page (str): the link for the book
+            book_content (str): the source of the book page
+            start_time (float): when the retrieval of the book page was queued
+
+        Returns:
+
+        """
+        category, pdf_download_link, summary = self.downloader._retrieve_book_info(book_page, book_content)
+        book_filename = self.downloader.get_path_to_save_file(category, pdf_download_link)
+        download_start_time = time.time()
+        Metrics.metrics.observe('stage_seconds', download_start_time - start_time, stage='extract')
+
+        def on_pdf_file(part_filename):
+            Metrics.metrics.observe('stage_seconds', time.time() - download_start_time, stage='download')
+            page['books'][index] = (book_page, pdf_download_link, book_filename, part_filename, summary, category)
+            self._save_finished_books()
+        async_web.download_to_part_file(self.fetcher, pdf_download_link, book_filename, on_pdf_file)
+
+    def _on_book_page_error(self, page, index, book_page, url_error, start_time):
+        """
+        Log a book page that could not be retrieved, even after retrying, and record the book
+        as failed
+
+        Args:
+            page (dict): the page number, the slots for its books, and how many are saved
+            index (int): position of the book on the listing page
+            book_page (str): the link for the book
+            url_error (URLError): the error the last attempt failed with
+            start_time (float): when the retrieval of the book page was queued
+
+        Returns:
+
+        """
+        Metrics.metrics.observe('stage_seconds', time.time() - start_time, stage='extract')
+        web.log_download_error(url_error, book_page, stage='extract')
+        page['books'][index] = (book_page, None, None, None, None, None)
+        self._save_finished_books()
+
+    def _save_finished_books(self):
+        """
+        Save the downloaded books that every earlier book is done for
+
+        Save books in listing order, stopping at the first one that is still in progress.
+        Move on to the next listing page once every book on the current one is saved.
+
+        Args:
+
+        Returns:
+
+        """
+        while self.pages and self.pages[0]['books'] is not None:
+            page = self.pages[0]
+            books = page['books']
+            while page['saved'] < len(books) and books[page['saved']] is not None:
+                downloaded_book = books[page['saved']]
+                books[page['saved']] = True
+                page['saved'] += 1
+                print downloaded_book[0]
+                self.downloader.save_book(downloaded_book)
+            if page['saved'] < len(books):
+                return
+            with interrupt.KeyboardInterruptBlocked():
+                self.downloader.config.set('current_pages', page['number'])
+            self.pages.pop(0)
+            self._fetch_next_listing_page()
+
+    def run(self):
+        """
+        Run the crawl until every page is done
+
+        Args:
+
+        Returns:
+
+        """
+        for _ in xrange(self.listing_lookahead):
+            self._fetch_next_listing_page()
+        self.fetcher.run()
+
+
+def parse_arguments():
+    """
+    Parse the command line arguments
+
+    Returns:
+        argparse.Namespace: the parsed arguments
+    """
+    parser = argparse.ArgumentParser(description='Download books from www.allitebooks.com')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of PDF files to download at the same time (default: 1)')
+    parser.add_argument('--extract-workers', type=int, default=1,
+                        help='number of book pages to process at the same time (default: 1)')
+    parser.add_argument('--listing-workers', type=int, default=1,
+                        help='number of listing pages to retrieve at the same time (default: 1)')
+    parser.add_argument('--queue-depth', type=int, default=8,
+                        help='maximum books waiting in front of each stage (default: 8)')
+    parser.add_argument('--pool-size', type=int, default=4,
+                        help='maximum idle connections kept open per host (default: 4)')
+    parser.add_argument('--cache-dir',
+                        help='cache listing and book pages in this directory and revalidate them')
+    parser.add_argument('--cache-size', type=int, default=256,
+                        help='maximum size of the page cache in MB (default: 256)')
+    parser.add_argument('--stream-book-pages', action='store_true',
+                        help='stop reading each book page once the book information is found')
+    parser.add_argument('--dedupe', action='store_true',
+                        help='keep identical PDF files once and hardlink every book to its content')
+    parser.add_argument('--summary-files', action='store_true',
+                        help='also write the summary of every book to a .txt file next to its PDF file')
+    parser.add_argument('--fsync', default='none', choices=FileWriter.FSYNC_POLICIES,
+                        help='when saved files are synced to disk: never explicitly, as each one is saved, '
+                             'or every --fsync-interval seconds (default: none)')
+    parser.add_argument('--fsync-interval', type=float, default=5.0,
+                        help='seconds between syncs with --fsync periodic (default: 5)')
+    parser.add_argument('--search', metavar='QUERY',
+                        help='search the summaries, categories, and titles of the downloaded books and exit')
+    parser.add_argument('--search-limit', type=int, default=20,
+                        help='maximum number of books found by --search (default: 20)')
+    parser.add_argument('--sync', action='store_true',
+                        help='only download the books added since the last downloaded one')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='retrieve everything with non-blocking requests on a single thread')
+    parser.add_argument('--max-in-flight', type=int, default=100,
+                        help='maximum requests running at once with --async (default: 100)')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='number of worker processes splitting the listing pages between them (default: 1)')
+    parser.add_argument('--pages-per-lease', type=int, default=10,
+                        help='listing pages a shard claims at once (default: 10)')
+    parser.add_argument('--lease-duration', type=int, default=60,
+                        help='seconds after which the pages of a shard that stopped are claimed again (default: 60)')
+    parser.add_argument('--max-rate', type=float, default=100.0,
+                        help='maximum requests started per second per host, shared by the shards (default: 100)')
+    parser.add_argument('--max-host-concurrency', type=int, default=64,
+                        help='maximum requests running at once per host, shared by the shards (default: 64)')
+    parser.add_argument('--retries', type=int, default=5,
+                        help='times a request failing with a transient error is sent again (default: 5)')
+    parser.add_argument('--retry-backoff', type=float, default=1.0,
+                        help='seconds waited before the first retry, doubled for each one (default: 1)')
+    parser.add_argument('--log-level', default='WARNING',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'),
+                        help='lowest level of the messages written to web.log (default: WARNING)')
+    parser.add_argument('--async-logging', action='store_true',
+                        help='write web.log from a background thread in batches')
+    parser.add_argument('--metrics-json',
+                        help='write the metrics of the crawl to this JSON file periodically')
+    parser.add_argument('--metrics-prometheus',
+                        help='write the metrics of the crawl to this Prometheus textfile (.prom) periodically')
+    parser.add_argument('--metrics-interval', type=int, default=15,
+                        help='seconds between writes of the metrics files (default: 15)')
+    parser.add_argument('--show-rate-limits', action='store_true',
+                        help='print the limits each host ended up with once done')
+    arguments = parser.parse_args()
+    if arguments.shards > 1 and (arguments.sync or arguments.use_async):
+        parser.error('--shards cannot be combined with --sync or --async')
+    if arguments.dedupe and arguments.use_async:
+        parser.error('--dedupe cannot be combined with --async')
+    return arguments
+
+
+def search_catalog(query, limit=20):
+    """
+    Print the downloaded books matching the given query
+
+    Args:
+        query (str): the words to look for, in the FTS5 query syntax, encoded like the
+            command line arguments (or in UTF-8 if the locale cannot decode it)
+        limit (int, optional): maximum number of books printed, defaults to 20
+
+    Returns:
+
+    """
+    try:
+        query = query.decode(sys.getfilesystemencoding() or 'utf-8')
+    except UnicodeDecodeError:
+        query = query.decode('utf-8', 'replace')
+    start_time = time.time()
+    books = Catalog.Catalog('Allitebook.catalog').search(query, limit)
+    elapsed_time = time.time() - start_time
+    for book in books:
+        snippet = u' '.join(book['snippet'].split())
+        print u'{0[title]} ({0[category]})\n    {0[path]}\n    {1}'.format(book, snippet).encode('utf-8')
+    print '{0} books found in {1:.1f} ms'.format(len(books), 1000 * elapsed_time)
+
+
+def configure(arguments):
+    """
+    Configure the connections, logging, retries, rate limits, cache, and file writer
+
+    With several shards, the maximum rate and concurrency of each host are split between
+    them, so that together they stay within the limits.
+
+    Args:
+        arguments (argparse.Namespace): the parsed arguments
+
+    Returns:
+
+    """
+    shards = max(1, arguments.shards)
+    max_rate = arguments.max_rate / shards
+    max_host_concurrency = max(1, arguments.max_host_concurrency // shards)
+    web.configure_connection_pool(pool_size=arguments.pool_size)
+    FileWriter.file_writer.configure(arguments.fsync, arguments.fsync_interval)
+    web.web_logger.set_current_level(arguments.log_level)
+    if arguments.async_logging:
+        web.web_logger.start_async_writer()
+    web.configure_retry_policy(attempts=arguments.retries + 1, backoff=arguments.retry_backoff)
+    web.configure_rate_limiter(max_rate=max_rate, rate=min(10.0, max_rate),
+                               max_concurrency=max_host_concurrency,
+                               concurrency=min(4, max_host_concurrency))
+    if arguments.cache_dir:
+        web.enable_http_cache(arguments.cache_dir, max_size=arguments.cache_size * 1024 * 1024)
+
+
+def get_shard_filename(filename, shard):
+    """
+    Get the name of the file written by the given shard, keeping the extension
+
+    Args:
+        filename (str): the name of the file, None if it is not written
+        shard (int): the number of the shard, None if there are no shards
+
+    Returns:
+        str: the filename with the shard number before the extension, None if filename is None
+    """
+    if filename is None or shard is None:
+        return filename
+    root, extension = os.path.splitext(filename)
+    return '{0}.shard{1}{2}'.format(root, shard, extension)
+
+
+def run(arguments, shard=None):
+    """
+    Configure everything, download the books, and write the metrics
+
+    The log writer and the file writer are closed explicitly once done, since a shard
+    process exits without running the atexit handlers that close them otherwise.
+
+    Args:
+        arguments (argparse.Namespace): the parsed arguments
+        shard (int, optional): the number of the shard run by this process, defaults to None
+            (the only process)
+
+    Returns:
+
+    """
+    configure(arguments)
+    allitebook_downloader = AllitebookDownloader('http://www.allitebooks.com',
+                                                 workers=arguments.workers,
+                                                 extract_workers=arguments.extract_workers,
+                                                 listing_workers=arguments.listing_workers,
+                                                 queue_depth=arguments.queue_depth,
+                                                 stream_book_pages=arguments.stream_book_pages,
+                                                 dedupe=arguments.dedupe,
+                                                 summary_files=arguments.summary_files)
+    metrics_exporter = None
+    if arguments.metrics_json or arguments.metrics_prometheus:
+        metrics_exporter = Metrics.MetricsExporter(Metrics.metrics, get_shard_filename(arguments.metrics_json, shard),
+                                                   get_shard_filename(arguments.metrics_prometheus, shard),
+                                                   arguments.metrics_interval).start()
+    try:
+        if shard is not None:
+            allitebook_downloader.start_shard(PageLeases.PageLeases('Allitebook.leases', arguments.pages_per_lease,
+                                                                    arguments.lease_duration))
+        elif arguments.sync:
+            allitebook_downloader.sync()
+        elif arguments.use_async:
+            allitebook_downloader.start_async(arguments.max_in_flight)
+        else:
+            allitebook_downloader.start()
+    finally:
+        if metrics_exporter is not None:
+            metrics_exporter.stop()
+        web.web_logger.close()
+        FileWriter.file_writer.close()
+    if arguments.show_rate_limits:
+        for host, limits in sorted(web.get_rate_limits().items()):
+            print '{0}: {1[concurrency_limit]} at once, {1[rate]} requests/s'.format(host, limits)
+
+
+def run_shards(arguments):
+    """
+    Run one worker process per shard and wait for all of them
+
+    Each worker configures itself after it starts, so that no connection, thread, or
+    database handle is shared between processes.  The workers split the listing pages
+    through the page leases ('Allitebook.leases'); the pages of a worker that dies are
+    claimed by the others once its leases expire.
+
+    Args:
+        arguments (argparse.Namespace): the parsed arguments
+
+    Returns:
+        bool: whether every worker exited successfully or not
+    """
+    processes = [multiprocessing.Process(target=run, args=(arguments, shard), name='shard-{0}'.format(shard))
+                 for shard in xrange(arguments.shards)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
+    return all(process.exitcode == 0 for process in processes)
+
 
 def main():
     """
     Run the script
     """
-    allitebook_downloader = AllitebookDownloader('http://www.allitebooks.com')
-    allitebook_downloader.start()
+    arguments = parse_arguments()
+    if arguments.search is not None:
+        search_catalog(arguments.search, arguments.search_limit)
+    elif arguments.shards > 1:
+        if not run_shards(arguments):
+            raise SystemExit(1)
+    else:
+        run(arguments)
 
 if __name__ == '__main__':
     main()
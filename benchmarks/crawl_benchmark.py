@@ -0,0 +1,197 @@
+"""
+Measure a whole crawl against a local synthetic site
+
+Start the synthetic site in a separate process, route www.allitebooks.com and
+file.allitebooks.com to it, run AllitebookDownloader in a temporary directory, and
+report the books and megabytes downloaded per second, the peak memory, and the CPU time
+of the crawl (the server is not counted).
+
+Usage:
+    python benchmarks/crawl_benchmark.py [--workers N] [--async] [--latency S] ...
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import synthetic_site
+import Allitebook
+from lib.FileWriter import FileWriter
+from lib.PageLeases import PageLeases
+from lib.utils import web
+
+
+def serve_site(site, port_queue):
+    server = synthetic_site.SyntheticSiteServer(site)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_site_process(site):
+    """
+    Serve the site from a separate process, so that it does not count in the measurements
+
+    Args:
+        site (SyntheticSite): the site to serve
+
+    Returns:
+        tuple: the process and the port the site is served on
+    """
+    port_queue = multiprocessing.Queue()
+    site_process = multiprocessing.Process(target=serve_site, args=(site, port_queue))
+    site_process.daemon = True
+    site_process.start()
+    return site_process, port_queue.get(timeout=10)
+
+
+def get_downloaded_size(directory):
+    """
+    Get the size of the PDF files saved under the given directory
+
+    Args:
+        directory (str): the directory the books were saved to
+
+    Returns:
+        tuple: the number of PDF files and their total size in bytes
+    """
+    count = size = 0
+    for path, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.endswith('.pdf'):
+                count += 1
+                size += os.path.getsize(os.path.join(path, filename))
+    return count, size
+
+
+def get_usage():
+    """
+    Get the CPU time and the peak memory of this process and of the shards it waited for
+
+    The site process is still running, so it is not counted.
+
+    Returns:
+        tuple: the CPU time in seconds and the largest peak RSS of a process in KB
+    """
+    usages = [resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)]
+    return (sum(usage.ru_utime + usage.ru_stime for usage in usages),
+            max(usage.ru_maxrss for usage in usages))
+
+
+def run_crawl(arguments, shard=None):
+    """
+    Run the crawl in the current directory
+
+    Args:
+        arguments (argparse.Namespace): the parsed arguments
+        shard (int, optional): the number of the shard run by this process, defaults to None
+            (the only process)
+
+    Returns:
+
+    """
+    allitebook_downloader = Allitebook.AllitebookDownloader('http://www.allitebooks.com',
+                                                            workers=arguments.workers,
+                                                            extract_workers=arguments.extract_workers,
+                                                            listing_workers=arguments.listing_workers,
+                                                            queue_depth=arguments.queue_depth,
+                                                            stream_book_pages=arguments.stream_book_pages,
+                                                            dedupe=arguments.dedupe)
+    if shard is not None:
+        allitebook_downloader.start_shard(PageLeases.PageLeases('Allitebook.leases', arguments.pages_per_lease))
+    elif arguments.use_async:
+        allitebook_downloader.start_async(arguments.max_in_flight)
+    else:
+        allitebook_downloader.start()
+
+
+def run_sharded_crawl(arguments):
+    """
+    Run the crawl in the current directory with one worker process per shard
+
+    Args:
+        arguments (argparse.Namespace): the parsed arguments
+
+    Returns:
+
+    """
+    processes = [multiprocessing.Process(target=run_crawl, args=(arguments, shard))
+                 for shard in xrange(arguments.shards)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure a crawl against a local synthetic site')
+    synthetic_site.add_site_arguments(parser)
+    parser.add_argument('--workers', type=int, default=1, help='PDF files downloaded at once (default: 1)')
+    parser.add_argument('--extract-workers', type=int, default=1, help='book pages processed at once (default: 1)')
+    parser.add_argument('--listing-workers', type=int, default=1,
+                        help='listing pages retrieved at once (default: 1)')
+    parser.add_argument('--queue-depth', type=int, default=8, help='books waiting in front of each stage (default: 8)')
+    parser.add_argument('--pool-size', type=int, default=4, help='idle connections kept per host (default: 4)')
+    parser.add_argument('--max-rate', type=float, default=100.0,
+                        help='requests started per second per host at most (default: 100)')
+    parser.add_argument('--initial-rate', type=float, default=100.0,
+                        help='requests started per second per host at first (default: 100)')
+    parser.add_argument('--stream-book-pages', action='store_true', help='stop reading book pages early')
+    parser.add_argument('--dedupe', action='store_true', help='store identical PDF files once')
+    parser.add_argument('--fsync', default='none', choices=FileWriter.FSYNC_POLICIES,
+                        help='when saved files are synced to disk (default: none)')
+    parser.add_argument('--shards', type=int, default=1, help='worker processes splitting the pages (default: 1)')
+    parser.add_argument('--pages-per-lease', type=int, default=1,
+                        help='listing pages a shard claims at once (default: 1)')
+    parser.add_argument('--async', dest='use_async', action='store_true', help='use the asynchronous engine')
+    parser.add_argument('--max-in-flight', type=int, default=100, help='requests at once with --async (default: 100)')
+    parser.add_argument('--keep', action='store_true', help='keep the directory the books were saved to')
+    arguments = parser.parse_args()
+    if arguments.dedupe and arguments.use_async:
+        parser.error('--dedupe cannot be combined with --async')
+
+    site = synthetic_site.create_site(arguments)
+    site_process, port = start_site_process(site)
+    web.configure_connection_pool(pool_size=arguments.pool_size,
+                                  host_overrides={'www.allitebooks.com': ('127.0.0.1', port),
+                                                  synthetic_site.FILE_HOST: ('127.0.0.1', port)})
+    FileWriter.file_writer.configure(arguments.fsync)
+    web.configure_rate_limiter(rate=min(arguments.initial_rate, arguments.max_rate), max_rate=arguments.max_rate)
+
+    directory = tempfile.mkdtemp(prefix='allitebook-benchmark-')
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        usage_before = get_usage()
+        start_time = time.time()
+        if arguments.shards > 1:
+            run_sharded_crawl(arguments)
+        else:
+            run_crawl(arguments)
+        elapsed_time = time.time() - start_time
+        usage_after = get_usage()
+        book_count, downloaded_size = get_downloaded_size(directory)
+    finally:
+        os.chdir(working_directory)
+        site_process.terminate()
+        if arguments.keep:
+            print 'Books saved to {0}'.format(directory)
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    cpu_time = usage_after[0] - usage_before[0]
+    megabytes = downloaded_size / (1024.0 * 1024)
+    print 'books:    {0} of {1} in {2:.2f} s'.format(book_count, site.pages * site.books_per_page, elapsed_time)
+    print 'books/s:  {0:.2f}'.format(book_count / elapsed_time)
+    print 'MB/s:     {0:.2f} ({1:.1f} MB)'.format(megabytes / elapsed_time, megabytes)
+    print 'peak RSS: {0:.1f} MB'.format(usage_after[1] / 1024.0)
+    print 'CPU:      {0:.2f} s ({1:.0%} of one core)'.format(cpu_time, cpu_time / elapsed_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Measure the CPU time spent extracting the information of a book page
+
+Compare the single pass of BookInfoExtracter.get_book_info with the field by field
+search it falls back to, on saved book pages given on the command line or on a
+synthetic one.  Both must give the same results, which is also checked on a few pages
+with tricky summaries.
+
+Usage:
+    python benchmarks/extract_benchmark.py [--repeat N] [book_page.html ...]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lib import BookInfoExtracter
+
+
+def build_synthetic_page():
+    """
+    Build a page shaped like a book page of www.allitebooks.com
+
+    Returns:
+        str: the source of the page
+    """
+    navigation = ''.join('<li><a href="http://www.allitebooks.com/category-{0}/">Category {0}</a></li>\n'.format(index)
+                         for index in xrange(150))
+    description = ''.join('<p>Paragraph {0} of the description, with <b>markup</b> &amp; entities.</p>\n'.format(index)
+                          for index in xrange(20))
+    comments = ''.join('<li class="comment"><p>Comment {0}: thanks for sharing!</p></li>\n'.format(index)
+                       for index in xrange(200))
+    return ('<html><head><title>Book</title></head><body><ul class="menu">' + navigation + '</ul>'
+            '<article><dl><dt>Category:</dt><dd><a href="http://www.allitebooks.com/programming/python/" '
+            'rel="category">Python</a></dd></dl>'
+            '<span class="download-links"><a href="http://file.allitebooks.com/20170101/Book Title.pdf" '
+            'target="_blank">Download PDF</a></span>'
+            '<div class="entry-content"><h3>Book Description:</h3>' + description +
+            '<div class="book-footer"></div></div></article><ol class="comments">' + comments +
+            '</ol><footer>' + navigation + '</footer></body></html>')
+
+
+def build_regression_pages():
+    """
+    Build book pages whose summaries the single pass once got differently than the field by
+    field search
+
+    Returns:
+        list: the names and sources of the pages
+    """
+    descriptions = [('summary followed by a div', 'Plain summary.'),
+                    ('tag cut by the ending marker', '<p>Summary</p>\n<div'),
+                    ('whitespace between tags', '<p>One</p>\r\n\t<p>Two</p>\n\n<br> <br>'),
+                    ('entities', 'AT&T &amp; fish &amp chips &nbsp; &#8217; &#150; &foo; a < b > c'),
+                    ('apos entity', '<p>It&apos;s &APOS; plain</p>'),
+                    ('script and comment', '<script>var a = "<b>";</script><!-- c -->t<![CDATA[x]]>'),
+                    ('not utf-8', 'caf\xe9')]
+    return [(name, '<a href="http://www.allitebooks.com/databases/" rel="category">Databases</a>'
+                   '<a href="http://file.allitebooks.com/20170101/Book.pdf">Download PDF</a>'
+                   '<h3>Book Description:</h3>' + description + '<div class="book-footer"></div>')
+            for name, description in descriptions]
+
+
+def measure(function, repeat):
+    """
+    Get the CPU seconds taken by one call to the function, the best of repeat calls
+
+    Args:
+        function (func): the function to measure
+        repeat (int): number of calls
+
+    Returns:
+        float: the CPU seconds of the fastest call
+    """
+    timings = []
+    for _ in xrange(repeat):
+        start_time = time.clock()
+        function()
+        timings.append(time.clock() - start_time)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the extraction of book pages')
+    parser.add_argument('--repeat', type=int, default=200, help='calls measured per page (default: 200)')
+    parser.add_argument('pages', nargs='*', help='saved book pages (default: a synthetic page)')
+    arguments = parser.parse_args()
+
+    pages = [(page, open(page).read()) for page in arguments.pages] or [('synthetic', build_synthetic_page())]
+    for name, page_content in build_regression_pages():
+        extracter = BookInfoExtracter.BookInfoExtracter(name, page_content)
+        assert extracter.get_book_info() == extracter._get_book_info_by_field(), 'Results differ for ' + name
+    for name, page_content in pages:
+        extracter = BookInfoExtracter.BookInfoExtracter(name, page_content)
+        assert extracter.get_book_info() == extracter._get_book_info_by_field(), 'Results differ for ' + name
+        single_pass_time = measure(extracter.get_book_info, arguments.repeat)
+        by_field_time = measure(extracter._get_book_info_by_field, arguments.repeat)
+        print '{0} ({1} KB): single pass {2:.3f} ms, by field {3:.3f} ms, {4:.1f}x faster'.format(
+            name, len(page_content) // 1024, single_pass_time * 1000, by_field_time * 1000,
+            by_field_time / single_pass_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,279 @@
+"""
+A local HTTP server serving a synthetic site shaped like www.allitebooks.com
+
+The homepage has the "Last Page" marker, every listing page has entry-title links to
+book pages, every book page has a rel="category" link, a file.allitebooks.com link,
+and a description, and every PDF file has a size within the configured range.  Both
+hosts are served on the same port and told apart by the Host header.
+
+Usage:
+    python benchmarks/synthetic_site.py [--port N] [--pages N] [--latency S] ...
+"""
+import BaseHTTPServer
+import SocketServer
+import argparse
+import gzip
+import hashlib
+import re
+import StringIO
+import threading
+import time
+import urllib
+
+FILE_HOST = 'file.allitebooks.com'
+CATEGORIES = ('programming/python/', 'programming/java/', 'web-development/javascript/',
+              'databases/', 'networking/', 'operating-systems/linux/')
+_WRITE_CHUNK_SIZE = 16 * 1024
+_PDF_PATH_PATTERN = re.compile(r'/\d+/Book (\d+)-(\d+)\.pdf$')
+_BOOK_PATH_PATTERN = re.compile(r'/book-(\d+)-(\d+)/$')
+
+
+class SyntheticSite(object):
+
+    def __init__(self, pages=5, books_per_page=10, min_pdf_size=1024 * 1024, max_pdf_size=1024 * 1024,
+                 page_padding=32 * 1024, latency=0.0, bandwidth=None, compress=True):
+        """
+        The content and the behaviour of the synthetic site
+
+        Args:
+            pages (int, optional): number of listing pages, defaults to 5
+            books_per_page (int, optional): number of books on each listing page, defaults to 10
+            min_pdf_size (int, optional): smallest PDF file in bytes, defaults to 1 MB
+            max_pdf_size (int, optional): largest PDF file in bytes, defaults to 1 MB
+            page_padding (int, optional): bytes of sidebar, comments, and footer added after the
+                description of every book page, defaults to 32 KB
+            latency (float, optional): seconds waited before every response, defaults to 0
+            bandwidth (int, optional): bytes per second sent on each connection, defaults to
+                None (unlimited)
+            compress (bool, optional): gzip the html pages if the client accepts it or not,
+                defaults to True
+
+        Returns:
+            SyntheticSite: an instance of the class
+        """
+        self.pages = pages
+        self.books_per_page = books_per_page
+        self.min_pdf_size = min_pdf_size
+        self.max_pdf_size = max(min_pdf_size, max_pdf_size)
+        self.page_padding = page_padding
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.compress = compress
+        self.pdf_content = '%PDF-1.4\n' + 'x' * self.max_pdf_size
+
+    def get_pdf_size(self, page, index):
+        """
+        Get the size of the PDF file of a book, always the same for the same book
+
+        Args:
+            page (int): the listing page the book is on
+            index (int): the position of the book on the page
+
+        Returns:
+            int: the size in bytes
+        """
+        size_range = self.max_pdf_size - self.min_pdf_size
+        if not size_range:
+            return self.min_pdf_size
+        book_hash = int(hashlib.md5('{0}-{1}'.format(page, index)).hexdigest()[:8], 16)
+        return self.min_pdf_size + book_hash % (size_range + 1)
+
+    def get_total_pdf_size(self):
+        """
+        Get the size of all the PDF files of the site
+
+        Returns:
+            int: the size in bytes
+        """
+        return sum(self.get_pdf_size(page, index)
+                   for page in xrange(1, self.pages + 1) for index in xrange(self.books_per_page))
+
+    def render_homepage(self):
+        return ('<html><body><div class="pagination"><a class="last" href="http://www.allitebooks.com/page/{0}/" '
+                'title="Last Page &rarr;">{0}</a></div></body></html>').format(self.pages)
+
+    def render_listing_page(self, page):
+        entries = ''.join('<article><header><h2 class="entry-title"><a href="http://www.allitebooks.com/book-{0}-{1}/" '
+                          'rel="bookmark">Book {0}-{1}</a></h2></header><div class="entry-summary"><p>An excerpt of '
+                          'book {0}-{1}.</p></div></article>\n'.format(page, index)
+                          for index in xrange(self.books_per_page))
+        return '<html><body><main>' + entries + '</main></body></html>'
+
+    def render_book_page(self, page, index):
+        category = CATEGORIES[(page * self.books_per_page + index) % len(CATEGORIES)]
+        description = ''.join('<p>Paragraph {0} of the description of book {1}-{2} &amp; more.</p>\n'.format(
+            paragraph, page, index) for paragraph in xrange(5))
+        padding = '<aside class="sidebar">' + '<p>Related book, comment, or footer link.</p>\n' * (
+            self.page_padding // 44) + '</aside>'
+        return ('<html><body><article><dl><dt>Category:</dt><dd><a href="http://www.allitebooks.com/{0}" '
+                'rel="category">Category</a></dd></dl><span class="download-links"><a href="http://{1}/20170101/'
+                'Book {2}-{3}.pdf" target="_blank">Download PDF</a></span><div class="entry-content">'
+                '<h3>Book Description:</h3>{4}<div class="book-footer"></div></div></article>{5}'
+                '</body></html>').format(category, FILE_HOST, page, index, description, padding)
+
+
+class SyntheticSiteHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        site = self.server.site
+        if site.latency:
+            time.sleep(site.latency)
+        host = self.headers.get('Host', '').partition(':')[0]
+        path = urllib.unquote(self.path.partition('?')[0])
+
+        if host == FILE_HOST:
+            pdf_match = _PDF_PATH_PATTERN.match(path)
+            if pdf_match is None:
+                return self.send_body(404, 'text/html', 'Not Found')
+            size = site.get_pdf_size(int(pdf_match.group(1)), int(pdf_match.group(2)))
+            return self.send_pdf(site.pdf_content[:size])
+
+        book_match = _BOOK_PATH_PATTERN.match(path)
+        if path == '/':
+            body = site.render_homepage()
+        elif path.startswith('/page/') and path[len('/page/'):].strip('/').isdigit():
+            body = site.render_listing_page(int(path[len('/page/'):].strip('/')))
+        elif book_match is not None:
+            body = site.render_book_page(int(book_match.group(1)), int(book_match.group(2)))
+        else:
+            return self.send_body(404, 'text/html', 'Not Found')
+        self.send_body(200, 'text/html', body, compress=site.compress)
+
+    def send_pdf(self, body):
+        start = 0
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes=') and range_header.endswith('-'):
+            start = int(range_header[len('bytes='):-1])
+        etag = '"{0}"'.format(len(body))
+        if start and self.headers.get('If-Range', etag) != etag:
+            start = 0
+        if start >= len(body) > 0:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */{0}'.format(len(body)))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        headers = {'ETag': etag}
+        if start:
+            headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, len(body) - 1, len(body))
+        self.send_body(206 if start else 200, 'application/pdf', body[start:], headers=headers)
+
+    def send_body(self, code, content_type, body, compress=False, headers=None):
+        if compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            buffer_ = StringIO.StringIO()
+            with gzip.GzipFile(fileobj=buffer_, mode='wb', compresslevel=6) as gzip_file:
+                gzip_file.write(body)
+            body = buffer_.getvalue()
+            headers = dict(headers or {}, **{'Content-Encoding': 'gzip'})
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.write_throttled(body)
+
+    def write_throttled(self, body):
+        bandwidth = self.server.site.bandwidth
+        if not bandwidth:
+            self.wfile.write(body)
+            return
+        for offset in xrange(0, len(body), _WRITE_CHUNK_SIZE):
+            chunk = body[offset:offset + _WRITE_CHUNK_SIZE]
+            self.wfile.write(chunk)
+            self.wfile.flush()
+            time.sleep(float(len(chunk)) / bandwidth)
+
+
+class SyntheticSiteServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, site, port=0):
+        """
+        A threaded HTTP server serving the given site on localhost
+
+        Args:
+            site (SyntheticSite): the site to serve
+            port (int, optional): the port to listen on, defaults to 0 (any free port)
+
+        Returns:
+            SyntheticSiteServer: an instance of the class
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), SyntheticSiteHandler)
+        self.site = site
+
+    def start(self):
+        """
+        Serve requests on a daemon thread
+
+        Returns:
+            SyntheticSiteServer: the server itself
+        """
+        thread = threading.Thread(target=self.serve_forever, name='synthetic-site')
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+def add_site_arguments(parser):
+    """
+    Add the options of the synthetic site to an argument parser
+
+    Args:
+        parser (argparse.ArgumentParser): the parser
+
+    Returns:
+
+    """
+    parser.add_argument('--pages', type=int, default=5, help='number of listing pages (default: 5)')
+    parser.add_argument('--books-per-page', type=int, default=10, help='books on each listing page (default: 10)')
+    parser.add_argument('--pdf-size', default='1024',
+                        help='size of the PDF files in KB, or a MIN-MAX range (default: 1024)')
+    parser.add_argument('--page-padding', type=int, default=32,
+                        help='KB of sidebar and comments on every book page (default: 32)')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds waited before every response (default: 0)')
+    parser.add_argument('--bandwidth', type=float, default=0,
+                        help='MB/s sent on each connection (default: unlimited)')
+    parser.add_argument('--no-compression', dest='compress', action='store_false',
+                        help='do not gzip the html pages')
+
+
+def create_site(arguments):
+    """
+    Create the synthetic site described by the parsed arguments of add_site_arguments
+
+    Args:
+        arguments (argparse.Namespace): the parsed arguments
+
+    Returns:
+        SyntheticSite: the site
+    """
+    min_pdf_size, _, max_pdf_size = arguments.pdf_size.partition('-')
+    return SyntheticSite(pages=arguments.pages, books_per_page=arguments.books_per_page,
+                         min_pdf_size=int(min_pdf_size) * 1024, max_pdf_size=int(max_pdf_size or min_pdf_size) * 1024,
+                         page_padding=arguments.page_padding * 1024, latency=arguments.latency,
+                         bandwidth=int(arguments.bandwidth * 1024 * 1024) or None, compress=arguments.compress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a synthetic www.allitebooks.com')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on (default: 8080)')
+    add_site_arguments(parser)
+    arguments = parser.parse_args()
+    server = SyntheticSiteServer(create_site(arguments), arguments.port)
+    print 'Serving on http://127.0.0.1:{0}/'.format(server.server_address[1])
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
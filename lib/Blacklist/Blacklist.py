@@ -0,0 +1,194 @@
+import fnmatch
+import os
+import re
+import string
+import threading
+import time
+
+from lib.utils import web
+
+def _translate_glob(glob):
+    """
+    Translate a glob to a regex that can be combined with others
+
+    Args:
+        glob (str): the glob
+
+    Returns:
+        str: the regex, without the global flags fnmatch appends to it
+    """
+    pattern = fnmatch.translate(glob)
+    if pattern.endswith('(?ms)'):
+        pattern = pattern[:-len('(?ms)')]
+    return pattern
+
+_RULE_TRANSLATORS = {'prefix:': re.escape,
+                     'glob:': _translate_glob,
+                     're:': lambda pattern: pattern}
+_REGEX_LITERAL_CHARACTERS = frozenset(string.ascii_letters + string.digits + '/:_-%=&,~@!;')
+
+def _get_literal_prefix(rule_prefix, pattern, compiled_pattern):
+    """
+    Get the text every url matching the rule starts with
+
+    Args:
+        rule_prefix (str): the kind of the rule, 'prefix:', 'glob:', or 're:'
+        pattern (str): the rule, without its kind
+        compiled_pattern (re.RegexObject): the compiled regex of the rule
+
+    Returns:
+        str: the literal prefix of the rule, empty if it could not be told
+    """
+    if rule_prefix == 'prefix:':
+        return pattern
+    elif rule_prefix == 'glob:':
+        return re.split(r'[*?[]', pattern, 1)[0]
+    if '|' in pattern or compiled_pattern.flags & (re.IGNORECASE | re.VERBOSE):
+        return ''
+    literal_length = 0
+    while literal_length < len(pattern) and pattern[literal_length] in _REGEX_LITERAL_CHARACTERS:
+        literal_length += 1
+    if literal_length < len(pattern) and pattern[literal_length] in '*?{+':
+        literal_length -= 1
+    return pattern[:max(0, literal_length)]
+
+class Blacklist(object):
+
+    def __init__(self, filename, reload_interval=5):
+        """
+        A set of urls to be skipped, loaded from a file
+
+        Every line of the file is either a url to skip, or a rule starting with 'prefix:',
+        'glob:', or 're:' (a regex matched from the start of the url).  Empty lines and lines
+        starting with '#' are ignored.  Urls are kept in a set, and 'prefix:' rules in a set
+        per prefix length, so checking a url against them costs one lookup per distinct
+        length, no matter how many rules the file has.  'glob:' and 're:' rules are indexed
+        by the literal text they start with: only the rules whose literal prefix the url
+        starts with are tried, the globs sharing one literal prefix combined into a single
+        regex.  're:' rules are compiled one by one, since combining them would renumber
+        their groups and break their backreferences, and a 're:' rule whose literal prefix
+        cannot be told (one with '|' or case-insensitive) is tried on every url.  The file is
+        loaded again when it changes, checked at most every reload_interval seconds.  If the
+        file changed to an invalid regex, the error is logged and the previous rules are
+        kept; only an invalid file at creation raises.
+
+        Args:
+            filename (str): name of the blacklist file
+            reload_interval (int, optional): seconds between checks for changes to the file,
+                defaults to 5
+
+        Returns:
+            Blacklist: an instance of the class
+
+        Raises:
+            re.error: a 're:' rule of the file is not a valid regex
+        """
+        self.filename = filename
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.modification_time = self._get_modification_time()
+        self.last_checked = time.time()
+        self.matcher = self._load()
+
+    def _get_modification_time(self):
+        try:
+            return os.stat(self.filename).st_mtime
+        except OSError:
+            return None
+
+    def _reload_if_changed(self):
+        """
+        Load the file again if it changed since it was last loaded
+
+        A file that cannot be loaded is logged and the rules loaded before are kept, until
+        the file changes again.
+
+        Args:
+
+        Returns:
+
+        """
+        now = time.time()
+        if now - self.last_checked < self.reload_interval:
+            return
+        with self.lock:
+            if now - self.last_checked < self.reload_interval:
+                return
+            self.last_checked = now
+            modification_time = self._get_modification_time()
+            if modification_time != self.modification_time:
+                self.modification_time = modification_time
+                try:
+                    self.matcher = self._load()
+                except re.error as error:
+                    web.web_logger.log_event('blacklist_reload_failed', 'ERROR', filename=self.filename,
+                                             reason=str(error))
+
+    def _load(self):
+        """
+        Parse the file into a set of urls, the prefix rules by length, and the glob and
+        're:' rules by literal prefix
+
+        Args:
+
+        Returns:
+            tuple: the set of urls, (length, set of prefixes) pairs, (length, dict of literal
+                prefix to regexes) pairs, and the number of rules
+
+        Raises:
+            re.error: a rule is not a valid regex, the message gives its line
+        """
+        urls = set()
+        prefixes = {}
+        glob_patterns = {}
+        regex_rules = {}
+        rule_count = 0
+        if os.path.exists(self.filename):
+            with open(self.filename) as blacklist_file_handler:
+                for line_number, line in enumerate(blacklist_file_handler, 1):
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    for rule_prefix, translate in _RULE_TRANSLATORS.items():
+                        if line.startswith(rule_prefix):
+                            pattern = '(?:{0})'.format(translate(line[len(rule_prefix):].strip()))
+                            try:
+                                compiled_pattern = re.compile(pattern, re.DOTALL)
+                            except re.error as error:
+                                raise re.error('{0} on line {1}: {2}'.format(error, line_number, line))
+                            rule_count += 1
+                            literal_prefix = _get_literal_prefix(rule_prefix, line[len(rule_prefix):].strip(),
+                                                                 compiled_pattern)
+                            if rule_prefix == 'prefix:':
+                                prefixes.setdefault(len(literal_prefix), set()).add(literal_prefix)
+                            elif rule_prefix == 'glob:':
+                                glob_patterns.setdefault(literal_prefix, []).append(pattern)
+                            else:
+                                regex_rules.setdefault(literal_prefix, []).append(compiled_pattern)
+                            break
+                    else:
+                        urls.add(line)
+
+        patterns = {}
+        for literal_prefix, literal_glob_patterns in glob_patterns.items():
+            patterns[literal_prefix] = [re.compile('|'.join(literal_glob_patterns), re.DOTALL)]
+        for literal_prefix, literal_regex_rules in regex_rules.items():
+            patterns.setdefault(literal_prefix, []).extend(literal_regex_rules)
+        patterns_by_length = {}
+        for literal_prefix, literal_patterns in patterns.items():
+            patterns_by_length.setdefault(len(literal_prefix), {})[literal_prefix] = tuple(literal_patterns)
+        return (frozenset(urls), tuple(sorted((length, frozenset(length_prefixes))
+                                              for length, length_prefixes in prefixes.items())),
+                tuple(sorted(patterns_by_length.items())), rule_count)
+
+    def __contains__(self, url):
+        self._reload_if_changed()
+        urls, prefixes, patterns, _ = self.matcher
+        return url in urls or \
+            any(url[:length] in length_prefixes for length, length_prefixes in prefixes) or \
+            any(pattern.match(url) is not None for length, length_patterns in patterns
+                for pattern in length_patterns.get(url[:length], ()))
+
+    def __len__(self):
+        urls, _, _, rule_count = self.matcher
+        return len(urls) + rule_count
@@ -0,0 +1,176 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+from lib.FileWriter import FileWriter
+from lib.utils import file_tools
+
+_1MB = 1024 * 1024
+_FICLONE = 0x40049409
+
+class ContentDigest(object):
+
+    def __init__(self):
+        """
+        The SHA-256 of a file, computed while it streams
+
+        Returns:
+            ContentDigest: an instance of the class
+        """
+        self.reset()
+
+    def reset(self):
+        """
+        Start over, for a file downloaded again from its beginning
+
+        Args:
+
+        Returns:
+
+        """
+        self.full_hash = hashlib.sha256()
+        self.size = 0
+
+    def update(self, chunk):
+        """
+        Add the next chunk of the file
+
+        Args:
+            chunk (str): the bytes following the ones already added
+
+        Returns:
+
+        """
+        self.full_hash.update(chunk)
+        self.size += len(chunk)
+
+    def update_from_file(self, filename):
+        """
+        Add the content of the given file, read in chunks
+
+        Args:
+            filename (str): the path of the file
+
+        Returns:
+
+        """
+        with open(filename, 'rb') as file_:
+            while True:
+                chunk = file_.read(_1MB)
+                if not chunk:
+                    return
+                self.update(chunk)
+
+    def get_full_hash(self):
+        return self.full_hash.hexdigest()
+
+def _link(source, destination):
+    """
+    Make destination share the content of source
+
+    Use a hardlink if possible, a reflink (copy on write clone) if source is on another
+    filesystem that supports them, and a copy otherwise.
+
+    Args:
+        source (str): the path of the existing file
+        destination (str): the path to create
+
+    Returns:
+        str: 'hardlink', 'reflink', or 'copy'
+    """
+    try:
+        os.link(source, destination)
+        return 'hardlink'
+    except OSError as exception:
+        if exception.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+    try:
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+        return 'reflink'
+    except IOError:
+        shutil.copyfile(source, destination)
+        return 'copy'
+
+class BlobStore(object):
+
+    def __init__(self, directory):
+        """
+        A content-addressed store of downloaded files
+
+        Every distinct content is kept once, named after its SHA-256, and the paths of the
+        books are links to it.  An SQLite index keyed on the hash tells whether a downloaded
+        file is already stored.
+
+        Args:
+            directory (str): the directory to keep the files in, should be on the same
+                filesystem as the books so that they can be hardlinked
+
+        Returns:
+            BlobStore: an instance of the class
+        """
+        self.directory = directory
+        file_tools.assure_directory_path_exists(directory)
+        self.lock = threading.Lock()
+        self.database = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        self.database.execute('PRAGMA journal_mode=WAL')
+        self.database.execute('PRAGMA synchronous=NORMAL')
+        with self.database:
+            self.database.execute('CREATE TABLE IF NOT EXISTS blobs (sha256 TEXT PRIMARY KEY, size INTEGER, '
+                                  'created_at REAL)')
+
+    def get_blob_path(self, sha256):
+        return os.path.join(self.directory, sha256[:2], sha256)
+
+    def create_content_digest(self):
+        """
+        Create a ContentDigest for a file to commit to this store
+
+        Args:
+
+        Returns:
+            ContentDigest: the digest
+        """
+        return ContentDigest()
+
+    def commit(self, part_filename, filename, content_digest):
+        """
+        Store the downloaded part file and link filename to its content
+
+        If the content is already stored, as told by its full hash, the part file is removed.
+        Otherwise it is moved into the store.  Either way, the link to the stored content is
+        made at the part file path and renamed to filename, so filename is replaced
+        atomically.  Another process (another shard) storing the same content at
+        the same time renames identical bytes over the blob and leaves the single row of the
+        index as it is.
+
+        Args:
+            part_filename (str): the path of the downloaded file
+            filename (str): the path of the book
+            content_digest (ContentDigest): the digest computed while the file was downloaded
+
+        Returns:
+            bool: whether the content was already stored or not
+        """
+        sha256 = content_digest.get_full_hash()
+        blob_path = self.get_blob_path(sha256)
+        with self.lock, self.database:
+            is_duplicate = self.database.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone() \
+                is not None
+            if not is_duplicate:
+                FileWriter.file_writer.ensure_directory(os.path.dirname(blob_path))
+                os.rename(part_filename, blob_path)
+                FileWriter.file_writer.record_commit(blob_path)
+                self.database.execute('INSERT OR IGNORE INTO blobs (sha256, size, created_at) VALUES (?, ?, ?)',
+                                      (sha256, content_digest.size, time.time()))
+        if is_duplicate:
+            file_tools.remove_if_exists(part_filename)
+
+        _link(self.get_blob_path(sha256), part_filename)
+        os.rename(part_filename, filename)
+        return is_duplicate
@@ -1,24 +1,221 @@
+import HTMLParser
+import re
+import urllib2
+
 import bs4
 
 from utils import web
 
+_BOOK_INFO_PATTERN = re.compile(r'\.com/(?P<category>[^"]*)"[^<>]*?rel="category"'
+                                r'|(?P<pdf_download_link>http://file\.allitebooks\.com[^"]*)(?=")'
+                                r'|<h3>Book Description:</h3>(?P<summary>.*?)<div class=', re.DOTALL)
+_CATEGORY_PATTERN = re.compile(r'\.com/(?P<category>[^"]*)"[^<>]*?rel="category"')
+_PDF_DOWNLOAD_LINK_PATTERN = re.compile(r'(?P<pdf_download_link>http://file\.allitebooks\.com[^"]*)(?=")')
+_SUMMARY_BEGINNING_MARKER = '<h3>Book Description:</h3>'
+_SUMMARY_ENDING_MARKER = '<div class='
+_TAG_PATTERN = re.compile(r'<[^>]*>')
+_PLAIN_HTML_PATTERN = re.compile(r'(?:[^<&]'
+                                 r'|<(?!/?(?:script|style|pre|textarea|meta)\b)/?[a-zA-Z][a-zA-Z0-9]*'
+                                 r'(?:\s+[a-zA-Z_:][-a-zA-Z0-9_:.]*(?:\s*=\s*"[^"<>&]*")?)*\s*/?>'
+                                 r'|&(?:(?!apos;)[a-zA-Z][a-zA-Z0-9]*|#[0-9]{1,5});)*\Z', re.IGNORECASE)
+_ASCII_SPACES = ' \n\t\x0c\r'
+_html_parser = HTMLParser.HTMLParser()
+
+def _scan_book_info(page_content):
+    """
+    Find the category, pdf download link, and summary in a single pass over the page source
+
+    Args:
+        page_content (str): the source of the book page
+
+    Returns:
+        dict: the first match of each field ('category', 'pdf_download_link', and 'summary',
+            the summary still as html), missing fields are not in the dict
+    """
+    book_info = {}
+    for match in _BOOK_INFO_PATTERN.finditer(page_content):
+        field = match.lastgroup
+        if field not in book_info:
+            book_info[field] = match.group(field)
+            if len(book_info) == 3:
+                break
+    return book_info
+
+class _BookInfoScanner(object):
+
+    OVERLAP = 4096
+
+    def __init__(self):
+        """
+        Find the category, pdf download link, and summary in a page source fed one chunk at a time
+
+        Each chunk is scanned once, along with the end of the previous ones: the category and
+        the pdf download link are searched in the last OVERLAP bytes and the new chunk, and
+        the summary is collected from its beginning marker until its ending marker is found.
+        A category or link longer than OVERLAP may be missed, in which case the page is
+        scanned again whole by get_book_info.
+
+        Returns:
+            _BookInfoScanner: an instance of the class
+        """
+        self.chunks = []
+        self.tail = ''
+        self.book_info = {}
+        self.summary_parts = None
+        self.summary_tail = ''
+
+    def feed(self, chunk):
+        """
+        Scan the next chunk of the page source
+
+        Args:
+            chunk (str): the chunk
+
+        Returns:
+            bool: whether the category, pdf download link, and summary are all found or not
+        """
+        self.chunks.append(chunk)
+        text = self.tail + chunk
+        for field, pattern in (('category', _CATEGORY_PATTERN), ('pdf_download_link', _PDF_DOWNLOAD_LINK_PATTERN)):
+            if field not in self.book_info:
+                match = pattern.search(text)
+                if match is not None:
+                    self.book_info[field] = match.group(field)
+        if self.summary_parts is not None:
+            self._feed_summary(chunk)
+        else:
+            beginning_marker_index = text.find(_SUMMARY_BEGINNING_MARKER)
+            if beginning_marker_index != -1:
+                self.summary_parts = []
+                self._feed_summary(text[beginning_marker_index + len(_SUMMARY_BEGINNING_MARKER):])
+        self.tail = text[-self.OVERLAP:]
+        return len(self.book_info) == 3
+
+    def _feed_summary(self, data):
+        """
+        Add data to the summary until its ending marker is found
+
+        Args:
+            data (str): the source following what was added before
+
+        Returns:
+
+        """
+        if 'summary' in self.book_info:
+            return
+        ending_marker_index = (self.summary_tail + data).find(_SUMMARY_ENDING_MARKER)
+        if ending_marker_index == -1:
+            self.summary_parts.append(data)
+            self.summary_tail = (self.summary_tail + data)[1 - len(_SUMMARY_ENDING_MARKER):]
+            return
+        summary = ''.join(self.summary_parts) + data
+        self.book_info['summary'] = summary[:len(summary) - len(data) - len(self.summary_tail) + ending_marker_index]
+        self.summary_parts = []
+
+    def get_page_content(self):
+        """
+        Get the page source fed so far
+
+        Returns:
+            str: the page source
+        """
+        return ''.join(self.chunks)
+
+def _get_text(html):
+    """
+    Get the text of the summary html, the way _get_book_summary gets it with BeautifulSoup
+
+    Plain html, made of text, simple tags, and entities, is handled without BeautifulSoup:
+    the tags are stripped, the entities unescaped, and the text between two tags collapsed
+    to a single space or newline when it is only whitespace, like BeautifulSoup does.
+    Anything else (comments, scripts, stray '<' or '&', '&apos;', which HTMLParser unescapes
+    but BeautifulSoup keeps, text that is not utf-8) is parsed with BeautifulSoup, followed
+    by the ending marker as _get_book_summary parses it.
+
+    Args:
+        html (str): the html of the summary, without its ending marker
+
+    Returns:
+        unicode str: the text of the summary
+    """
+    try:
+        text = html.decode('utf-8') if not isinstance(html, unicode) else html
+    except UnicodeDecodeError:
+        text = None
+    if text is None or _PLAIN_HTML_PATTERN.match(text) is None:
+        return bs4.BeautifulSoup(html + _SUMMARY_ENDING_MARKER, 'html.parser').get_text()
+    text_parts = []
+    for text_part in _TAG_PATTERN.split(text):
+        text_part = _html_parser.unescape(text_part)
+        if text_part and not text_part.strip(_ASCII_SPACES):
+            text_part = '\n' if '\n' in text_part else ' '
+        text_parts.append(text_part)
+    return ''.join(text_parts)
+
 class BookInfoExtracter(object):
 
-    def __init__(self, url):
+    def __init__(self, url, page_content=None, streamed=False):
         """
         A class to extract information about a book given the url
 
         Given the url, provide methods for extracting the book category, the pdf
-        download link, and the book summary.
+        download link, and the book summary.  If streamed is True, the page is read one
+        chunk at a time and the connection is closed as soon as all three are found, so
+        the rest of the page (sidebar, comments, footer) is never downloaded.
 
         Args:
             url (str): link to extract information from
+            page_content (str, optional): the already retrieved source of the page, defaults
+                to None (retrieve it from the url)
+            streamed (bool, optional): stop reading the page once the book information is
+                found or not, defaults to False
 
         Returns:
             BookInfoExtracter: an instance of the class
         """
         self.url = url
-        self.page_content = web.get_source(url)
+        self.book_info = None
+        if page_content is not None:
+            self.page_content = page_content
+        elif streamed:
+            self.page_content = self._read_until_book_info()
+        else:
+            self.page_content = web.get_source(url)
+
+    def _read_until_book_info(self):
+        """
+        Read the page source until the category, pdf download link, and summary are found
+
+        Every chunk is scanned once as it arrives (see _BookInfoScanner).  If the connection
+        breaks after chunks started arriving, the whole page is retrieved again with
+        get_source, which retries it.  Errors opening the connection are raised, since
+        iter_source already retried them.
+
+        Args:
+
+        Returns:
+            str: the source of the page, up to the chunk completing the book information
+
+        Raises:
+            HTTPError: the server responded with an error status
+            URLError: the connection could not be opened
+        """
+        scanner = _BookInfoScanner()
+        chunks = web.iter_source(self.url)
+        has_received_chunks = False
+        try:
+            for chunk in chunks:
+                has_received_chunks = True
+                if scanner.feed(chunk):
+                    self.book_info = scanner.book_info
+                    break
+        except urllib2.URLError:
+            if not has_received_chunks:
+                raise
+            return web.get_source(self.url)
+        finally:
+            chunks.close()
+        return scanner.get_page_content()
 
     def _get_book_category(self):
         """
@@ -100,7 +297,23 @@ class BookInfoExtracter(object):
         Get the category, pdf download link, and summary
 
         Retrieve the category the book belongs to, the link from which a pdf version can be
-        downloaded, and a book excerpt.
+        downloaded, and a book excerpt.  All three are found in a single pass over the page
+        source; if one of them is missing there, the page is searched again field by field.
+
+        Args:
+
+        Returns:
+            tuple: category of the book, download link, and book excerpt
+        """
+        book_info = self.book_info or _scan_book_info(self.page_content)
+        if len(book_info) == 3:
+            summary = _get_text(book_info['summary']).strip().replace('\n\n', '\n')
+            return book_info['category'], book_info['pdf_download_link'], summary
+        return self._get_book_info_by_field()
+
+    def _get_book_info_by_field(self):
+        """
+        Get the category, pdf download link, and summary with one search for each
 
         Args:
 
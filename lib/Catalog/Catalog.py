@@ -0,0 +1,157 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+
+_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+class Catalog(object):
+
+    def __init__(self, filename):
+        """
+        A searchable catalog of the books downloaded
+
+        Keep the title, category, summary, and links of every book in a single SQLite database
+        in WAL mode, with a full-text index (FTS5) over the title, category, and summary, so
+        that searching tens of thousands of books is an indexed lookup instead of a walk
+        through one text file per book.  If the SQLite library has no FTS5, the catalog still
+        records books and is searched with LIKE instead.
+
+        Args:
+            filename (str): name of the database file
+
+        Returns:
+            Catalog: an instance of the class
+        """
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.database = sqlite3.connect(filename, check_same_thread=False)
+        self.database.execute('PRAGMA journal_mode=WAL')
+        self.database.execute('PRAGMA synchronous=NORMAL')
+        with self.database:
+            self.database.execute('CREATE TABLE IF NOT EXISTS books ('
+                                  'id INTEGER PRIMARY KEY, book_url TEXT UNIQUE, pdf_url TEXT, path TEXT, '
+                                  'title TEXT, category TEXT, summary TEXT, updated_at REAL)')
+        try:
+            with self.database:
+                self.database.execute('CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5('
+                                      'title, category, summary, content=books, content_rowid=id)')
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.full_text = False
+
+    @staticmethod
+    def get_title(path):
+        """
+        Get the title of a book from the path its file was saved to
+
+        Args:
+            path (str): the path of the PDF file
+
+        Returns:
+            str: the filename without its extension, with spaces instead of underscores
+        """
+        return os.path.splitext(os.path.basename(path))[0].replace('_', ' ')
+
+    def record(self, book_url, pdf_url, path, category, summary):
+        """
+        Add or replace the entry of the given book, keeping the full-text index in sync
+
+        Args:
+            book_url (str): the link for a particular book
+            pdf_url (str): the link the PDF file was downloaded from
+            path (str): the path the file was saved to
+            category (str): the category of the book
+            summary (unicode): the book excerpt
+
+        Returns:
+
+        """
+        title = self.get_title(path)
+        with self.lock, self.database:
+            row = self.database.execute('SELECT id, title, category, summary FROM books WHERE book_url = ?',
+                                        (book_url,)).fetchone()
+            if row is None:
+                book_id = self.database.execute('INSERT INTO books VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+                                                (book_url, pdf_url, path, title, category, summary,
+                                                 time.time())).lastrowid
+            else:
+                book_id = row[0]
+                if self.full_text:
+                    self.database.execute("INSERT INTO books_fts (books_fts, rowid, title, category, summary) "
+                                          "VALUES ('delete', ?, ?, ?, ?)", row)
+                self.database.execute('UPDATE books SET pdf_url = ?, path = ?, title = ?, category = ?, summary = ?, '
+                                      'updated_at = ? WHERE id = ?',
+                                      (pdf_url, path, title, category, summary, time.time(), book_id))
+            if self.full_text:
+                self.database.execute('INSERT INTO books_fts (rowid, title, category, summary) VALUES (?, ?, ?, ?)',
+                                      (book_id, title, category, summary))
+
+    def get(self, book_url):
+        """
+        Get the entry of the given book
+
+        Args:
+            book_url (str): the link for a particular book
+
+        Returns:
+            dict: the pdf_url, path, title, category, and summary of the book
+            None: if the book is not in the catalog
+        """
+        with self.lock:
+            row = self.database.execute('SELECT pdf_url, path, title, category, summary FROM books '
+                                        'WHERE book_url = ?', (book_url,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('pdf_url', 'path', 'title', 'category', 'summary'), row))
+
+    def search(self, query, limit=20):
+        """
+        Find the books whose title, category, or summary match the given query
+
+        The query uses the FTS5 syntax (words, "phrases", AND/OR/NOT, prefix*, and
+        column:word).  A query that is not valid FTS5 is searched again as a plain list of
+        words.
+
+        Args:
+            query (str): the words to look for
+            limit (int, optional): maximum number of books returned, defaults to 20
+
+        Returns:
+            list: the book_url, path, title, category, and an excerpt of the summary around the
+                match of each book, the most relevant first (matches in the title count most)
+        """
+        if not self.full_text:
+            return self._search_without_index(query, limit)
+        statement = ("SELECT books.book_url, books.path, books.title, books.category, "
+                     "snippet(books_fts, 2, '[', ']', '...', 16) FROM books_fts "
+                     "JOIN books ON books.id = books_fts.rowid WHERE books_fts MATCH ? "
+                     "ORDER BY bm25(books_fts, 10.0, 2.0, 1.0) LIMIT ?")
+        with self.lock:
+            try:
+                rows = self.database.execute(statement, (query, limit)).fetchall()
+            except sqlite3.OperationalError:
+                terms = _TERM_PATTERN.findall(query)
+                if not terms:
+                    return []
+                rows = self.database.execute(statement, (' '.join('"{0}"'.format(term) for term in terms),
+                                                         limit)).fetchall()
+        return [dict(zip(('book_url', 'path', 'title', 'category', 'snippet'), row)) for row in rows]
+
+    def _search_without_index(self, query, limit):
+        terms = _TERM_PATTERN.findall(query)
+        if not terms:
+            return []
+        condition = ' AND '.join(['(title LIKE ? OR category LIKE ? OR summary LIKE ?)'] * len(terms))
+        parameters = []
+        for term in terms:
+            parameters.extend(['%{0}%'.format(term)] * 3)
+        with self.lock:
+            rows = self.database.execute('SELECT book_url, path, title, category, substr(summary, 1, 120) '
+                                         'FROM books WHERE ' + condition + ' LIMIT ?', parameters + [limit]).fetchall()
+        return [dict(zip(('book_url', 'path', 'title', 'category', 'snippet'), row)) for row in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.database.execute('SELECT COUNT(*) FROM books').fetchone()[0]
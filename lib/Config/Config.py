@@ -81,6 +81,18 @@ class Config(object):
         self.config[key] = value
         return previous_value
 
+    def set_many(self, values):
+        """
+        Set the values of several keys
+
+        Args:
+            values (dict): the keys and their new values
+
+        Returns:
+
+        """
+        self.config.update(values)
+
     def get(self, key):
         """
         Get the value of the specified key
@@ -0,0 +1,129 @@
+import json
+import os
+import sqlite3
+import threading
+
+import Config
+
+class ProgressStore(object):
+
+    def __init__(self, filename, legacy_filename=None):
+        """
+        A transactional drop-in replacement for the Config class
+
+        Keep the key-value pairs in an SQLite database in WAL mode and commit every change
+        as soon as it is made, so that a crash (even SIGKILL) loses nothing that was set.
+        Committing is cheap enough to be done after every book.  If the database is empty
+        and legacy_filename exists, the values of that config file are imported.  The lock
+        is reentrant, so that save can run from a signal handler that interrupted set.
+
+        Args:
+            filename (str): name of the database file
+            legacy_filename (str, optional): name of a config file written by the Config
+                class to import values from, defaults to None
+
+        Returns:
+            ProgressStore: an instance of the class
+        """
+        self.filename = filename
+        self.lock = threading.RLock()
+        self.database = sqlite3.connect(filename, check_same_thread=False)
+        self.database.execute('PRAGMA journal_mode=WAL')
+        self.database.execute('PRAGMA synchronous=NORMAL')
+        with self.database:
+            self.database.execute('CREATE TABLE IF NOT EXISTS progress (key TEXT PRIMARY KEY, value TEXT)')
+        self.config = dict((key, json.loads(value))
+                           for key, value in self.database.execute('SELECT key, value FROM progress'))
+        if not self.config and legacy_filename and os.path.exists(legacy_filename):
+            self._import_legacy_config(legacy_filename)
+
+    def _import_legacy_config(self, legacy_filename):
+        """
+        Import the values of a config file written by the Config class
+
+        Args:
+            legacy_filename (str): name of the config file
+
+        Returns:
+
+        """
+        legacy_config = Config.Config(legacy_filename).config
+        self.set_many(dict((key, None if value == 'None' else value) for key, value in legacy_config.items()))
+
+    def set_default_value(self, key, value):
+        """
+        Set the value of the key to the specified value if the value is not set
+
+        Create a new key-value in the store if the key does not exist.  Otherwise, do nothing.
+
+        Args:
+            key (str): the name of the key-value pair
+            value (str): the value associated with the key
+
+        Returns:
+
+        """
+        if not key in self.config:
+            self.set(key, value)
+
+    def set(self, key, value):
+        """
+        Set the value of the key to the specified value and commit it
+
+        Args:
+            key (str): the name of the key-value pair
+            value (str): the value associated with the key
+
+        Returns:
+            None: if the key-value pair did not previously exists
+            str: the previous value if the key-value pair already exists
+        """
+        previous_value = self.get(key)
+        self.set_many({key: value})
+        return previous_value
+
+    def set_many(self, values):
+        """
+        Set the values of several keys and commit them in a single transaction
+
+        Either every value is saved or none of them is.
+
+        Args:
+            values (dict): the keys and their new values
+
+        Returns:
+
+        """
+        with self.lock, self.database:
+            self.database.executemany('INSERT OR REPLACE INTO progress VALUES (?, ?)',
+                                      ((key, json.dumps(value)) for key, value in values.items()))
+            self.config.update(values)
+
+    def get(self, key):
+        """
+        Get the value of the specified key
+
+        Args:
+            key (str): the name of the key-value pair
+
+        Returns:
+            None: if the key-value pair does not exists
+            str: the current value of the specified key
+        """
+        return self.config.get(key)
+
+    def save(self):
+        """
+        Save the config data
+
+        Every change is already committed, so only move the WAL content into the database
+        file.
+
+        Args:
+
+        Returns:
+            bool: if the operation was successful or not
+        """
+        with self.lock:
+            self.database.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        return True
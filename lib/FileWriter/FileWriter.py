@@ -0,0 +1,218 @@
+import atexit
+import ctypes
+import ctypes.util
+import errno
+import os
+import threading
+
+from lib.utils import file_tools
+
+FSYNC_POLICIES = ('none', 'per-file', 'periodic')
+_FALLOC_FL_KEEP_SIZE = 0x01
+
+def _load_fallocate():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fallocate = libc.fallocate
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+_fallocate = _load_fallocate()
+
+class FileWriter(object):
+
+    def __init__(self, fsync_policy='none', fsync_interval=5.0):
+        """
+        Write downloaded files to disk with as few system calls on the critical path as possible
+
+        Directories already created are remembered, so that each one costs a single makedirs
+        per run.  Files are preallocated to their final size before they are written (without
+        changing their size, so that partial files can still be resumed), written to their
+        part file, and renamed into place.  Files reach the disk following the fsync policy:
+        'none' leaves it to the operating system, 'per-file' syncs every file and its
+        directory as it is committed, and 'periodic' syncs the files committed since the last
+        time every fsync_interval seconds from a background thread.
+
+        Args:
+            fsync_policy (str, optional): one of FSYNC_POLICIES, defaults to 'none'
+            fsync_interval (float, optional): seconds between syncs of the 'periodic' policy,
+                defaults to 5
+
+        Returns:
+            FileWriter: an instance of the class
+
+        Raises:
+            ValueError: the fsync policy is not one of FSYNC_POLICIES
+        """
+        self.directories = set()
+        self.pending_filenames = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.configure(fsync_policy, fsync_interval)
+
+    def configure(self, fsync_policy='none', fsync_interval=5.0):
+        """
+        Change the fsync policy, starting the background thread of the 'periodic' policy
+
+        Args:
+            fsync_policy (str, optional): one of FSYNC_POLICIES, defaults to 'none'
+            fsync_interval (float, optional): seconds between syncs of the 'periodic' policy,
+                defaults to 5
+
+        Returns:
+
+        Raises:
+            ValueError: the fsync policy is not one of FSYNC_POLICIES
+        """
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError('unknown fsync policy: {0}'.format(fsync_policy))
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        if fsync_policy == 'periodic' and self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='file-writer')
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close)
+
+    def ensure_directory(self, directory):
+        """
+        Create the given directory and its parents, unless it was already done
+
+        Args:
+            directory (str): the directory path
+
+        Returns:
+
+        Raises:
+            OSError: Exception preventing the creation of the directory
+        """
+        if directory in self.directories:
+            return
+        file_tools.assure_directory_path_exists(directory)
+        with self.lock:
+            self.directories.add(directory)
+
+    def preallocate(self, file_, size):
+        """
+        Reserve the disk space of the given file up to size bytes
+
+        The file keeps its current size, the blocks are only allocated so that the writes
+        that follow do not fragment it or fail halfway for lack of space.  Filesystems and
+        platforms without fallocate are left alone.
+
+        Args:
+            file_ (file): the open file
+            size (int): the final size of the file in bytes, None if unknown
+
+        Returns:
+            bool: whether the space was reserved or not
+        """
+        if _fallocate is None or not size:
+            return False
+        if _fallocate(file_.fileno(), _FALLOC_FL_KEEP_SIZE, 0, size) != 0:
+            error_number = ctypes.get_errno()
+            if error_number not in (errno.EOPNOTSUPP, errno.ENOSYS, errno.EINVAL):
+                raise OSError(error_number, os.strerror(error_number))
+            return False
+        return True
+
+    def finish(self, file_):
+        """
+        Flush the given file once it is completely written, syncing it with the 'per-file' policy
+
+        Args:
+            file_ (file): the open file
+
+        Returns:
+
+        """
+        file_.flush()
+        if self.fsync_policy == 'per-file':
+            os.fsync(file_.fileno())
+
+    def commit(self, filename):
+        """
+        Replace the given path with its part file
+
+        Args:
+            filename (str): the path of the complete file
+
+        Returns:
+
+        Raises:
+            OSError: the part file does not exist or could not be renamed
+        """
+        file_tools.commit_part_file(filename)
+        self.record_commit(filename)
+
+    def record_commit(self, filename):
+        """
+        Apply the fsync policy to a file put in place by a rename done elsewhere
+
+        Args:
+            filename (str): the path of the committed file
+
+        Returns:
+
+        """
+        if self.fsync_policy == 'per-file':
+            _fsync_directory(os.path.dirname(filename) or '.')
+        elif self.fsync_policy == 'periodic':
+            with self.lock:
+                self.pending_filenames.append(filename)
+
+    def sync(self):
+        """
+        Sync the files committed since the last sync, then their directories
+
+        Args:
+
+        Returns:
+
+        """
+        with self.lock:
+            filenames, self.pending_filenames = self.pending_filenames, []
+        directories = set()
+        for filename in filenames:
+            try:
+                file_descriptor = os.open(filename, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(file_descriptor)
+            finally:
+                os.close(file_descriptor)
+            directories.add(os.path.dirname(filename) or '.')
+        for directory in directories:
+            _fsync_directory(directory)
+
+    def _run(self):
+        while not self.stopped.wait(self.fsync_interval):
+            self.sync()
+
+    def close(self):
+        """
+        Stop the background thread and sync the files still waiting
+
+        Args:
+
+        Returns:
+
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.sync()
+
+def _fsync_directory(directory):
+    file_descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+file_writer = FileWriter()
@@ -0,0 +1,43 @@
+import re
+import time
+
+_BOOK_PAGE_PATTERN = re.compile(r'"entry-title".*?<a href="([^"]+)"', re.DOTALL)
+
+class ListingParser(object):
+
+    def __init__(self, page_content):
+        """
+        A class to extract the links leading to each book from the source of a listing page
+
+        The links are found by a single compiled regex as the parser is iterated over, so
+        the caller can stop before the end of the page and the rest of it is never scanned.
+        The time spent scanning is kept in parse_time.
+
+        Args:
+            page_content (str): the source of the listing page
+
+        Returns:
+            ListingParser: an instance of the class
+        """
+        self.page_content = page_content
+        self.parse_time = 0.0
+        self.book_page_count = 0
+
+    def __iter__(self):
+        """
+        Iterate over the links in the order they are listed on the page (newest first)
+
+        Args:
+
+        Returns:
+            generator: the links leading to each book
+        """
+        matches = _BOOK_PAGE_PATTERN.finditer(self.page_content)
+        while True:
+            start_time = time.time()
+            match = next(matches, None)
+            self.parse_time += time.time() - start_time
+            if match is None:
+                return
+            self.book_page_count += 1
+            yield str(match.group(1))
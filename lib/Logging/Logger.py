@@ -1,7 +1,14 @@
+import Queue
+import atexit
+import json
+import threading
+import time
 from datetime import datetime
 
 import interrupt
 
+_CLOSE = object()
+
 class LoggerConfig(object):
 
     def __init__(self, include_time):
@@ -99,18 +106,112 @@ class LoggerConfig(object):
         else:
             return False
 
+class AsyncLogWriter(object):
+
+    def __init__(self, filename, batch_size=64 * 1024, flush_interval=1.0):
+        """
+        Write log messages to a file from a background thread
+
+        Messages are put on a queue and returned from right away.  The writer thread keeps
+        the file open and writes the messages in batches, once batch_size bytes are waiting
+        or the oldest waiting message is flush_interval seconds old.  Everything still
+        waiting is written when the writer is closed, which happens at exit at the latest.
+
+        Args:
+            filename (str): name of the log file
+            batch_size (int, optional): bytes waiting that trigger a write, defaults to 64 KB
+            flush_interval (float, optional): seconds a message waits at most, defaults to 1
+
+        Returns:
+            AsyncLogWriter: an instance of the class
+        """
+        self.filename = filename
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = Queue.Queue()
+        self.lock = threading.Lock()
+        self.is_closed = False
+        self.thread = threading.Thread(target=self._run, name='log-writer')
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, message):
+        """
+        Queue a message to be written
+
+        Args:
+            message (str): the message, including its trailing newline
+
+        Returns:
+
+        """
+        self.queue.put(message)
+
+    def _run(self):
+        with open(self.filename, 'a') as log_file:
+            batch = []
+            batch_bytes = 0
+            batch_started = None
+            while True:
+                try:
+                    if batch:
+                        message = self.queue.get(timeout=max(0, batch_started + self.flush_interval - time.time()))
+                    else:
+                        message = self.queue.get()
+                except Queue.Empty:
+                    message = None
+
+                if message is not None and message is not _CLOSE:
+                    if not batch:
+                        batch_started = time.time()
+                    batch.append(message)
+                    batch_bytes += len(message)
+
+                if batch and (message is None or message is _CLOSE or batch_bytes >= self.batch_size or
+                              time.time() - batch_started >= self.flush_interval):
+                    log_file.write(''.join(batch))
+                    log_file.flush()
+                    batch = []
+                    batch_bytes = 0
+                if message is _CLOSE:
+                    return
+
+    def close(self):
+        """
+        Write every waiting message and stop the writer thread
+
+        Args:
+
+        Returns:
+
+        """
+        with self.lock:
+            if self.is_closed:
+                return
+            self.is_closed = True
+        self.queue.put(_CLOSE)
+        self.thread.join()
+
 class Logger:
 
-    def __init__(self, filename, include_time=True):
+    def __init__(self, filename, include_time=True, asynchronous=False, structured=False):
         """
         A logger class to simplify the logging process
 
         Abstracts the logging process by opening and writing files behind the scenes and
-        logging data if it meets the current logging level.
+        logging data if it meets the current logging level.  In asynchronous mode, the
+        messages are written by an AsyncLogWriter instead, so logging never waits on the
+        file.  In structured mode, every message and event is written as one JSON object
+        per line.
 
         Args:
             filename (str): name of the log file
             include_time (bool, optional): include the time in the log file or not
+            asynchronous (bool, optional): write the messages from a background thread or
+                not, defaults to False
+            structured (bool, optional): write JSON objects instead of text or not, defaults
+                to False
 
         Returns:
             Logger: an instance of the class
@@ -118,6 +219,38 @@ class Logger:
         self.filename = filename
         self.config = LoggerConfig(include_time)
         self.current_logging_level = 'WARNING'
+        self.structured = structured
+        self.cached_time = (None, None)
+        self.writer = None
+        if asynchronous:
+            self.start_async_writer()
+
+    def start_async_writer(self, batch_size=64 * 1024, flush_interval=1.0):
+        """
+        Write the messages from a background thread from now on
+
+        Args:
+            batch_size (int, optional): bytes waiting that trigger a write, defaults to 64 KB
+            flush_interval (float, optional): seconds a message waits at most, defaults to 1
+
+        Returns:
+
+        """
+        if self.writer is None:
+            self.writer = AsyncLogWriter(self.filename, batch_size, flush_interval)
+
+    def close(self):
+        """
+        Write every waiting message and go back to writing the messages right away
+
+        Args:
+
+        Returns:
+
+        """
+        writer, self.writer = self.writer, None
+        if writer is not None:
+            writer.close()
 
     def set_current_level(self, new_logging_level):
         """
@@ -138,12 +271,42 @@ class Logger:
         else:
             return False
 
+    def is_enabled_for(self, logging_level):
+        """
+        Check whether messages at the given level are logged
+
+        Args:
+            logging_level (str): the name of the logging level
+
+        Returns:
+            bool: whether the level is greater than or equal to the current logging level
+        """
+        logging_levels = self.config.logging_levels
+        return logging_levels[logging_level] >= logging_levels[self.current_logging_level]
+
+    def _get_formatted_time(self):
+        """
+        Get the current time, formatted once per second at most
+
+        Args:
+
+        Returns:
+            str: the current time
+        """
+        current_second = int(time.time())
+        cached_second, formatted_time = self.cached_time
+        if cached_second != current_second:
+            formatted_time = datetime.fromtimestamp(current_second).strftime('%Y-%m-%d %H:%M:%S')
+            self.cached_time = (current_second, formatted_time)
+        return formatted_time
+
     def log(self, message, logging_level=None):
         """
         Log a message
 
         If the logging_level specified is greater than or equal to the current logging
         level, then log the message into the log.  Include the time if configured to do so.
+        Messages below the current logging level are rejected before any formatting.
 
         Args:
             message (str): the message to enter into the log
@@ -152,24 +315,71 @@ class Logger:
         Returns:
             bool: whether the operation was successful or not
         """
+        if logging_level and not self.is_enabled_for(logging_level):
+            return None
+
+        if self.structured:
+            record = {'message': message.strip()}
+            if logging_level:
+                record['level'] = logging_level
+            return self._write_record(record)
 
         if logging_level:
-            current_logging_value = self.config.logging_levels[self.current_logging_level]
-            given_logging_value = self.config.logging_levels[logging_level]
+            message = '{0}: {1}'.format(logging_level, message)
+        if self.config.include_time:
+            message = '{0} {1}'.format(self._get_formatted_time(), message)
+        return self._write('{0}\n'.format(message.strip()))
 
-            if given_logging_value >= current_logging_value:
-                message = '{0}: {1}'.format(logging_level, message)
-            else:
-                return None
+    def log_event(self, event, logging_level='INFO', **fields):
+        """
+        Log an event along with its fields
+
+        In structured mode, the event is written as a JSON object holding the time, the
+        level, the event, and the fields (such as url, status, bytes, duration, and stage).
+        Otherwise, it is written as a message listing the fields as key=value pairs.  Events
+        below the current logging level are rejected before any formatting.
+
+        Args:
+            event (str): the name of the event
+            logging_level (str, optional): the level to log the event at, defaults to 'INFO'
+            **fields: the fields of the event
+
+        Returns:
+            bool: whether the operation was successful or not
+        """
+        if not self.is_enabled_for(logging_level):
+            return None
+
+        if self.structured:
+            fields['event'] = event
+            fields['level'] = logging_level
+            return self._write_record(fields)
+
+        message = ' '.join([event] + ['{0}={1}'.format(key, value) for key, value in sorted(fields.items())])
+        return self.log(message, logging_level)
 
+    def _write_record(self, record):
         if self.config.include_time:
-            current_time = datetime.now()
-            formatted_time = current_time.strftime('%Y-%m-%d %H:%M:%S')
-            message = '{0} {1}'.format(formatted_time, message)
+            record['time'] = self._get_formatted_time()
+        return self._write(json.dumps(record, default=str) + '\n')
+
+    def _write(self, message):
+        """
+        Write a formatted message to the log file, or hand it to the writer thread
+
+        Args:
+            message (str): the message, including its trailing newline
+
+        Returns:
+            bool: whether the operation was successful or not
+        """
+        writer = self.writer
+        if writer is not None:
+            writer.write(message)
+            return True
 
         with interrupt.KeyboardInterruptBlocked():
             with open(self.filename, 'a') as log_file:
-                message = '{0}\n'.format(message.strip())
                 log_file.write(message)
         return True
 
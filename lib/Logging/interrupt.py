@@ -1,4 +1,5 @@
 import signal
+import threading
 
 class KeyboardInterruptBlocked(object):
 
@@ -21,7 +22,8 @@ class KeyboardInterruptBlocked(object):
         Mute the KeyboardInterrupt signal
 
         Store the default handler for SIGINT (KeyboardInterrupt), replace the handler
-        with our own to ignore KeyboardInterrupt signal.
+        with our own to ignore KeyboardInterrupt signal.  Signals are only delivered to
+        the main thread, so this is a no-op when entered from any other thread.
 
         Args:
 
@@ -29,6 +31,9 @@ class KeyboardInterruptBlocked(object):
 
         '''
         self.received_signal = False
+        self.is_main_thread = isinstance(threading.current_thread(), threading._MainThread)
+        if not self.is_main_thread:
+            return
         self.old_handler = signal.getsignal(signal.SIGINT)
         signal.signal(signal.SIGINT, self.handler)
 
@@ -65,6 +70,8 @@ class KeyboardInterruptBlocked(object):
         Returns:
 
         '''
+        if not self.is_main_thread:
+            return
         signal.signal(signal.SIGINT, self.old_handler)
         if self.received_signal:
             self.old_handler(*self.received_signal)
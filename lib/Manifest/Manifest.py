@@ -0,0 +1,128 @@
+import sqlite3
+import threading
+import time
+
+class Manifest(object):
+
+    def __init__(self, filename):
+        """
+        An index of the books already fetched
+
+        Keep one row per book page in an SQLite database: the PDF download link, the path the
+        file was saved to, its size, and the status of the download.  Book pages are the
+        primary key, so checking whether a book is known is an indexed lookup no matter how
+        many books the manifest holds.
+
+        Args:
+            filename (str): name of the database file
+
+        Returns:
+            Manifest: an instance of the class
+        """
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.database = sqlite3.connect(filename, check_same_thread=False)
+        self.database.execute('PRAGMA journal_mode=WAL')
+        self.database.execute('PRAGMA synchronous=NORMAL')
+        with self.database:
+            self.database.execute('CREATE TABLE IF NOT EXISTS books ('
+                                  'book_url TEXT PRIMARY KEY, pdf_url TEXT, path TEXT, size INTEGER, '
+                                  'status TEXT, updated_at REAL)')
+            self.database.execute('CREATE INDEX IF NOT EXISTS books_pdf_url ON books (pdf_url)')
+
+    def get(self, book_url):
+        """
+        Get the entry of the given book
+
+        Args:
+            book_url (str): the link for a particular book
+
+        Returns:
+            dict: the pdf_url, path, size, and status of the book
+            None: if the book is not in the manifest
+        """
+        with self.lock:
+            row = self.database.execute('SELECT pdf_url, path, size, status FROM books WHERE book_url = ?',
+                                        (book_url,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(('pdf_url', 'path', 'size', 'status'), row))
+
+    def is_downloaded(self, book_url):
+        """
+        Check whether the given book was already downloaded
+
+        Args:
+            book_url (str): the link for a particular book
+
+        Returns:
+            bool: whether the book was downloaded or not
+        """
+        with self.lock:
+            row = self.database.execute('SELECT 1 FROM books WHERE book_url = ? AND status = ?',
+                                        (book_url, 'downloaded')).fetchone()
+        return row is not None
+
+    def has_downloaded(self):
+        """
+        Check whether any book was downloaded
+
+        Args:
+
+        Returns:
+            bool: whether the manifest records at least one downloaded book or not
+        """
+        with self.lock:
+            row = self.database.execute('SELECT 1 FROM books WHERE status = ? LIMIT 1', ('downloaded',)).fetchone()
+        return row is not None
+
+    def get_unfinished(self):
+        """
+        Get the books whose download failed or was found but never finished
+
+        Args:
+
+        Returns:
+            list: the links of the books, the ones recorded longest ago first
+        """
+        with self.lock:
+            rows = self.database.execute('SELECT book_url FROM books WHERE status IN (?, ?) ORDER BY updated_at',
+                                         ('failed', 'pending')).fetchall()
+        return [row[0] for row in rows]
+
+    def record_pending(self, book_urls):
+        """
+        Record the given books as found but not downloaded yet, unless they are known already
+
+        Args:
+            book_urls (list): the links of the books
+
+        Returns:
+
+        """
+        now = time.time()
+        with self.lock, self.database:
+            self.database.executemany('INSERT OR IGNORE INTO books VALUES (?, NULL, NULL, NULL, ?, ?)',
+                                      [(book_url, 'pending', now) for book_url in book_urls])
+
+    def record(self, book_url, pdf_url, path, size, status):
+        """
+        Add or replace the entry of the given book
+
+        Args:
+            book_url (str): the link for a particular book
+            pdf_url (str): the link the PDF file was downloaded from
+            path (str): the path the file was saved to
+            size (int): size of the file in bytes, None if it was not downloaded
+            status (str): 'downloaded', 'failed', or 'pending'
+
+        Returns:
+
+        """
+        with self.lock, self.database:
+            self.database.execute('INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?, ?, ?)',
+                                  (book_url, pdf_url, path, size, status, time.time()))
+
+    def __len__(self):
+        with self.lock:
+            return self.database.execute('SELECT COUNT(*) FROM books').fetchone()[0]
@@ -0,0 +1,267 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _get_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra_labels=()):
+    labels = list(key) + list(extra_labels)
+    if not labels:
+        return ''
+    escaped_labels = ('{0}="{1}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')
+                                          .replace('\n', '\\n'))
+                      for name, value in labels)
+    return '{' + ','.join(escaped_labels) + '}'
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        A distribution of observed values, counted in buckets
+
+        Args:
+            buckets (tuple, optional): the upper bounds of the buckets, defaults to
+                DEFAULT_BUCKETS
+
+        Returns:
+            Histogram: an instance of the class
+        """
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def get_cumulative_counts(self):
+        """
+        Get the number of values at most each bound, like Prometheus buckets
+
+        Args:
+
+        Returns:
+            list: the bounds and their cumulative counts
+        """
+        cumulative_counts = []
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative_counts.append((bound, total))
+        return cumulative_counts
+
+class Metrics(object):
+
+    def __init__(self, prefix='allitebook'):
+        """
+        Counters and latency histograms of a crawl
+
+        Every metric has a name and a set of labels (host, stage, status...).  Recording is
+        thread safe and cheap: one dictionary update under a lock.
+
+        Args:
+            prefix (str, optional): prefix of the metric names when exported, defaults to
+                'allitebook'
+
+        Returns:
+            Metrics: an instance of the class
+        """
+        self.prefix = prefix
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def increment(self, name, value=1, **labels):
+        """
+        Add value to the counter with the given name and labels
+
+        Args:
+            name (str): name of the counter
+            value (int, optional): the amount to add, defaults to 1
+            **labels: the labels of the counter
+
+        Returns:
+
+        """
+        key = _get_key(labels)
+        with self.lock:
+            values = self.counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Add a value to the histogram with the given name and labels
+
+        Args:
+            name (str): name of the histogram
+            value (float): the observed value, usually seconds
+            **labels: the labels of the histogram
+
+        Returns:
+
+        """
+        key = _get_key(labels)
+        with self.lock:
+            labelled_histograms = self.histograms.setdefault(name, {})
+            if key not in labelled_histograms:
+                labelled_histograms[key] = Histogram()
+            labelled_histograms[key].observe(value)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """
+        Observe the seconds spent in the with block in the histogram with the given name
+
+        Args:
+            name (str): name of the histogram
+            **labels: the labels of the histogram
+
+        Returns:
+
+        """
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start_time, **labels)
+
+    def to_dict(self):
+        """
+        Get the current value of every metric
+
+        Args:
+
+        Returns:
+            dict: the timestamp, the counters, and the histograms, each metric being a list of
+                its labels and values
+        """
+        with self.lock:
+            counters = dict((name, [{'labels': dict(key), 'value': value} for key, value in sorted(values.items())])
+                            for name, values in self.counters.items())
+            histograms = dict((name, [{'labels': dict(key), 'count': histogram.count, 'sum': histogram.sum,
+                                       'buckets': [[_format_bound(bound), count]
+                                                   for bound, count in histogram.get_cumulative_counts()]}
+                                      for key, histogram in sorted(labelled_histograms.items())])
+                              for name, labelled_histograms in self.histograms.items())
+        return {'timestamp': time.time(), 'counters': counters, 'histograms': histograms}
+
+    def to_prometheus(self):
+        """
+        Get the current value of every metric in the Prometheus text format
+
+        Args:
+
+        Returns:
+            str: the metrics, one sample per line
+        """
+        lines = []
+        with self.lock:
+            for name, values in sorted(self.counters.items()):
+                full_name = '{0}_{1}'.format(self.prefix, name)
+                lines.append('# TYPE {0} counter'.format(full_name))
+                for key, value in sorted(values.items()):
+                    lines.append('{0}{1} {2}'.format(full_name, _format_labels(key), value))
+            for name, labelled_histograms in sorted(self.histograms.items()):
+                full_name = '{0}_{1}'.format(self.prefix, name)
+                lines.append('# TYPE {0} histogram'.format(full_name))
+                for key, histogram in sorted(labelled_histograms.items()):
+                    for bound, count in histogram.get_cumulative_counts():
+                        bucket_labels = _format_labels(key, [('le', _format_bound(bound))])
+                        lines.append('{0}_bucket{1} {2}'.format(full_name, bucket_labels, count))
+                    lines.append('{0}_sum{1} {2!r}'.format(full_name, _format_labels(key), histogram.sum))
+                    lines.append('{0}_count{1} {2}'.format(full_name, _format_labels(key), histogram.count))
+        return '\n'.join(lines) + '\n'
+
+class MetricsExporter(object):
+
+    def __init__(self, metrics, json_filename=None, prometheus_filename=None, interval=15):
+        """
+        Write the metrics to files periodically
+
+        The files are written to a temporary file and renamed, so that a reader (such as the
+        Prometheus node exporter textfile collector) never sees a half written file.
+
+        Args:
+            metrics (Metrics): the metrics to export
+            json_filename (str, optional): file the metrics are written to as JSON, defaults
+                to None
+            prometheus_filename (str, optional): file the metrics are written to in the
+                Prometheus text format, should end with .prom, defaults to None
+            interval (int, optional): seconds between writes, defaults to 15
+
+        Returns:
+            MetricsExporter: an instance of the class
+        """
+        self.metrics = metrics
+        self.json_filename = json_filename
+        self.prometheus_filename = prometheus_filename
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def _write_file(self, filename, content):
+        temporary_filename = '{0}.{1}.tmp'.format(filename, os.getpid())
+        with open(temporary_filename, 'w') as file_:
+            file_.write(content)
+        os.rename(temporary_filename, filename)
+
+    def export(self):
+        """
+        Write the metrics to the files now
+
+        Args:
+
+        Returns:
+
+        """
+        if self.json_filename:
+            self._write_file(self.json_filename, json.dumps(self.metrics.to_dict(), indent=2, sort_keys=True))
+        if self.prometheus_filename:
+            self._write_file(self.prometheus_filename, self.metrics.to_prometheus())
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.export()
+
+    def start(self):
+        """
+        Write the metrics every interval seconds on a daemon thread
+
+        Args:
+
+        Returns:
+            MetricsExporter: the exporter itself
+        """
+        self.thread = threading.Thread(target=self._run, name='metrics')
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the periodic writes and write the final metrics
+
+        Args:
+
+        Returns:
+
+        """
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.export()
+
+metrics = Metrics()
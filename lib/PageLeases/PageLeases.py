@@ -0,0 +1,224 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from lib.utils import web
+
+class PageLeases(object):
+
+    def __init__(self, filename, pages_per_lease=10, lease_duration=60, worker=None):
+        """
+        Hand out ranges of listing pages to worker processes through leases
+
+        The pages are counted from the last one (offset 0), so that the ranges stay the
+        same as books are added to the first pages.  Each range is a row of an SQLite table
+        shared by every worker.  A worker claims a range inside a BEGIN IMMEDIATE
+        transaction, so two workers never hold the same range, and keeps its leases alive
+        with a heartbeat thread.  The leases of a worker that dies expire after
+        lease_duration seconds and are claimed again by the others, starting from the first
+        page the dead worker had not saved.
+
+        Args:
+            filename (str): name of the database file
+            pages_per_lease (int, optional): pages in each range, defaults to 10
+            lease_duration (int, optional): seconds a lease lasts without a heartbeat,
+                defaults to 60
+            worker (str, optional): name of the worker holding the leases, defaults to None
+                (the host name and process id)
+
+        Returns:
+            PageLeases: an instance of the class
+        """
+        self.filename = filename
+        self.pages_per_lease = max(1, pages_per_lease)
+        self.lease_duration = lease_duration
+        self.worker = worker or '{0}:{1}'.format(socket.gethostname(), os.getpid())
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+        self.database = sqlite3.connect(filename, timeout=30, isolation_level=None, check_same_thread=False)
+        self.database.execute('PRAGMA journal_mode=WAL')
+        self.database.execute('CREATE TABLE IF NOT EXISTS leases ('
+                              'first_offset INTEGER PRIMARY KEY, last_offset INTEGER, next_offset INTEGER, '
+                              'status TEXT, worker TEXT, expires_at REAL)')
+
+    def _run_transaction(self, function, *args):
+        """
+        Run the given function inside a BEGIN IMMEDIATE transaction
+
+        The write lock of the database is taken from the start, so the rows the function
+        reads cannot be changed by another worker before it writes.
+
+        Args:
+            function (func): called with the database connection and args
+            *args: the arguments of the function
+
+        Returns:
+            object: the value returned by the function
+        """
+        with self.lock:
+            self.database.execute('BEGIN IMMEDIATE')
+            try:
+                result = function(self.database, *args)
+            except Exception:
+                self.database.execute('ROLLBACK')
+                raise
+            self.database.execute('COMMIT')
+            return result
+
+    def add_pages(self, total_pages):
+        """
+        Create the ranges of the pages that do not have one yet
+
+        Args:
+            total_pages (int): the number of listing pages of the site
+
+        Returns:
+
+        """
+        def add_ranges(database):
+            last_offset = database.execute('SELECT MAX(last_offset) FROM leases').fetchone()[0]
+            first_offset = 0 if last_offset is None else last_offset + 1
+            database.executemany("INSERT INTO leases VALUES (?, ?, ?, 'pending', NULL, NULL)",
+                                 ((offset, min(offset + self.pages_per_lease, total_pages) - 1, offset)
+                                  for offset in xrange(first_offset, total_pages, self.pages_per_lease)))
+        self._run_transaction(add_ranges)
+
+    def claim(self):
+        """
+        Claim a range that is not leased, or whose lease expired
+
+        Args:
+
+        Returns:
+            tuple: the offsets of the first page left and of the last page of the range
+            None: if every range is done or leased
+        """
+        def claim_range(database):
+            now = time.time()
+            row = database.execute("SELECT first_offset, next_offset, last_offset FROM leases "
+                                   "WHERE status = 'pending' OR (status = 'leased' AND expires_at < ?) "
+                                   "ORDER BY first_offset LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            database.execute("UPDATE leases SET status = 'leased', worker = ?, expires_at = ? WHERE first_offset = ?",
+                             (self.worker, now + self.lease_duration, row[0]))
+            return row[1], row[2]
+        return self._run_transaction(claim_range)
+
+    def holds(self, offset):
+        """
+        Check whether this worker still holds the lease of the given page
+
+        A lease that expired is not held anymore, even before another worker claims it,
+        since it may be claimed at any time.
+
+        Args:
+            offset (int): the offset of the page from the last one
+
+        Returns:
+            bool: whether the lease is held or not
+        """
+        with self.lock:
+            row = self.database.execute("SELECT 1 FROM leases WHERE first_offset <= ? AND last_offset >= ? AND "
+                                        "status = 'leased' AND worker = ? AND expires_at >= ?",
+                                        (offset, offset, self.worker, time.time())).fetchone()
+        return row is not None
+
+    def advance(self, offset):
+        """
+        Record that the given page is saved, finishing its range after its last page
+
+        Args:
+            offset (int): the offset of the page from the last one
+
+        Returns:
+            bool: whether the lease was still held or not
+        """
+        with self.lock:
+            cursor = self.database.execute("UPDATE leases SET next_offset = ?, "
+                                           "status = CASE WHEN ? > last_offset THEN 'done' ELSE status END "
+                                           "WHERE first_offset <= ? AND last_offset >= ? AND status = 'leased' AND "
+                                           "worker = ? AND expires_at >= ?",
+                                           (offset + 1, offset + 1, offset, offset, self.worker, time.time()))
+        return cursor.rowcount == 1
+
+    def has_unfinished(self):
+        """
+        Check whether some range is not done yet
+
+        Args:
+
+        Returns:
+            bool: whether a range is pending or leased
+        """
+        with self.lock:
+            row = self.database.execute("SELECT 1 FROM leases WHERE status != 'done' LIMIT 1").fetchone()
+        return row is not None
+
+    def renew(self):
+        """
+        Extend the leases held by this worker
+
+        Leases that expired are left alone: they may be claimed by another worker at any
+        time, so this worker already stopped working on them.
+
+        Args:
+
+        Returns:
+
+        """
+        with self.lock:
+            now = time.time()
+            self.database.execute("UPDATE leases SET expires_at = ? WHERE status = 'leased' AND worker = ? AND "
+                                  "expires_at >= ?", (now + self.lease_duration, self.worker, now))
+
+    def _run_heartbeat(self):
+        interval = self.lease_duration / 3.0
+        wait_time = interval
+        while not self.stopped.wait(wait_time):
+            try:
+                self.renew()
+            except sqlite3.Error as error:
+                web.web_logger.log_event('lease_renewal_failed', 'ERROR', filename=self.filename, worker=self.worker,
+                                         reason=str(error))
+                wait_time = min(1.0, interval)
+            else:
+                wait_time = interval
+
+    def start_heartbeat(self):
+        """
+        Renew the leases of this worker on a daemon thread, three times per lease duration
+
+        A renewal that fails is logged and tried again within a second.  If renewals keep
+        failing until the leases expire, holds tells that they are lost.
+
+        Args:
+
+        Returns:
+            PageLeases: the leases themselves
+        """
+        self.stopped.clear()
+        self.heartbeat_thread = threading.Thread(target=self._run_heartbeat, name='lease-heartbeat')
+        self.heartbeat_thread.daemon = True
+        self.heartbeat_thread.start()
+        return self
+
+    def release(self):
+        """
+        Stop the heartbeat and give back the ranges this worker did not finish
+
+        Args:
+
+        Returns:
+
+        """
+        self.stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+        with self.lock:
+            self.database.execute("UPDATE leases SET status = 'pending', worker = NULL, expires_at = NULL "
+                                  "WHERE status = 'leased' AND worker = ?", (self.worker,))
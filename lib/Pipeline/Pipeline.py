@@ -0,0 +1,220 @@
+import Queue
+import sys
+import threading
+
+_STOP = object()
+_POLL_INTERVAL = 0.5
+
+class Stage(object):
+
+    def __init__(self, name, function, workers=1):
+        """
+        A stage of a pipeline
+
+        Describes the work done at one step of a pipeline: every item going through the
+        stage is replaced by the value function returns for it.
+
+        Args:
+            name (str): name of the stage
+            function (func): takes an item and returns the item for the next stage
+            workers (int, optional): number of threads running function, defaults to 1
+
+        Returns:
+            Stage: an instance of the class
+        """
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+
+class Pipeline(object):
+
+    def __init__(self, stages, queue_depth=8):
+        """
+        A chain of stages connected by bounded queues
+
+        Every stage runs in its own threads and hands its results to the next stage through a
+        queue holding at most queue_depth items, so a slow stage holds back the ones before it
+        instead of letting work pile up in memory.  The first exception raised by a stage
+        stops the whole pipeline and is raised again by put and results.
+
+        Args:
+            stages (list): the Stage objects, in the order items go through them
+            queue_depth (int, optional): maximum items waiting in front of each stage,
+                defaults to 8
+
+        Returns:
+            Pipeline: an instance of the class
+        """
+        self.stages = stages
+        self.queues = [Queue.Queue(max(1, queue_depth)) for _ in xrange(len(stages) + 1)]
+        self.error = None
+        self.threads = []
+        self.running_workers = [stage.workers for stage in stages]
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the threads of every stage
+
+        Args:
+
+        Returns:
+            Pipeline: the pipeline itself
+        """
+        for stage_index, stage in enumerate(self.stages):
+            for worker_number in xrange(stage.workers):
+                thread_name = '{0}-{1}'.format(stage.name, worker_number)
+                thread = threading.Thread(target=self._run_worker, args=(stage_index,), name=thread_name)
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+        return self
+
+    def _put(self, queue, item):
+        """
+        Put an item in a queue, giving up if the pipeline was stopped by an error
+
+        Args:
+            queue (Queue): the queue to put the item in
+            item (object): the item
+
+        Returns:
+            bool: whether the item was put in the queue or not
+        """
+        while self.error is None:
+            try:
+                queue.put(item, timeout=_POLL_INTERVAL)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def _get(self, queue):
+        """
+        Get an item from a queue, giving up if the pipeline was stopped by an error
+
+        Args:
+            queue (Queue): the queue to get the item from
+
+        Returns:
+            object: the item, or _STOP if the pipeline was stopped by an error
+        """
+        while self.error is None:
+            try:
+                return queue.get(timeout=_POLL_INTERVAL)
+            except Queue.Empty:
+                continue
+        return _STOP
+
+    def _run_worker(self, stage_index):
+        """
+        Run the function of a stage on every item of its queue until the end of the input
+
+        The last worker of a stage to see the end of the input passes it on to the next stage.
+
+        Args:
+            stage_index (int): the position of the stage in the pipeline
+
+        Returns:
+
+        """
+        stage = self.stages[stage_index]
+        input_queue = self.queues[stage_index]
+        output_queue = self.queues[stage_index + 1]
+        try:
+            while True:
+                item = self._get(input_queue)
+                if item is _STOP:
+                    self._put(input_queue, _STOP)
+                    break
+                if not self._put(output_queue, stage.function(item)):
+                    return
+        except Exception:
+            with self.lock:
+                if self.error is None:
+                    self.error = sys.exc_info()
+            return
+
+        with self.lock:
+            self.running_workers[stage_index] -= 1
+            is_last_worker = self.running_workers[stage_index] == 0
+        if is_last_worker:
+            self._get(input_queue)
+            self._put(output_queue, _STOP)
+
+    def _raise_error(self):
+        """
+        Raise the exception that stopped the pipeline, if any
+
+        Args:
+
+        Returns:
+
+        """
+        if self.error is not None:
+            exception_type, exception_value, traceback = self.error
+            raise exception_type, exception_value, traceback
+
+    def put(self, item):
+        """
+        Feed an item to the first stage
+
+        Blocks while the queue of the first stage is full.
+
+        Args:
+            item (object): the item
+
+        Returns:
+
+        Raises:
+            Exception: the exception that stopped the pipeline
+        """
+        if not self._put(self.queues[0], item):
+            self._raise_error()
+
+    def close(self):
+        """
+        Mark the end of the input
+
+        Args:
+
+        Returns:
+
+        """
+        self._put(self.queues[0], _STOP)
+
+    def abort(self, exception_info):
+        """
+        Stop the pipeline because of an error that happened outside of the stages
+
+        Args:
+            exception_info (tuple): the value of sys.exc_info() for the error
+
+        Returns:
+
+        """
+        with self.lock:
+            if self.error is None:
+                self.error = exception_info
+
+    def results(self):
+        """
+        Iterate over the items coming out of the last stage
+
+        Items come out in the order they are finished, which is not necessarily the order
+        they were put in.  Waits with a timeout so that signals are still handled.
+
+        Args:
+
+        Returns:
+            generator: the items coming out of the last stage
+
+        Raises:
+            Exception: the exception that stopped the pipeline
+        """
+        while True:
+            item = self._get(self.queues[-1])
+            if item is _STOP:
+                self._raise_error()
+                return
+            yield item
@@ -0,0 +1,608 @@
+import asyncore
+import collections
+import heapq
+import os
+import socket
+import sys
+import time
+import urllib2
+import urlparse
+
+from lib.FileWriter import FileWriter
+from lib.Metrics import Metrics
+from lib.utils import file_tools
+from lib.utils import rate_limiter
+from lib.utils import retry
+from lib.utils import web
+
+_REDIRECT_CODES = (301, 302, 303, 307)
+_1KB = 1024
+_64KB = 64 * _1KB
+
+class AsyncResponse(object):
+
+    def __init__(self, url):
+        '''
+        The result of an asynchronous request
+
+        Holds the status, headers, and body of a response, or the error that prevented
+        the request from completing.
+
+        Args:
+            url (str): the url that was requested
+
+        Returns:
+            AsyncResponse: an instance of the class
+        '''
+        self.url = url
+        self.status = None
+        self.reason = ''
+        self.headers = {}
+        self.body = []
+        self.error = None
+
+    def get_body(self):
+        '''
+        Get the body of the response
+
+        Args:
+
+        Returns:
+            str: the body of the response
+        '''
+        return ''.join(self.body)
+
+class AsyncRequest(asyncore.dispatcher):
+
+    def __init__(self, url, on_complete, socket_map, headers=None, body_filename=None, on_headers=None):
+        '''
+        A single non-blocking HTTP GET request
+
+        Connect to the host of the url, resolved through the DNS cache shared with web, send
+        the request, and parse the response as the bytes arrive.  on_complete is called with
+        the request once the response is complete or the request failed.  The host name is
+        resolved here, before the request is registered: on a miss of the DNS cache the
+        lookup blocks the whole fetcher, once per host until the cached addresses expire.
+
+        Args:
+            url (str): the url to retrieve
+            on_complete (func): called with the request once it is done
+            socket_map (dict): the asyncore socket map the request is registered in
+            headers (dict, optional): extra headers to send, defaults to None
+            body_filename (str, optional): file the body of a successful response is written
+                to instead of being held in memory, defaults to None; a 206 response continuing
+                the file is appended to it
+            on_headers (func, optional): called with the response once its headers are parsed,
+                before the body file is opened, defaults to None
+
+        Returns:
+            AsyncRequest: an instance of the class
+
+        Raises:
+            socket.error: the host name could not be resolved or the socket not created
+        '''
+        asyncore.dispatcher.__init__(self, map=socket_map)
+        self.url = url
+        self.on_complete = on_complete
+        self.body_filename = body_filename
+        self.body_file = None
+        self.on_headers = on_headers
+        self.response = AsyncResponse(url)
+        self.start_time = time.time()
+        self.latency = None
+        self.last_activity = self.start_time
+        self.is_connected = False
+        self.is_done = False
+        self.header_buffer = ''
+        self.content_length = None
+        self.received = 0
+
+        _, netloc, path, query, _ = urlparse.urlsplit(url.replace(' ', '%20'))
+        host, _, port = netloc.partition(':')
+        self.host = host
+        self.port = int(port or 80)
+        request_headers = {'Host': netloc, 'User-Agent': 'Mozilla/5.0', 'Connection': 'close'}
+        request_headers.update(headers or {})
+        request_lines = ['GET {0}{1} HTTP/1.0'.format(path or '/', '?' + query if query else '')]
+        request_lines.extend('{0}: {1}'.format(key, value) for key, value in request_headers.items())
+        self.outgoing = '\r\n'.join(request_lines) + '\r\n\r\n'
+
+        family, _, _, _, address = web.get_dns_cache().resolve(self.host, self.port)[0]
+        self.create_socket(family, socket.SOCK_STREAM)
+        self.connect(address)
+
+    def writable(self):
+        return not self.connected or len(self.outgoing) > 0
+
+    def handle_connect(self):
+        self.is_connected = True
+
+    def handle_write(self):
+        sent = self.send(self.outgoing)
+        self.outgoing = self.outgoing[sent:]
+        self.last_activity = time.time()
+
+    def handle_read(self):
+        data = self.recv(_64KB)
+        self.last_activity = time.time()
+        if self.response.status is None:
+            self._feed_headers(data)
+        else:
+            self._feed_body(data)
+        if self.content_length is not None and self.received >= self.content_length:
+            self._finish()
+
+    def _feed_headers(self, data):
+        '''
+        Buffer the data until the headers are complete, then parse them
+
+        Args:
+            data (str): bytes received from the socket
+
+        Returns:
+
+        '''
+        self.header_buffer += data
+        header_end_index = self.header_buffer.find('\r\n\r\n')
+        if header_end_index == -1:
+            return
+
+        header_lines = self.header_buffer[:header_end_index].split('\r\n')
+        remaining_data = self.header_buffer[header_end_index + 4:]
+        self.header_buffer = ''
+        self.latency = time.time() - self.start_time
+
+        status_line_parts = header_lines[0].split(' ', 2)
+        self.response.status = int(status_line_parts[1])
+        self.response.reason = status_line_parts[2] if len(status_line_parts) > 2 else ''
+        for line in header_lines[1:]:
+            key, _, value = line.partition(':')
+            self.response.headers[key.strip().lower()] = value.strip()
+        if self.response.headers.get('content-length', '').isdigit():
+            self.content_length = int(self.response.headers['content-length'])
+        if self.on_headers is not None:
+            self.on_headers(self.response)
+        if self.body_filename is not None and self.response.status in (200, 206):
+            offset = 0
+            if self.response.status == 206 and os.path.exists(self.body_filename):
+                offset = os.path.getsize(self.body_filename)
+            content_range = self.response.headers.get('content-range')
+            mode = web.get_part_file_mode(self.response.status, content_range, offset)
+            if mode is None:
+                self.fail('unexpected Content-Range: {0}'.format(content_range))
+                return
+            self.body_file = open(self.body_filename, mode)
+            FileWriter.file_writer.preallocate(self.body_file,
+                                               offset + self.content_length if self.content_length is not None else None)
+        self._feed_body(remaining_data)
+
+    def _feed_body(self, data):
+        '''
+        Store the data as part of the body, or write it to the body file
+
+        Args:
+            data (str): bytes received from the socket
+
+        Returns:
+
+        '''
+        if not data:
+            return
+        self.received += len(data)
+        if self.body_file is not None:
+            self.body_file.write(data)
+        else:
+            self.response.body.append(data)
+
+    def handle_close(self):
+        if self.response.status is None:
+            self.response.error = urllib2.URLError('connection closed before a response was received')
+        elif self.content_length is not None and self.received < self.content_length:
+            self.response.error = urllib2.URLError('connection closed after {0} of {1} bytes'.format(
+                self.received, self.content_length))
+        self._finish()
+
+    def handle_error(self):
+        _, exception_value, _ = sys.exc_info()
+        self.fail(exception_value)
+
+    def fail(self, reason):
+        '''
+        Abort the request
+
+        Args:
+            reason (Exception or str): why the request failed
+
+        Returns:
+
+        '''
+        self.response.error = urllib2.URLError(reason)
+        self._finish()
+
+    def _finish(self):
+        '''
+        Close the connection and report the request as done (only once)
+
+        Args:
+
+        Returns:
+
+        '''
+        self.close()
+        if self.response.error is not None and not self.is_connected:
+            web.get_dns_cache().invalidate(self.host, self.port)
+        if self.body_file is not None and not self.body_file.closed:
+            if self.response.error is None:
+                FileWriter.file_writer.finish(self.body_file)
+            self.body_file.close()
+        if self.is_done:
+            return
+        self.is_done = True
+        response = self.response
+        if response.error is None and response.status >= 400:
+            response.error = urllib2.HTTPError(response.url, response.status, response.reason,
+                                               response.headers, None)
+        self.on_complete(self)
+
+class AsyncFetcher(object):
+
+    def __init__(self, max_in_flight=100, timeout=60, max_redirects=5):
+        '''
+        Run many HTTP requests at the same time on a single thread
+
+        Requests are queued per host and started as long as fewer than max_in_flight are
+        running and the rate limiter of web lets a request to their host start; like the
+        requests of web, each one holds a slot of its host until it is done, its status and
+        latency adapt the limits of the host, and it is recorded in the metrics along with
+        the bytes received.  Callbacks, and the functions scheduled with call_later, are run from run(), outside
+        of the asyncore handlers, so exceptions they raise propagate to the caller of run().
+
+        Args:
+            max_in_flight (int, optional): maximum requests running at once, defaults to 100
+            timeout (int, optional): seconds of inactivity before a request fails, defaults to 60
+            max_redirects (int, optional): redirects followed per request, defaults to 5
+
+        Returns:
+            AsyncFetcher: an instance of the class
+        '''
+        self.max_in_flight = max(1, max_in_flight)
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.socket_map = {}
+        self.pending = collections.OrderedDict()
+        self.next_start_time = None
+        self.in_flight = {}
+        self.completed = collections.deque()
+        self.timers = []
+        self.timer_count = 0
+
+    def call_later(self, delay, function, *args):
+        '''
+        Schedule a function to be called from run() after the given delay
+
+        Args:
+            delay (float): seconds to wait
+            function (func): the function to call
+            *args: the arguments of the function
+
+        Returns:
+
+        '''
+        self.timer_count += 1
+        heapq.heappush(self.timers, (time.time() + delay, self.timer_count, function, args))
+
+    def _run_due_timers(self):
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, function, args = heapq.heappop(self.timers)
+            function(*args)
+
+    def fetch(self, url, callback, headers=None, body_filename=None, on_headers=None):
+        '''
+        Queue a request
+
+        Args:
+            url (str): the url to retrieve
+            callback (func): called with the AsyncResponse once the request is done
+            headers (dict, optional): extra headers to send, defaults to None
+            body_filename (str, optional): file the body of a successful response is written
+                to, defaults to None
+            on_headers (func, optional): called with the AsyncResponse once its headers are
+                parsed, defaults to None
+
+        Returns:
+
+        '''
+        self._queue((url, callback, headers, body_filename, on_headers, 0))
+
+    def _queue(self, pending_request):
+        host = web.get_host(pending_request[0].replace(' ', '%20'))
+        self.pending.setdefault(host, collections.deque()).append(pending_request)
+
+    def _start_pending_requests(self):
+        '''
+        Start the queued requests the rate limiter lets through, in order for each host
+
+        Remember when a host that is held back can next be tried, so run() does not wait
+        longer than that.
+
+        Args:
+
+        Returns:
+
+        '''
+        self.next_start_time = None
+        host_rate_limiter = web.get_rate_limiter()
+        for host in self.pending.keys():
+            host_pending_requests = self.pending[host]
+            while host_pending_requests and len(self.in_flight) < self.max_in_flight:
+                wait_time = host_rate_limiter.get(host).try_acquire()
+                if wait_time:
+                    start_time = time.time() + wait_time
+                    self.next_start_time = min(self.next_start_time or start_time, start_time)
+                    break
+                url, callback, headers, body_filename, on_headers, redirect_count = host_pending_requests.popleft()
+                try:
+                    request = AsyncRequest(url, self._on_complete, self.socket_map, headers, body_filename,
+                                           on_headers)
+                except socket.error as socket_error:
+                    host_rate_limiter.get(host).release(0, 'error')
+                    web.record_response(host, 'error', 0)
+                    response = AsyncResponse(url)
+                    response.error = urllib2.URLError(socket_error)
+                    self.completed.append((callback, response))
+                    continue
+                self.in_flight[request] = (callback, headers, body_filename, on_headers, redirect_count)
+            if not host_pending_requests:
+                del self.pending[host]
+
+    def _report_done(self, request):
+        '''
+        Report the request as done to the rate limiter of its host, and record it in the
+        metrics and the log like the requests of web
+
+        Args:
+            request (AsyncRequest): the finished request
+
+        Returns:
+
+        '''
+        response = request.response
+        latency = request.latency if request.latency is not None else time.time() - request.start_time
+        host = web.get_host(request.url.replace(' ', '%20'))
+        host_rate_limiter = web.get_rate_limiter().get(host)
+        if response.status is None:
+            host_rate_limiter.release(latency, 'error')
+            web.record_response(host, 'error', latency)
+            return
+        if response.status >= 400:
+            retry_after = rate_limiter.parse_retry_after(response.headers.get('retry-after'))
+            host_rate_limiter.release(latency, response.status, retry_after)
+        else:
+            host_rate_limiter.release(latency)
+        web.record_response(host, response.status, latency)
+        Metrics.metrics.increment('http_received_bytes_total', request.received, host=host)
+        web.web_logger.log_event('response', 'DEBUG', url=request.url, status=response.status,
+                                 bytes=request.received, duration=time.time() - request.start_time)
+
+    def _on_complete(self, request):
+        callback, headers, body_filename, on_headers, redirect_count = self.in_flight.pop(request)
+        self._report_done(request)
+        response = request.response
+        location = response.headers.get('location')
+        if response.status in _REDIRECT_CODES and location and redirect_count < self.max_redirects:
+            response.error = None
+            redirect_url = urlparse.urljoin(response.url, location)
+            self._queue((redirect_url, callback, headers, body_filename, on_headers, redirect_count + 1))
+        else:
+            self.completed.append((callback, response))
+
+    def _expire_stale_requests(self):
+        now = time.time()
+        for request in self.in_flight.keys():
+            if now - request.last_activity > self.timeout:
+                request.fail('timed out')
+
+    def run(self):
+        '''
+        Run until every queued request, including the ones queued by callbacks and
+        scheduled functions, is done
+
+        Args:
+
+        Returns:
+
+        '''
+        while self.pending or self.in_flight or self.completed or self.timers:
+            self._run_due_timers()
+            self._start_pending_requests()
+            wait_time = 0.5
+            if self.timers:
+                wait_time = min(wait_time, self.timers[0][0] - time.time())
+            if self.next_start_time is not None:
+                wait_time = min(wait_time, self.next_start_time - time.time())
+            wait_time = max(0, wait_time)
+            if self.in_flight:
+                asyncore.loop(timeout=wait_time, use_poll=True, map=self.socket_map, count=1)
+                self._expire_stale_requests()
+            elif not self.pending and not self.completed:
+                time.sleep(wait_time)
+            while self.completed:
+                callback, response = self.completed.popleft()
+                callback(response)
+
+def fetch_with_retries(fetcher, url, callback, body_filename=None, get_headers=None, on_headers=None):
+    '''
+    Queue a request, sending it again while it fails with transient errors
+
+    Follow the retry policy of web: the retries are scheduled on the fetcher after the
+    delay of the policy instead of sleeping, and requests to a host whose circuit is open
+    wait for the circuit to let one through.
+
+    Args:
+        fetcher (AsyncFetcher): the fetcher running the request
+        url (str): the url to retrieve
+        callback (func): called with the AsyncResponse of the last attempt
+        body_filename (str, optional): file the body of a successful response is written
+            to, defaults to None
+        get_headers (func, optional): called before each attempt, returns the extra headers
+            to send, defaults to None
+        on_headers (func, optional): called with the AsyncResponse of each attempt once its
+            headers are parsed, defaults to None
+
+    Returns:
+
+    '''
+    retry_policy = web.get_retry_policy()
+    host = web.get_host(url.replace(' ', '%20'))
+
+    def on_attempt_done(retry_number, response):
+        retry_policy.record_attempt(host, response.error)
+        if response.error is not None and retry_policy.should_retry(retry_number, response.error):
+            fetcher.call_later(retry_policy.get_delay(retry_number, response.error), attempt, retry_number + 1)
+        else:
+            callback(response)
+
+    def attempt(retry_number):
+        try:
+            retry_policy.circuit_breaker.before_request(host)
+        except retry.CircuitOpenError as circuit_open_error:
+            response = AsyncResponse(url)
+            response.error = circuit_open_error
+            on_attempt_done(retry_number, response)
+            return
+        headers = get_headers() if get_headers is not None else None
+        fetcher.fetch(url, lambda response: on_attempt_done(retry_number, response), headers=headers,
+                      body_filename=body_filename, on_headers=on_headers)
+    attempt(0)
+
+def get_source(fetcher, link, callback, error_callback=None):
+    '''
+    Retrieve the page source without blocking
+
+    Queue a request for the given link; callback is called with the page source once it
+    has been retrieved.  Transient errors are retried following the retry policy of web.
+    Like web.get_source, the http cache of web is used if it is enabled: a fresh cached page
+    is given to callback without any request, from run(), and a stale one is revalidated.
+    The last error is raised (from fetcher.run()), unless error_callback is given.
+
+    Args:
+        fetcher (AsyncFetcher): the fetcher running the request
+        link (str): the url to retrieve the source for
+        callback (func): called with the source of the page (str)
+        error_callback (func, optional): called with the error instead of raising it,
+            defaults to None
+
+    Returns:
+
+    Raises:
+        HTTPError: the server responded with an error status
+        URLError: the page could not be retrieved
+    '''
+    proper_encoded_link = link.replace(' ', '%20')
+    http_cache = web.get_http_cache()
+    cached_page = http_cache.lookup(proper_encoded_link) if http_cache is not None else None
+    revalidation_headers = None
+    if cached_page is not None:
+        page_content, is_fresh, revalidation_headers = cached_page
+        if is_fresh:
+            fetcher.call_later(0, callback, page_content)
+            return
+
+    def on_response(response):
+        if response.error is not None:
+            if error_callback is None:
+                raise response.error
+            error_callback(response.error)
+        elif cached_page is not None and response.status == 304:
+            http_cache.revalidated(proper_encoded_link)
+            callback(cached_page[0])
+        else:
+            page_content = response.get_body()
+            if http_cache is not None:
+                http_cache.store(proper_encoded_link, page_content, response.headers.get('etag'),
+                                 response.headers.get('last-modified'))
+            callback(page_content)
+    fetch_with_retries(fetcher, proper_encoded_link, on_response, get_headers=lambda: revalidation_headers)
+
+def download_page(fetcher, download_link, callback):
+    '''
+    Download file without blocking
+
+    Queue a request for the given download link; callback is called with the content of
+    the file once it has been downloaded.  Transient errors are retried following the retry
+    policy of web.  In the case of HTTPErrors or URLErrors, log the error and call callback
+    with None.
+
+    Args:
+        fetcher (AsyncFetcher): the fetcher running the request
+        download_link (str): the url to retrieve the file from
+        callback (func): called with the content of the file (str), or None if the file
+            was not downloaded due to HTTPError or URLError
+
+    Returns:
+
+    '''
+    def on_response(response):
+        if response.error is not None:
+            web.log_download_error(response.error, download_link)
+            callback(None)
+        else:
+            callback(response.get_body())
+    fetch_with_retries(fetcher, download_link, on_response)
+
+def download_to_part_file(fetcher, download_link, filename, callback):
+    '''
+    Download file to the part file of the given filename without blocking
+
+    Queue a request for the given download link, writing the body to the part file next to
+    filename as it arrives.  callback is called with the path of the part file once the
+    file has been downloaded.  Like web.download_to_part_file, a download that is
+    interrupted keeps what it received in the part file and is resumed with a Range
+    request, on the next attempt following the retry policy of web, or on the next call
+    for the same file (even from another run or from the threaded engine).  In the case
+    of HTTPErrors that are not transient, log the error, remove the part file, and call
+    callback with None.  In the case of transient errors on every attempt (including a
+    connection closed before Content-Length bytes arrived), log the error, keep the part
+    file, and call callback with None.
+
+    Args:
+        fetcher (AsyncFetcher): the fetcher running the request
+        download_link (str): the url to retrieve the file from
+        filename (str): the path the file will be committed to
+        callback (func): called with the path of the part file (str), or None if the file
+            was not downloaded due to HTTPError or URLError
+
+    Returns:
+
+    '''
+    part_filename = file_tools.get_part_filename(filename)
+    metadata_filename = part_filename + '.json'
+    attempt = {'offset': 0}
+
+    def get_headers():
+        attempt['offset'], headers = web.get_resume_headers(download_link, part_filename)
+        return headers
+
+    def on_headers(response):
+        if response.status not in (200, 206):
+            return
+        if web.get_part_file_mode(response.status, response.headers.get('content-range'), attempt['offset']):
+            web.save_resume_validator(download_link, part_filename, response.headers)
+        else:
+            file_tools.remove_if_exists(metadata_filename)
+
+    def on_response(response):
+        if web.is_part_file_complete(response.status, response.headers.get('content-range'), attempt['offset']):
+            response.error = None
+        if response.error is not None:
+            web.log_download_error(response.error, download_link)
+            if isinstance(response.error, urllib2.HTTPError) and not retry.is_transient(response.error):
+                file_tools.remove_if_exists(part_filename)
+                file_tools.remove_if_exists(metadata_filename)
+            callback(None)
+        else:
+            file_tools.remove_if_exists(metadata_filename)
+            callback(part_filename)
+    fetch_with_retries(fetcher, download_link, on_response, body_filename=part_filename, get_headers=get_headers,
+                       on_headers=on_headers)
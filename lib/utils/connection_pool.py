@@ -0,0 +1,347 @@
+import collections
+import httplib
+import socket
+import threading
+import time
+import urllib2
+import urlparse
+
+_REDIRECT_CODES = (301, 302, 303, 307)
+
+class DNSCache(object):
+
+    def __init__(self, ttl=300, host_overrides=None):
+        '''
+        A cache of host name lookups
+
+        Keep the addresses returned by getaddrinfo for ttl seconds, so that connecting to
+        the same host over and over does not repeat the lookup.  Hosts in host_overrides
+        resolve to the given address and port instead, like an entry in /etc/hosts.
+
+        Args:
+            ttl (int, optional): seconds a lookup is kept for, defaults to 300
+            host_overrides (dict, optional): the address and port to connect to for some host
+                names, defaults to None
+
+        Returns:
+            DNSCache: an instance of the class
+        '''
+        self.ttl = ttl
+        self.host_overrides = host_overrides or {}
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, host, port):
+        '''
+        Get the addresses of the given host
+
+        Args:
+            host (str): the host name
+            port (int): the port to connect to
+
+        Returns:
+            list: the addresses, in the format returned by socket.getaddrinfo
+
+        Raises:
+            socket.gaierror: the host name could not be resolved
+        '''
+        key = (host, port)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        address, port = self.host_overrides.get(host, (host, port))
+        addresses = socket.getaddrinfo(address, port, 0, socket.SOCK_STREAM)
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, addresses)
+        return addresses
+
+    def invalidate(self, host, port):
+        '''
+        Forget the addresses of the given host
+
+        Args:
+            host (str): the host name
+            port (int): the port to connect to
+
+        Returns:
+
+        '''
+        with self.lock:
+            self.entries.pop((host, port), None)
+
+class CachedDNSHTTPConnection(httplib.HTTPConnection):
+
+    def __init__(self, host, port, timeout, dns_cache):
+        '''
+        An HTTP connection resolving its host through a DNSCache
+
+        Args:
+            host (str): the host name
+            port (int): the port to connect to
+            timeout (int): socket timeout in seconds
+            dns_cache (DNSCache): the cache to resolve the host with
+
+        Returns:
+            CachedDNSHTTPConnection: an instance of the class
+        '''
+        httplib.HTTPConnection.__init__(self, host, port, timeout=timeout)
+        self.dns_cache = dns_cache
+
+    def connect(self):
+        last_error = socket.error('getaddrinfo returned no addresses')
+        for family, socket_type, protocol, _, address in self.dns_cache.resolve(self.host, self.port):
+            sock = None
+            try:
+                sock = socket.socket(family, socket_type, protocol)
+                sock.settimeout(self.timeout)
+                sock.connect(address)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.sock = sock
+                return
+            except socket.error as socket_error:
+                last_error = socket_error
+                if sock is not None:
+                    sock.close()
+        self.dns_cache.invalidate(self.host, self.port)
+        raise last_error
+
+class PooledResponse(object):
+
+    def __init__(self, connection_pool, key, connection, response, url):
+        '''
+        A response whose connection goes back to the pool once the body is read
+
+        Reading the body to the end hands the connection back to the pool for reuse.  Closing
+        the response before that drops the connection instead.
+
+        Args:
+            connection_pool (ConnectionPool): the pool the connection belongs to
+            key (tuple): the scheme, host, and port of the connection
+            connection (HTTPConnection): the connection the response was received on
+            response (HTTPResponse): the response
+            url (str): the url that was requested
+
+        Returns:
+            PooledResponse: an instance of the class
+        '''
+        self.connection_pool = connection_pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.code = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        self.received_bytes = 0
+        self.done_callbacks = []
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.url
+
+    def add_done_callback(self, callback):
+        '''
+        Call the given function once the body is read or the response is closed
+
+        Args:
+            callback (function): function taking no arguments
+
+        Returns:
+
+        '''
+        self.done_callbacks.append(callback)
+
+    def _run_done_callbacks(self):
+        done_callbacks, self.done_callbacks = self.done_callbacks, []
+        for callback in done_callbacks:
+            callback()
+
+    def read(self, amount=None):
+        '''
+        Read the body
+
+        Args:
+            amount (int, optional): maximum number of bytes to read, defaults to None (read
+                the rest of the body)
+
+        Returns:
+            str: the bytes read, empty once the whole body is read
+
+        Raises:
+            URLError: the connection failed or was closed before the whole body was read
+        '''
+        try:
+            data = self.response.read() if amount is None else self.response.read(amount)
+        except (httplib.HTTPException, socket.error) as error:
+            self.close()
+            raise urllib2.URLError(error)
+        if not data and amount and self.response.length:
+            self.close()
+            raise urllib2.URLError(httplib.IncompleteRead('', self.response.length))
+        self.received_bytes += len(data)
+        if self.response.isclosed():
+            self._release()
+        return data
+
+    def _release(self):
+        if self.connection is not None:
+            if self.response.will_close:
+                self.connection.close()
+            else:
+                self.connection_pool.put_back(self.key, self.connection)
+            self.connection = None
+        self._run_done_callbacks()
+
+    def close(self):
+        '''
+        Close the response, dropping the connection if the body was not read to the end
+
+        Args:
+
+        Returns:
+
+        '''
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.response.close()
+        self._run_done_callbacks()
+
+class ConnectionPool(object):
+
+    def __init__(self, pool_size=4, timeout=60, dns_cache_ttl=300, max_redirects=5, host_overrides=None):
+        '''
+        A pool of keep-alive HTTP connections per host
+
+        Connections are kept open once a response has been read and reused by the next
+        request to the same host, so the TCP handshake and the host name lookup are only
+        paid when no idle connection is left.
+
+        Args:
+            pool_size (int, optional): maximum idle connections kept per host, defaults to 4
+            timeout (int, optional): socket timeout in seconds, defaults to 60
+            dns_cache_ttl (int, optional): seconds a host name lookup is kept for, defaults
+                to 300
+            max_redirects (int, optional): redirects followed per request, defaults to 5
+            host_overrides (dict, optional): the address and port to connect to for some host
+                names, defaults to None
+
+        Returns:
+            ConnectionPool: an instance of the class
+        '''
+        self.pool_size = max(1, pool_size)
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.dns_cache = DNSCache(dns_cache_ttl, host_overrides)
+        self.idle_connections = collections.defaultdict(list)
+        self.lock = threading.Lock()
+
+    def _get_connection(self, key):
+        '''
+        Get an idle connection to the given host, or a new one if there is none
+
+        Args:
+            key (tuple): the scheme, host, and port to connect to
+
+        Returns:
+            tuple: the connection and whether it was reused or not
+        '''
+        with self.lock:
+            idle_connections = self.idle_connections[key]
+            if idle_connections:
+                return idle_connections.pop(), True
+
+        scheme, host, port = key
+        if scheme == 'https':
+            return httplib.HTTPSConnection(host, port, timeout=self.timeout), False
+        return CachedDNSHTTPConnection(host, port, self.timeout, self.dns_cache), False
+
+    def put_back(self, key, connection):
+        '''
+        Keep a connection for reuse, or close it if the pool for its host is full
+
+        Args:
+            key (tuple): the scheme, host, and port of the connection
+            connection (HTTPConnection): the connection
+
+        Returns:
+
+        '''
+        with self.lock:
+            idle_connections = self.idle_connections[key]
+            if len(idle_connections) < self.pool_size:
+                idle_connections.append(connection)
+                return
+        connection.close()
+
+    def _open(self, url, headers):
+        '''
+        Send a GET request on a pooled connection
+
+        An idle connection may have been closed by the server in the meantime, so a failed
+        request on a reused connection is sent again on another one.
+
+        Args:
+            url (str): the url to retrieve
+            headers (dict): the headers to send
+
+        Returns:
+            PooledResponse: the response
+
+        Raises:
+            URLError: the request could not be sent or no response was received
+        '''
+        scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+        default_port = 443 if scheme == 'https' else 80
+        host, _, port = netloc.partition(':')
+        key = (scheme, host, int(port or default_port))
+        request_path = (path or '/') + ('?' + query if query else '')
+
+        while True:
+            connection, is_reused = self._get_connection(key)
+            try:
+                connection.request('GET', request_path, headers=headers)
+                response = connection.getresponse()
+                return PooledResponse(self, key, connection, response, url)
+            except (httplib.HTTPException, socket.error) as error:
+                connection.close()
+                if not is_reused:
+                    raise urllib2.URLError(error)
+
+    def urlopen(self, url, headers=None):
+        '''
+        Retrieve the given url, following redirects
+
+        Behaves like urllib2.urlopen: error statuses raise HTTPError and failed connections
+        raise URLError.
+
+        Args:
+            url (str): the url to retrieve
+            headers (dict, optional): the headers to send, defaults to None
+
+        Returns:
+            PooledResponse: the response, its body is read with read()
+
+        Raises:
+            HTTPError: the server responded with an error status
+            URLError: the url could not be retrieved
+        '''
+        for _ in xrange(self.max_redirects + 1):
+            response = self._open(url, headers or {})
+            location = response.response.getheader('location')
+            if response.code in _REDIRECT_CODES and location:
+                response.read()
+                url = urlparse.urljoin(url, location)
+                continue
+            if response.code >= 400:
+                response.close()
+                raise urllib2.HTTPError(url, response.code, response.reason, response.headers, None)
+            return response
+        response.close()
+        raise urllib2.HTTPError(url, response.code, 'Too many redirects', response.headers, None)
@@ -22,3 +22,54 @@ def assure_directory_path_exists(directory_path):
     except OSError as exception:
         if exception.errno != errno.EEXIST:
             raise
+
+def get_part_filename(filename):
+    '''
+    Get the path of the part file for the given path
+
+    The part file holds the content of a file while it is being written, next to it
+    so that it is on the same filesystem.
+
+    Args:
+        filename (str): the path of the complete file
+
+    Returns:
+        str: the path of the part file
+    '''
+    return filename + '.part'
+
+def commit_part_file(filename):
+    '''
+    Replace the given path with its part file
+
+    Rename the part file to the given path.  The rename is atomic, so the path either
+    holds its previous content or the complete new content, never a partial file.
+
+    Args:
+        filename (str): the path of the complete file
+
+    Returns:
+
+    Raises:
+        OSError: the part file does not exist or could not be renamed
+    '''
+    os.rename(get_part_filename(filename), filename)
+
+def remove_if_exists(filename):
+    '''
+    Remove the given file, ignoring the error if it does not exist
+
+    Args:
+        filename (str): the path of the file to remove
+
+    Returns:
+
+    Raises:
+        OSError: Exception preventing the removal of the file ignoring the error
+            if the file does not exist
+    '''
+    try:
+        os.remove(filename)
+    except OSError as exception:
+        if exception.errno != errno.ENOENT:
+            raise
@@ -0,0 +1,202 @@
+import hashlib
+import os
+import re
+import sqlite3
+import thread
+import threading
+import time
+
+from lib.utils import file_tools
+
+_1MB = 1024 * 1024
+_DAY = 24 * 60 * 60
+
+DEFAULT_TTLS = {'homepage': 0,
+                'listing': 0,
+                'book': 30 * _DAY}
+
+_URL_CLASSES = [('homepage', re.compile(r'^https?://[^/]+/?$')),
+                ('listing', re.compile(r'^https?://[^/]+/page/\d+/?$'))]
+
+def classify_url(url):
+    '''
+    Get the class of the given url
+
+    Args:
+        url (str): the url to classify
+
+    Returns:
+        str: 'homepage', 'listing', or 'book'
+    '''
+    for url_class, url_pattern in _URL_CLASSES:
+        if url_pattern.match(url):
+            return url_class
+    return 'book'
+
+class HTTPCache(object):
+
+    def __init__(self, directory, max_size=256 * _1MB, ttls=None):
+        '''
+        An on-disk cache of page sources
+
+        Keep the source of every page retrieved along with its ETag and Last-Modified
+        validators.  A page younger than the ttl of its url class is served straight
+        from the cache, an older one is revalidated with a conditional request.  The
+        least recently used pages are evicted once the cache grows over max_size, as told by
+        a running total of the sizes stored, summed again from the index only before evicting
+        (other processes may share the directory).
+
+        Args:
+            directory (str): the directory to keep the cache in
+            max_size (int, optional): maximum total size of the cached pages in bytes,
+                defaults to 256 MB
+            ttls (dict, optional): seconds a page is served without revalidation, per url
+                class ('homepage', 'listing', 'book'), defaults to DEFAULT_TTLS
+
+        Returns:
+            HTTPCache: an instance of the class
+        '''
+        self.directory = directory
+        self.max_size = max_size
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.stats = {'fresh_hits': 0, 'revalidated': 0, 'misses': 0}
+        self.lock = threading.Lock()
+
+        file_tools.assure_directory_path_exists(directory)
+        self.database = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        with self.database:
+            self.database.execute('CREATE TABLE IF NOT EXISTS pages ('
+                                  'url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, '
+                                  'stored_at REAL, accessed_at REAL, size INTEGER)')
+            self.database.execute('CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)')
+        self.total_size = self._get_total_size()
+
+    def _get_total_size(self):
+        return self.database.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+
+    def _get_filename(self, url):
+        digest = hashlib.sha1(url).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def lookup(self, url):
+        '''
+        Look up the cached source of the given url
+
+        Args:
+            url (str): the url of the page
+
+        Returns:
+            tuple: the source of the page, whether it is still fresh or not, and the request
+                headers needed to revalidate it
+            None: if the page is not cached
+        '''
+        with self.lock:
+            row = self.database.execute('SELECT etag, last_modified, stored_at FROM pages WHERE url = ?',
+                                        (url,)).fetchone()
+        if row is None:
+            self._count('misses')
+            return None
+        etag, last_modified, stored_at = row
+        try:
+            with open(self._get_filename(url), 'rb') as page_file:
+                page_content = page_file.read()
+        except IOError:
+            self._count('misses')
+            return None
+
+        is_fresh = time.time() - stored_at < self.ttls[classify_url(url)]
+        if is_fresh:
+            self._count('fresh_hits')
+            self._touch(url, refresh=False)
+        revalidation_headers = {}
+        if etag:
+            revalidation_headers['If-None-Match'] = etag
+        if last_modified:
+            revalidation_headers['If-Modified-Since'] = last_modified
+        return page_content, is_fresh, revalidation_headers
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _touch(self, url, refresh):
+        now = time.time()
+        with self.lock, self.database:
+            if refresh:
+                self.database.execute('UPDATE pages SET accessed_at = ?, stored_at = ? WHERE url = ?',
+                                      (now, now, url))
+            else:
+                self.database.execute('UPDATE pages SET accessed_at = ? WHERE url = ?', (now, url))
+
+    def revalidated(self, url):
+        '''
+        Mark the cached source of the given url as fresh again after a 304 response
+
+        Args:
+            url (str): the url of the page
+
+        Returns:
+
+        '''
+        self._count('revalidated')
+        self._touch(url, refresh=True)
+
+    def store(self, url, page_content, etag=None, last_modified=None):
+        '''
+        Cache the source of the given url, then evict pages if the cache is too large
+
+        The source is written to a temporary file unique to the process and thread, then
+        renamed over the cached file, so concurrent stores of the same url do not mix.
+
+        Args:
+            url (str): the url of the page
+            page_content (str): the source of the page
+            etag (str, optional): value of the ETag header, defaults to None
+            last_modified (str, optional): value of the Last-Modified header, defaults to None
+
+        Returns:
+
+        '''
+        filename = self._get_filename(url)
+        file_tools.assure_directory_path_exists(os.path.dirname(filename))
+        temporary_filename = '{0}.{1}.{2}.part'.format(filename, os.getpid(), thread.get_ident())
+        try:
+            with open(temporary_filename, 'wb') as page_file:
+                page_file.write(page_content)
+            os.rename(temporary_filename, filename)
+        except (IOError, OSError):
+            file_tools.remove_if_exists(temporary_filename)
+            raise
+
+        now = time.time()
+        with self.lock, self.database:
+            row = self.database.execute('SELECT size FROM pages WHERE url = ?', (url,)).fetchone()
+            self.database.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)',
+                                  (url, etag, last_modified, now, now, len(page_content)))
+            self.total_size += len(page_content) - (row[0] if row is not None else 0)
+            is_too_large = self.total_size > self.max_size
+        if is_too_large:
+            self._evict()
+
+    def _evict(self):
+        '''
+        Remove the least recently used pages until the cache fits in max_size
+
+        Args:
+
+        Returns:
+
+        '''
+        with self.lock, self.database:
+            total_size = self._get_total_size()
+            evicted_urls = []
+            if total_size > self.max_size:
+                for url, size in self.database.execute('SELECT url, size FROM pages ORDER BY accessed_at'):
+                    if total_size <= self.max_size:
+                        break
+                    evicted_urls.append(url)
+                    total_size -= size
+                self.database.executemany('DELETE FROM pages WHERE url = ?', ((url,) for url in evicted_urls))
+            self.total_size = total_size
+        for url in evicted_urls:
+            file_tools.remove_if_exists(self._get_filename(url))
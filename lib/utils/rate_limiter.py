@@ -0,0 +1,245 @@
+import email.utils
+import threading
+import time
+
+_CONGESTION_STATUSES = (429, 503, 'error')
+
+def parse_retry_after(value):
+    '''
+    Get the number of seconds to wait from a Retry-After header
+
+    Args:
+        value (str): value of the header, either seconds or an HTTP date
+
+    Returns:
+        float: seconds to wait, None if the value is missing or invalid
+    '''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    parsed_date = email.utils.parsedate_tz(value)
+    if parsed_date is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed_date) - time.time())
+
+class HostRateLimiter(object):
+
+    def __init__(self, concurrency=4, min_concurrency=1, max_concurrency=64, rate=10.0, min_rate=0.5,
+                 max_rate=100.0, latency_tolerance=1.5, min_latency_increase=0.05):
+        '''
+        Limit the requests to one host, adapting to how the host responds
+
+        Requests start at most rate times per second (a token bucket) and at most
+        concurrency of them run at once.  Both limits grow additively while the latency
+        stays flat and shrink multiplicatively on 429/503 responses, connection errors, or
+        rising latency (AIMD), at most once per cooldown so one burst of errors does not
+        collapse them.  A Retry-After pauses the host altogether.
+
+        Args:
+            concurrency (int, optional): initial maximum requests running at once, defaults to 4
+            min_concurrency (int, optional): lowest the concurrency can go, defaults to 1
+            max_concurrency (int, optional): highest the concurrency can go, defaults to 64
+            rate (float, optional): initial maximum requests started per second, defaults to 10
+            min_rate (float, optional): lowest the rate can go, defaults to 0.5
+            max_rate (float, optional): highest the rate can go, defaults to 100
+            latency_tolerance (float, optional): latency above the baseline times this counts
+                as rising, defaults to 1.5
+            min_latency_increase (float, optional): seconds the latency must also be above the
+                baseline to count as rising, defaults to 0.05
+
+        Returns:
+            HostRateLimiter: an instance of the class
+        '''
+        self.concurrency_limit = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.latency_tolerance = latency_tolerance
+        self.min_latency_increase = min_latency_increase
+
+        self.condition = threading.Condition()
+        self.tokens = 1.0
+        self.last_refill = time.time()
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.paused_until = 0
+        self.last_decrease = 0
+
+    def _refill(self, now):
+        capacity = max(1.0, self.concurrency_limit)
+        self.tokens = min(capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def _try_acquire(self, now):
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        elif self.in_flight >= int(self.concurrency_limit):
+            return 1.0
+        elif self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        self.tokens -= 1
+        self.in_flight += 1
+        return 0
+
+    def acquire(self):
+        '''
+        Wait until a request to the host can start
+
+        Args:
+
+        Returns:
+
+        '''
+        with self.condition:
+            wait_time = self._try_acquire(time.time())
+            while wait_time:
+                self.condition.wait(wait_time)
+                wait_time = self._try_acquire(time.time())
+
+    def try_acquire(self):
+        '''
+        Start a request to the host if it can start now, without waiting
+
+        A request that starts must be reported done with release, like after acquire.
+
+        Args:
+
+        Returns:
+            float: 0 if the request can start, otherwise the seconds to wait before trying
+                again (at most until a running request is released)
+        '''
+        with self.condition:
+            return self._try_acquire(time.time())
+
+    def release(self, latency, status=None, retry_after=None):
+        '''
+        Report that a request to the host is done and adapt the limits
+
+        Args:
+            latency (float): seconds until the response headers arrived
+            status (int or str, optional): the error status of the response, 'error' for a
+                failed connection, defaults to None (success)
+            retry_after (float, optional): seconds the host asked to wait, defaults to None
+
+        Returns:
+
+        '''
+        with self.condition:
+            self.in_flight -= 1
+            now = time.time()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if status in _CONGESTION_STATUSES:
+                self._decrease(now, 0.5)
+            elif status is None:
+                self._on_success(now, latency)
+            self.condition.notify_all()
+
+    def _on_success(self, now, latency):
+        '''
+        Track the latency and grow the limits if it is flat, shrink them if it is rising
+
+        Args:
+            now (float): the current time
+            latency (float): seconds until the response headers arrived
+
+        Returns:
+
+        '''
+        self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+        if self.baseline_latency is None or latency < self.baseline_latency:
+            self.baseline_latency = latency
+        else:
+            self.baseline_latency += 0.01 * (latency - self.baseline_latency)
+
+        is_latency_rising = (self.latency > self.baseline_latency * self.latency_tolerance and
+                             self.latency - self.baseline_latency > self.min_latency_increase)
+        if is_latency_rising:
+            self._decrease(now, 0.8)
+        else:
+            self.concurrency_limit = min(self.max_concurrency, self.concurrency_limit + 1.0 / self.concurrency_limit)
+            self.rate = min(self.max_rate, self.rate + 1.0 / self.concurrency_limit)
+
+    def _decrease(self, now, factor):
+        '''
+        Shrink the limits by the given factor, unless they were shrunk very recently
+
+        Args:
+            now (float): the current time
+            factor (float): what to multiply the limits by
+
+        Returns:
+
+        '''
+        cooldown = max(1.0, 2 * (self.latency or 0))
+        if now - self.last_decrease < cooldown:
+            return
+        self.last_decrease = now
+        self.concurrency_limit = max(self.min_concurrency, self.concurrency_limit * factor)
+        self.rate = max(self.min_rate, self.rate * factor)
+
+    def get_limits(self):
+        '''
+        Get the current limits and measurements of the host
+
+        Args:
+
+        Returns:
+            dict: concurrency_limit, in_flight, rate, latency, and baseline_latency
+        '''
+        with self.condition:
+            return {'concurrency_limit': int(self.concurrency_limit),
+                    'in_flight': self.in_flight,
+                    'rate': round(self.rate, 2),
+                    'latency': self.latency,
+                    'baseline_latency': self.baseline_latency}
+
+class RateLimiter(object):
+
+    def __init__(self, **host_rate_limiter_options):
+        '''
+        A HostRateLimiter for every host, created on first use
+
+        Args:
+            **host_rate_limiter_options: the options every HostRateLimiter is created with
+
+        Returns:
+            RateLimiter: an instance of the class
+        '''
+        self.host_rate_limiter_options = host_rate_limiter_options
+        self.host_rate_limiters = {}
+        self.lock = threading.Lock()
+
+    def get(self, host):
+        '''
+        Get the limiter of the given host
+
+        Args:
+            host (str): the host name (and port)
+
+        Returns:
+            HostRateLimiter: the limiter of the host
+        '''
+        with self.lock:
+            if host not in self.host_rate_limiters:
+                self.host_rate_limiters[host] = HostRateLimiter(**self.host_rate_limiter_options)
+            return self.host_rate_limiters[host]
+
+    def get_limits(self):
+        '''
+        Get the current limits of every host
+
+        Args:
+
+        Returns:
+            dict: the limits of each host, as returned by HostRateLimiter.get_limits
+        '''
+        with self.lock:
+            host_rate_limiters = self.host_rate_limiters.items()
+        return dict((host, host_rate_limiter.get_limits()) for host, host_rate_limiter in host_rate_limiters)
@@ -0,0 +1,251 @@
+import random
+import threading
+import time
+import urllib2
+
+from lib.utils import rate_limiter
+
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+_HOST_FAILURE_STATUSES = (500, 502, 503, 504)
+
+class CircuitOpenError(urllib2.URLError):
+
+    def __init__(self, host, retry_in):
+        '''
+        Raised instead of sending a request to a host the circuit breaker considers down
+
+        Args:
+            host (str): the host name (and port)
+            retry_in (float): seconds until a request to the host is allowed again
+
+        Returns:
+            CircuitOpenError: an instance of the class
+        '''
+        urllib2.URLError.__init__(self, 'circuit open for {0}, retrying in {1:.0f}s'.format(host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+def is_transient(error):
+    '''
+    Check whether the request that failed with the given error is worth sending again
+
+    Connection errors and the statuses in RETRY_STATUSES are transient, other HTTP error
+    statuses are not.
+
+    Args:
+        error (URLError): the HTTPError or URLError raised by the request
+
+    Returns:
+        bool: whether the error is transient or not
+    '''
+    if isinstance(error, urllib2.HTTPError):
+        return error.code in RETRY_STATUSES
+    return True
+
+def _is_host_failure(error):
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, urllib2.HTTPError):
+        return error.code in _HOST_FAILURE_STATUSES
+    return True
+
+class CircuitBreaker(object):
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        '''
+        Stop sending requests to hosts that keep failing
+
+        Once failure_threshold requests in a row to a host fail with a connection error or a
+        5xx status, the circuit of the host opens and requests to it raise CircuitOpenError
+        without being sent.  After reset_timeout seconds a single request is let through: if
+        it succeeds the circuit closes, otherwise it stays open for another reset_timeout.
+
+        Args:
+            failure_threshold (int, optional): failures in a row opening the circuit, defaults
+                to 5
+            reset_timeout (int, optional): seconds the circuit stays open, defaults to 30
+
+        Returns:
+            CircuitBreaker: an instance of the class
+        '''
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def before_request(self, host):
+        '''
+        Check that a request to the given host can be sent
+
+        Args:
+            host (str): the host name (and port)
+
+        Returns:
+
+        Raises:
+            CircuitOpenError: the circuit of the host is open
+        '''
+        with self.lock:
+            state = self.hosts.get(host)
+            if state is None or state['opened_at'] is None:
+                return
+            now = time.time()
+            retry_in = state['opened_at'] + self.reset_timeout - now
+            if retry_in > 0:
+                raise CircuitOpenError(host, retry_in)
+            state['opened_at'] = now
+
+    def record_success(self, host):
+        '''
+        Close the circuit of the given host
+
+        Args:
+            host (str): the host name (and port)
+
+        Returns:
+
+        '''
+        with self.lock:
+            self.hosts.pop(host, None)
+
+    def record_failure(self, host):
+        '''
+        Count a failure of the given host, opening its circuit once there are too many
+
+        Args:
+            host (str): the host name (and port)
+
+        Returns:
+
+        '''
+        with self.lock:
+            state = self.hosts.setdefault(host, {'failures': 0, 'opened_at': None})
+            state['failures'] += 1
+            if state['failures'] >= self.failure_threshold:
+                state['opened_at'] = time.time()
+
+    def get_open_circuits(self):
+        '''
+        Get the hosts whose circuit is open
+
+        Args:
+
+        Returns:
+            dict: the number of failures in a row of each host whose circuit is open
+        '''
+        with self.lock:
+            return dict((host, state['failures']) for host, state in self.hosts.items()
+                        if state['opened_at'] is not None)
+
+class RetryPolicy(object):
+
+    def __init__(self, attempts=6, backoff=1.0, max_backoff=60.0, max_retry_after=300.0, circuit_breaker=None):
+        '''
+        Send requests again when they fail with transient errors
+
+        The n-th retry waits a random time between half and all of backoff * 2 ** n seconds
+        (capped at max_backoff), or as long as the host asked with Retry-After if that is
+        longer (capped at max_retry_after).  Requests to a host whose circuit is open wait
+        until the circuit lets one through.
+
+        Args:
+            attempts (int, optional): times a request is sent at most, defaults to 6
+            backoff (float, optional): seconds waited before the first retry, defaults to 1
+            max_backoff (float, optional): maximum seconds waited between retries, defaults
+                to 60
+            max_retry_after (float, optional): maximum seconds waited for a Retry-After,
+                defaults to 300
+            circuit_breaker (CircuitBreaker, optional): the circuit breaker of the hosts,
+                defaults to None (a new CircuitBreaker)
+
+        Returns:
+            RetryPolicy: an instance of the class
+        '''
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+
+    def get_delay(self, retry, error):
+        '''
+        Get the seconds to wait before the given retry
+
+        Args:
+            retry (int): the number of the retry, starting at 0
+            error (URLError): the error the last attempt failed with
+
+        Returns:
+            float: the seconds to wait
+        '''
+        delay = min(self.max_backoff, self.backoff * 2 ** retry)
+        delay = random.uniform(delay / 2, delay)
+        if isinstance(error, CircuitOpenError):
+            delay = max(delay, error.retry_in)
+        elif isinstance(error, urllib2.HTTPError) and error.hdrs:
+            retry_after = rate_limiter.parse_retry_after(error.hdrs.get('retry-after'))
+            if retry_after is not None:
+                delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+    def record_attempt(self, host, error=None):
+        '''
+        Report the outcome of a request to the circuit breaker
+
+        Args:
+            host (str): the host name (and port) the request was sent to
+            error (URLError, optional): the error the request failed with, defaults to None
+                (success)
+
+        Returns:
+
+        '''
+        if error is None:
+            self.circuit_breaker.record_success(host)
+        elif _is_host_failure(error):
+            self.circuit_breaker.record_failure(host)
+        elif not isinstance(error, CircuitOpenError):
+            self.circuit_breaker.record_success(host)
+
+    def should_retry(self, retry, error):
+        '''
+        Check whether a request that failed with the given error is sent again
+
+        Args:
+            retry (int): the number of the retry that would follow, starting at 0
+            error (URLError): the error the last attempt failed with
+
+        Returns:
+            bool: whether the error is transient and attempts are left or not
+        '''
+        return is_transient(error) and retry < self.attempts - 1
+
+    def call(self, host, function, *args, **kwargs):
+        '''
+        Call the given function, calling it again while it fails with transient errors
+
+        Args:
+            host (str): the host name (and port) the function sends its requests to
+            function (function): the function sending the request
+            *args: the arguments of the function
+            **kwargs: the keyword arguments of the function
+
+        Returns:
+            object: the value returned by the function
+
+        Raises:
+            URLError: the last error if every attempt failed, or the first error that is not
+                transient
+        '''
+        for retry in xrange(self.attempts):
+            try:
+                self.circuit_breaker.before_request(host)
+                result = function(*args, **kwargs)
+            except urllib2.URLError as error:
+                self.record_attempt(host, error)
+                if not self.should_retry(retry, error):
+                    raise
+                time.sleep(self.get_delay(retry, error))
+            else:
+                self.record_attempt(host)
+                return result
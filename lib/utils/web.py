@@ -1,15 +1,362 @@
-import bs4
+import json
+import os
+import threading
+import time
 import urllib2
+import urlparse
+import zlib
+
+import bs4
 
+from lib.FileWriter import FileWriter
 from lib.Logging import Logger
+from lib.Metrics import Metrics
+from lib.utils import connection_pool
+from lib.utils import file_tools
+from lib.utils import http_cache
+from lib.utils import rate_limiter
+from lib.utils import retry
+
+web_logger = Logger.Logger('web.log', structured=True)
+_connection_pool = connection_pool.ConnectionPool()
+_http_cache = None
+_rate_limiter = rate_limiter.RateLimiter()
+_retry_policy = retry.RetryPolicy()
+_transfer_stats = {'responses': 0, 'received_bytes': 0, 'decoded_bytes': 0, 'decompression_time': 0.0}
+_transfer_stats_lock = threading.Lock()
+
+_1KB = 1024
+_16KB = 16 * _1KB
+_64KB = 64 * _1KB
+_1MB = 1024 * _1KB
+
+def configure_connection_pool(pool_size=4, timeout=60, dns_cache_ttl=300, host_overrides=None):
+    '''
+    Replace the pool of connections used by every request
+
+    Args:
+        pool_size (int, optional): maximum idle connections kept per host, defaults to 4
+        timeout (int, optional): socket timeout in seconds, defaults to 60
+        dns_cache_ttl (int, optional): seconds a host name lookup is kept for, defaults to 300
+        host_overrides (dict, optional): the address and port to connect to for some host
+            names instead of resolving them, defaults to None
+
+    Returns:
+
+    '''
+    global _connection_pool
+    _connection_pool = connection_pool.ConnectionPool(pool_size, timeout, dns_cache_ttl,
+                                                      host_overrides=dict(host_overrides or {}))
+
+def get_dns_cache():
+    '''
+    Get the cache of host name lookups shared by every request
+
+    Args:
+
+    Returns:
+        DNSCache: the cache of the connection pool set by configure_connection_pool, which
+            also applies its host overrides
+    '''
+    return _connection_pool.dns_cache
+
+def enable_http_cache(directory, max_size=256 * _1MB, ttls=None):
+    '''
+    Cache the page sources retrieved by get_source on disk
+
+    Args:
+        directory (str): the directory to keep the cache in
+        max_size (int, optional): maximum total size of the cached pages in bytes, defaults
+            to 256 MB
+        ttls (dict, optional): seconds a page is served without revalidation, per url class
+            ('homepage', 'listing', 'book'), defaults to http_cache.DEFAULT_TTLS
+
+    Returns:
+        HTTPCache: the cache
+    '''
+    global _http_cache
+    _http_cache = http_cache.HTTPCache(directory, max_size, ttls)
+    return _http_cache
+
+def get_http_cache():
+    '''
+    Get the on-disk cache of page sources
+
+    Args:
+
+    Returns:
+        HTTPCache: the cache set by enable_http_cache, None if it is not enabled
+    '''
+    return _http_cache
+
+def configure_rate_limiter(**host_rate_limiter_options):
+    '''
+    Replace the limiter of the requests to every host
+
+    Args:
+        **host_rate_limiter_options: the options of rate_limiter.HostRateLimiter, such as
+            concurrency, max_concurrency, rate, and max_rate
+
+    Returns:
+
+    '''
+    global _rate_limiter
+    _rate_limiter = rate_limiter.RateLimiter(**host_rate_limiter_options)
+
+def get_rate_limits():
+    '''
+    Get the limits the requests to each host currently run under
+
+    Args:
+
+    Returns:
+        dict: concurrency_limit, in_flight, rate, latency, and baseline_latency per host
+    '''
+    return _rate_limiter.get_limits()
+
+def get_rate_limiter():
+    '''
+    Get the limiter of the requests to every host
+
+    Args:
+
+    Returns:
+        RateLimiter: the limiter set by configure_rate_limiter
+    '''
+    return _rate_limiter
+
+def configure_retry_policy(attempts=6, backoff=1.0, max_backoff=60.0, failure_threshold=5, reset_timeout=30):
+    '''
+    Replace the policy retrying the requests that fail with transient errors
+
+    Args:
+        attempts (int, optional): times a request is sent at most, defaults to 6
+        backoff (float, optional): seconds waited before the first retry, defaults to 1
+        max_backoff (float, optional): maximum seconds waited between retries, defaults to 60
+        failure_threshold (int, optional): failures in a row stopping the requests to a host,
+            defaults to 5
+        reset_timeout (int, optional): seconds the requests to such a host stay stopped,
+            defaults to 30
+
+    Returns:
+
+    '''
+    global _retry_policy
+    _retry_policy = retry.RetryPolicy(attempts, backoff, max_backoff,
+                                      circuit_breaker=retry.CircuitBreaker(failure_threshold, reset_timeout))
+
+def get_retry_policy():
+    '''
+    Get the policy retrying the requests that fail with transient errors
+
+    Args:
+
+    Returns:
+        RetryPolicy: the policy set by configure_retry_policy
+    '''
+    return _retry_policy
+
+def get_host(link):
+    '''
+    Get the host name (and port) of the given link, as the retry policy and rate limiter
+    know it
+
+    Args:
+        link (str): the url
+
+    Returns:
+        str: the host name (and port)
+    '''
+    return urlparse.urlsplit(link).netloc
+
+def _urlopen(link, headers=None):
+    '''
+    Retrieve the given url through the connection pool, within the limits of its host
+
+    The request waits for the rate limiter of the host and holds one of its slots until
+    the body is read or the response is closed.  The time until the headers arrive and
+    the status of the response adapt the limits of the host, and are recorded in the
+    metrics along with the bytes received.
+
+    Args:
+        link (str): the url to retrieve
+        headers (dict, optional): the headers to send, defaults to None
+
+    Returns:
+        PooledResponse: the response
+
+    Raises:
+        HTTPError: the server responded with an error status
+        URLError: the url could not be retrieved
+    '''
+    host = get_host(link)
+    host_rate_limiter = _rate_limiter.get(host)
+    host_rate_limiter.acquire()
+    start_time = time.time()
+    try:
+        connection = _connection_pool.urlopen(link, headers=headers)
+    except urllib2.HTTPError as http_error:
+        latency = time.time() - start_time
+        retry_after = rate_limiter.parse_retry_after(http_error.hdrs.getheader('retry-after')) \
+            if http_error.hdrs else None
+        host_rate_limiter.release(latency, http_error.code, retry_after)
+        record_response(host, http_error.code, latency)
+        raise
+    except urllib2.URLError:
+        latency = time.time() - start_time
+        host_rate_limiter.release(latency, 'error')
+        record_response(host, 'error', latency)
+        raise
+    latency = time.time() - start_time
+    record_response(host, connection.code, latency)
+
+    def on_done():
+        host_rate_limiter.release(latency)
+        Metrics.metrics.increment('http_received_bytes_total', connection.received_bytes, host=host)
+        web_logger.log_event('response', 'DEBUG', url=link, status=connection.code,
+                             bytes=connection.received_bytes, duration=time.time() - start_time)
+
+    connection.add_done_callback(on_done)
+    return connection
+
+def record_response(host, status, latency):
+    '''
+    Record a response, or a failed connection, in the metrics
+
+    Args:
+        host (str): the host name (and port) the request was sent to
+        status (int or str): the status of the response, 'error' for a failed connection
+        latency (float): seconds until the response headers arrived, or the connection failed
+
+    Returns:
+
+    '''
+    Metrics.metrics.increment('http_responses_total', host=host, status=status)
+    Metrics.metrics.observe('http_response_seconds', latency, host=host)
+    if status == 'error' or status >= 400:
+        Metrics.metrics.increment('http_errors_total', host=host, status=status)
+
+def get_transfer_stats():
+    '''
+    Get the size and decompression numbers of the pages retrieved so far
+
+    received_bytes is what was transferred, decoded_bytes what it decompressed to, and
+    decompression_time the seconds spent decompressing, over every get_source call.
+
+    Args:
+
+    Returns:
+        dict: responses, received_bytes, decoded_bytes, and decompression_time
+    '''
+    with _transfer_stats_lock:
+        return dict(_transfer_stats)
+
+def _record_transfer(received_bytes, decoded_bytes, decompression_time):
+    with _transfer_stats_lock:
+        _transfer_stats['responses'] += 1
+        _transfer_stats['received_bytes'] += received_bytes
+        _transfer_stats['decoded_bytes'] += decoded_bytes
+        _transfer_stats['decompression_time'] += decompression_time
+
+def _create_decompressor(content_encoding):
+    '''
+    Create a decompressor for the given Content-Encoding
+
+    Args:
+        content_encoding (str): value of the Content-Encoding header
+
+    Returns:
+        zlib.Decompress: the decompressor, None if the content is not compressed
+    '''
+    if content_encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif content_encoding == 'deflate':
+        return zlib.decompressobj()
+    return None
+
+def _iter_decoded_chunks(connection, CHUNK_SIZE=_64KB):
+    '''
+    Read the body of a response in chunks, decompressing them as they arrive
+
+    gzip and deflate bodies are decompressed one chunk at a time.  Some servers send
+    deflate without the zlib header, in which case the raw stream is decoded instead.
+    The sizes and time spent are added to the transfer stats once the body is read.
+
+    Args:
+        connection (PooledResponse): the response to read the body of
+        CHUNK_SIZE (int, optional): size of each data chunk, defaults to 64 KB
+
+    Returns:
+        generator: the decoded chunks of the body
+    '''
+    content_encoding = (connection.info().getheader('content-encoding') or '').strip().lower()
+    decompressor = _create_decompressor(content_encoding)
+    received_bytes = decoded_bytes = 0
+    decompression_time = 0.0
+    try:
+        while True:
+            chunk = connection.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            received_bytes += len(chunk)
+            if decompressor is not None:
+                start_time = time.time()
+                try:
+                    chunk = decompressor.decompress(chunk)
+                except zlib.error:
+                    if content_encoding != 'deflate' or received_bytes != len(chunk):
+                        raise
+                    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+                    chunk = decompressor.decompress(chunk)
+                decompression_time += time.time() - start_time
+            decoded_bytes += len(chunk)
+            yield chunk
+        if decompressor is not None:
+            chunk = decompressor.flush()
+            decoded_bytes += len(chunk)
+            yield chunk
+    finally:
+        connection.close()
+        _record_transfer(received_bytes, decoded_bytes, decompression_time)
+
+def _retrieve_source(link, headers, cached_page_content):
+    '''
+    Send the request for a page source and read the response
+
+    Args:
+        link (str): the properly encoded url to retrieve the source for
+        headers (dict): the headers to send
+        cached_page_content (str): the cached source of the page, None if it is not cached
+
+    Returns:
+        str: the source of the page
+
+    Raises:
+        HTTPError: the server responded with an error status
+        URLError: the source could not be retrieved
+    '''
+    connection = _urlopen(link, headers=headers)
+    if cached_page_content is not None and connection.code == 304:
+        connection.read()
+        _http_cache.revalidated(link)
+        return cached_page_content
 
-web_logger = Logger.Logger('web.log')
+    page_content = ''.join(_iter_decoded_chunks(connection))
+    if _http_cache is not None:
+        response_headers = connection.info()
+        _http_cache.store(link, page_content,
+                          response_headers.getheader('etag'), response_headers.getheader('last-modified'))
+    return page_content
 
 def get_source(link, bs4_format=False):
     '''
     Retrieve the page source
 
-    Retrieve the source of the given link as a BeautifulSoup object or simple text.
+    Retrieve the source of the given link as a BeautifulSoup object or simple text,
+    reusing a pooled connection to the host if there is one.  gzip and deflate are
+    accepted and decoded as the body arrives.  If the http cache is enabled, a fresh
+    cached page is returned without any request and a stale one is revalidated.  Requests
+    failing with transient errors are retried following the retry policy.
 
     Args:
         link (str): the url to retrieve the source for
@@ -19,24 +366,116 @@ def get_source(link, bs4_format=False):
     Returns:
         BeautifulSoup: the source of the page if bs4_format is True
         str: the source of the page if bs4_format is False
+
+    Raises:
+        HTTPError: the server responded with an error status
+        URLError: the source could not be retrieved, even after retrying
     '''
     proper_encoded_link = link.replace(' ', '%20')
-    request = urllib2.Request(proper_encoded_link, headers={'User-Agent': 'Mozilla/5.0'})
-    connection = urllib2.urlopen(request)
-    page_content = connection.read()
+    headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip, deflate'}
+    cached_page = _http_cache.lookup(proper_encoded_link) if _http_cache is not None else None
+    if cached_page is None:
+        page_content = _retry_policy.call(get_host(proper_encoded_link), _retrieve_source,
+                                          proper_encoded_link, headers, None)
+    else:
+        page_content, is_fresh, revalidation_headers = cached_page
+        if not is_fresh:
+            headers.update(revalidation_headers)
+            page_content = _retry_policy.call(get_host(proper_encoded_link), _retrieve_source,
+                                              proper_encoded_link, headers, page_content)
     if bs4_format:
         return bs4.BeautifulSoup(page_content, 'html.parser')
     else:
         return page_content
 
-_1KB = 1024
-_1MB = 1024 * _1KB
+def iter_source(link, CHUNK_SIZE=_16KB):
+    '''
+    Retrieve the page source one chunk at a time
+
+    Chunks are decoded as they arrive, so the caller can stop as soon as it found what it
+    was looking for.  Closing the generator before the end closes the connection and the
+    rest of the page is never read.  Opening the connection is retried following the retry
+    policy.  If the http cache is enabled, the page is retrieved whole with get_source and
+    given as a single chunk, since partial pages cannot be cached.
+
+    Args:
+        link (str): the url to retrieve the source for
+        CHUNK_SIZE (int, optional): size of each data chunk, defaults to 16 KB
+
+    Returns:
+        generator: the chunks of the source of the page
+
+    Raises:
+        HTTPError: the server responded with an error status
+        URLError: the source could not be retrieved
+    '''
+    if _http_cache is not None:
+        yield get_source(link)
+        return
+
+    proper_encoded_link = link.replace(' ', '%20')
+    headers = {'User-Agent': 'Mozilla/5.0', 'Accept-Encoding': 'gzip, deflate'}
+    connection = _retry_policy.call(get_host(proper_encoded_link), _urlopen, proper_encoded_link, headers)
+    chunks = _iter_decoded_chunks(connection, CHUNK_SIZE)
+    try:
+        for chunk in chunks:
+            yield chunk
+    finally:
+        chunks.close()
+
+def log_download_error(error, download_link, stage='download'):
+    '''
+    Log the error that prevented a file from being downloaded
+
+    The error is logged as a 'request_failed' event with the url, the status (None for
+    connection errors), the reason, and the stage of the crawl.
+
+    Args:
+        error (URLError): the HTTPError or URLError raised while downloading
+        download_link (str): the url the file was downloaded from
+        stage (str, optional): the stage of the crawl the file was needed for, defaults to
+            'download'
+
+    Returns:
+
+    '''
+    status = error.code if isinstance(error, urllib2.HTTPError) else None
+    web_logger.log_event('request_failed', 'ERROR', url=download_link, status=status, reason=error.reason,
+                         stage=stage)
+
+def _download_content(download_link, CHUNK_SIZE):
+    '''
+    Send the request for a file and read it in chunks
+
+    Args:
+        download_link (str): the properly encoded url to retrieve the file from
+        CHUNK_SIZE (int): size of each data chunk
+
+    Returns:
+        str: content of the downloaded file
+
+    Raises:
+        HTTPError: the server responded with an error status
+        URLError: the download failed
+    '''
+    connection = _urlopen(download_link)
+    file_chunks = []
+    while True:
+        file_chunk = connection.read(CHUNK_SIZE)
+        if file_chunk:
+            file_chunks.append(file_chunk)
+        else:
+            break
+    return ''.join(file_chunks)
+
 def download_page(download_link, CHUNK_SIZE=_1MB):
     '''
     Download file
 
-    Download the file from the given download link in chunks.  In the case of
-    HTTPErrors or URLErrors, log the error and return None.
+    Download the file from the given download link in chunks, retrying transient errors
+    following the retry policy.  In the case of HTTPErrors or URLErrors, log the error
+    and return None.  The whole file is held
+    in memory, use download_file to write large files straight to disk.
 
     Args:
         download_link (str): the url to retrieve the file from
@@ -51,24 +490,260 @@ def download_page(download_link, CHUNK_SIZE=_1MB):
     '''
     try:
         proper_encoded_download_link = download_link.replace(' ', '%20')
-        request = urllib2.Request(proper_encoded_download_link)
-        connection = urllib2.urlopen(request)
-        file_content = ''
-        while True:
-            file_chunk = connection.read(CHUNK_SIZE)
-            if file_chunk:
-                file_content += file_chunk
-            else:
-                break
-        return file_content
-    except urllib2.HTTPError as http_error:
-        log_message = '{0}, {1}: {2}\n'.format(http_error.code, http_error.reason, download_link)
-        web_logger.log_error(log_message)
-        return None
+        return _retry_policy.call(get_host(proper_encoded_download_link), _download_content,
+                                  proper_encoded_download_link, CHUNK_SIZE)
     except urllib2.URLError as url_error:
-        log_message = '{0}: {1}\n'.format(url_error.reason, download_link)
-        web_logger.log_error(log_message)
+        log_download_error(url_error, download_link)
         return None
     except Exception as e:
         print 'Something is up...'
         raise
+
+def _get_resume_validator(headers):
+    '''
+    Get the validator to resume a download with from the response headers
+
+    Weak ETags cannot be used with If-Range, so fall back to Last-Modified for them.
+
+    Args:
+        headers (mimetools.Message or dict): the headers of the response, a dict having
+            lowercase keys
+
+    Returns:
+        str: the strong ETag or the Last-Modified date, None if there is neither
+    '''
+    etag = headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('last-modified')
+
+def _read_part_file_metadata(metadata_filename):
+    try:
+        with open(metadata_filename) as metadata_file:
+            return json.load(metadata_file)
+    except (IOError, ValueError):
+        return None
+
+def get_resume_headers(download_link, part_filename):
+    '''
+    Get the headers resuming a download from where the part file stops
+
+    The part file keeps the bytes received so far and its metadata file the url and the
+    validator of the response they came from.  If both are present, only the rest of the
+    file is requested with a Range header; If-Range makes the server send the whole file
+    again if it changed since.
+
+    Args:
+        download_link (str): the url to retrieve the file from
+        part_filename (str): the path of the part file
+
+    Returns:
+        tuple: the size of the part file to resume from (0 to download the whole file) and
+            the headers to send
+    '''
+    metadata = _read_part_file_metadata(part_filename + '.json')
+    if metadata and metadata.get('url') == download_link and metadata.get('validator') and \
+            os.path.exists(part_filename):
+        offset = os.path.getsize(part_filename)
+        return offset, {'Range': 'bytes={0}-'.format(offset), 'If-Range': metadata['validator']}
+    return 0, {}
+
+def is_part_file_complete(code, content_range, offset):
+    '''
+    Check whether a response to a resumed download tells that the part file is complete
+
+    Args:
+        code (int): the status of the response
+        content_range (str): the Content-Range header of the response
+        offset (int): the size of the part file the download was resumed from
+
+    Returns:
+        bool: whether the server refused the range because the file ends at offset
+    '''
+    return code == 416 and offset > 0 and content_range == 'bytes */{0}'.format(offset)
+
+def get_part_file_mode(code, content_range, offset):
+    '''
+    Get the mode to open the part file with for the response to a (resumed) download
+
+    Args:
+        code (int): the status of the response
+        content_range (str): the Content-Range header of the response
+        offset (int): the size of the part file the download was resumed from
+
+    Returns:
+        str: 'ab' if the response continues the part file, 'wb' if it holds the whole file,
+            None if it holds a range that does not continue the part file
+    '''
+    if code != 206:
+        return 'wb'
+    if (content_range or '').startswith('bytes {0}-'.format(offset)):
+        return 'ab'
+    return None
+
+def save_resume_validator(download_link, part_filename, headers):
+    '''
+    Keep the validator of the response the part file is written from in its metadata file
+
+    Without a validator, the metadata file is removed and the download cannot be resumed.
+
+    Args:
+        download_link (str): the url the file is retrieved from
+        part_filename (str): the path of the part file
+        headers (mimetools.Message or dict): the headers of the response, a dict having
+            lowercase keys
+
+    Returns:
+
+    '''
+    metadata_filename = part_filename + '.json'
+    validator = _get_resume_validator(headers)
+    if validator:
+        with open(metadata_filename, 'w') as metadata_file:
+            json.dump({'url': download_link, 'validator': validator}, metadata_file)
+    else:
+        file_tools.remove_if_exists(metadata_filename)
+
+def _get_total_size(connection, offset):
+    '''
+    Get the size of the whole file from the headers of a (partial) response
+
+    Args:
+        connection (PooledResponse): the response
+        offset (int): the position the response starts at
+
+    Returns:
+        int: the size in bytes, None if the headers do not tell
+    '''
+    content_range = connection.info().getheader('content-range') or ''
+    if '/' in content_range and content_range.rpartition('/')[2].isdigit():
+        return int(content_range.rpartition('/')[2])
+    content_length = connection.info().getheader('content-length')
+    if content_length and content_length.isdigit():
+        return offset + int(content_length)
+    return None
+
+def _download_part(download_link, part_filename, CHUNK_SIZE, content_digest=None):
+    '''
+    Download file to the part file, resuming from where a previous attempt stopped
+
+    See get_resume_headers for how the download is resumed.
+
+    Args:
+        download_link (str): the url to retrieve the file from
+        part_filename (str): the path of the part file
+        CHUNK_SIZE (int): size of each data chunk
+        content_digest (ContentDigest, optional): hashes the file as it is written,
+            defaults to None
+
+    Returns:
+
+    Raises:
+        HTTPError: the server responded with an error status
+        URLError: the download was interrupted
+    '''
+    offset, headers = get_resume_headers(download_link, part_filename)
+    proper_encoded_download_link = download_link.replace(' ', '%20')
+    try:
+        connection = _urlopen(proper_encoded_download_link, headers=headers)
+    except urllib2.HTTPError as http_error:
+        content_range = http_error.hdrs.getheader('content-range') if http_error.hdrs else None
+        if is_part_file_complete(http_error.code, content_range, offset):
+            if content_digest is not None:
+                content_digest.reset()
+                content_digest.update_from_file(part_filename)
+            return
+        raise
+
+    content_range = connection.info().getheader('content-range') or ''
+    mode = get_part_file_mode(connection.code, content_range, offset)
+    if mode is None:
+        connection.close()
+        file_tools.remove_if_exists(part_filename + '.json')
+        raise urllib2.URLError('unexpected Content-Range: {0}'.format(content_range))
+    save_resume_validator(download_link, part_filename, connection.info())
+
+    try:
+        if content_digest is not None:
+            content_digest.reset()
+            if mode == 'ab':
+                content_digest.update_from_file(part_filename)
+        with open(part_filename, mode) as part_file:
+            FileWriter.file_writer.preallocate(part_file, _get_total_size(connection, offset if mode == 'ab' else 0))
+            while True:
+                file_chunk = connection.read(CHUNK_SIZE)
+                if file_chunk:
+                    part_file.write(file_chunk)
+                    if content_digest is not None:
+                        content_digest.update(file_chunk)
+                else:
+                    break
+            FileWriter.file_writer.finish(part_file)
+    finally:
+        connection.close()
+
+def download_to_part_file(download_link, filename, CHUNK_SIZE=_1MB, content_digest=None):
+    '''
+    Download file to the part file of the given filename
+
+    Stream the file from the given download link to the part file next to filename one
+    chunk at a time, so that only one chunk is ever held in memory.  A download that is
+    interrupted keeps what it received in the part file and is resumed with a Range
+    request, right away following the retry policy, or on the next call for the same file
+    (even from another run).  In the case of HTTPErrors that are not transient, log the
+    error, remove the part file, and return None.  In the case of transient errors on
+    every attempt, log the error, keep the part file, and return None.  If a content
+    digest is given, it hashes the file as it streams.
+
+    Args:
+        download_link (str): the url to retrieve the file from
+        filename (str): the path the file will be committed to
+        CHUNK_SIZE (int, optional): size of each data chunk, defaults to 1 MB
+        content_digest (ContentDigest, optional): the digest of the file, defaults to None
+
+    Returns:
+        str: path of the part file holding the downloaded file
+        None: file was not downloaded due to HTTPError or URLError
+
+    Raises:
+        Exception: Something went terribly wrong...
+    '''
+    part_filename = file_tools.get_part_filename(filename)
+    metadata_filename = part_filename + '.json'
+    try:
+        try:
+            _retry_policy.call(get_host(download_link), _download_part, download_link, part_filename, CHUNK_SIZE,
+                               content_digest)
+            file_tools.remove_if_exists(metadata_filename)
+            return part_filename
+        except urllib2.URLError as url_error:
+            log_download_error(url_error, download_link)
+            if isinstance(url_error, urllib2.HTTPError) and not retry.is_transient(url_error):
+                file_tools.remove_if_exists(part_filename)
+                file_tools.remove_if_exists(metadata_filename)
+            return None
+    except Exception as e:
+        print 'Something is up...'
+        raise
+
+def download_file(download_link, filename, CHUNK_SIZE=_1MB):
+    '''
+    Download file straight to disk
+
+    Stream the file to a part file next to filename and rename it to filename once it
+    is complete, so that filename never holds a partial file.  The file is synced following
+    the fsync policy of the file writer.
+
+    Args:
+        download_link (str): the url to retrieve the file from
+        filename (str): the path to save the file to
+        CHUNK_SIZE (int, optional): size of each data chunk, defaults to 1 MB
+
+    Returns:
+        bool: whether the file was downloaded or not
+    '''
+    part_filename = download_to_part_file(download_link, filename, CHUNK_SIZE)
+    if part_filename is None:
+        return False
+    FileWriter.file_writer.commit(filename)
+    return True